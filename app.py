@@ -1,14 +1,19 @@
 import os
 import sys
-from flask import Flask, flash, jsonify, redirect, render_template, request, session, url_for
+import json
+import time
+_app_import_started = time.perf_counter()
+from flask import Flask, Response, flash, jsonify, redirect, render_template, request, session, stream_with_context, url_for
 from dotenv import load_dotenv
 from werkzeug.utils import secure_filename
-from services.document_processor import extract_text_from_document
+from services.document_processor import load_document
 from services.ai_analyzer import analyze_document_coverage, answer_question_with_rag, generate_policy_draft, identify_risks_for_control, get_iso_controls_from_db
+from services.ai_analyzer import stream_answer_question_with_rag, stream_policy_draft, stream_risks_for_control
 from services.vector_store_manager import create_vector_store
-# --- Importar Vertex AI para inicialización ---
-import vertexai
-import google.auth
+from services.analysis_jobs import get_analysis_job, get_or_create_analysis_job, resume_analysis_job, JOB_COMPLETED, JOB_FAILED
+from services.runtime import get_startup_report, record_startup_phase, warmup
+from services.chat_cache import get_chat_cache_stats
+from services.metrics import get_trace, render_prometheus, span, trace_analysis
 
 # Cargar variables de entorno desde .env
 load_dotenv()
@@ -28,32 +33,20 @@ if not google_creds_path or not os.path.exists(google_creds_path):
     print("="*80)
     sys.exit(1) # Detener la aplicación si la configuración es incorrecta
 
-# Verificación del ID de proyecto e inicialización de Vertex AI
+# Verificación del ID de proyecto. Vertex AI se inicializa de forma diferida
+# (services/runtime.py) la primera vez que se usa el LLM o al llamar a /warmup.
 if not project_id:
     print("="*80)
     print("ERROR FATAL: La variable de entorno 'GOOGLE_CLOUD_PROJECT' no está configurada.")
     print("Por favor, añade tu ID de proyecto de Google Cloud a tu fichero .env.")
     print("="*80)
     sys.exit(1) # Detener la aplicación
-else:
-    try:
-        # Inicializar Vertex AI con el proyecto y las credenciales encontradas.
-        # Esto configura la librería para todas las llamadas posteriores.
-        vertexai.init(project=project_id, location=location)
-        print(f"--- Vertex AI inicializado para el proyecto: {project_id} ---")
-    except google.auth.exceptions.DefaultCredentialsError as e:
-        print(f"ERROR FATAL: Error de credenciales de Google. Causa: {e}")
-        sys.exit(1)
-    except Exception as e:
-        print("="*80)
-        print(f"ERROR FATAL: No se pudo inicializar Vertex AI. Causa: {e}")
-        print("Verifica que el proyecto exista, que la facturación esté habilitada y que la cuenta de servicio tenga el rol 'Usuario de Vertex AI'.")
-        print("="*80)
-        sys.exit(1) # Detener la aplicación
 
 # --- Configuración ---
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'pdf', 'docx'}
+# Si está activo, la página de análisis se muestra al instante y el análisis se ejecuta en segundo plano
+BACKGROUND_ANALYSIS = os.getenv('ANALYSIS_BACKGROUND_JOBS', 'true').lower() in ('true', '1', 'yes')
 
 # Inicializar la aplicación Flask
 app = Flask(__name__)
@@ -86,7 +79,8 @@ def index():
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
             file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
+            with span("upload_save"):
+                file.save(file_path)
             # Redirigir a la página de selección de controles (simulación de SoA)
             return redirect(url_for('select_controls', filename=filename))
         else:
@@ -117,25 +111,41 @@ def select_controls(filename):
 @app.route('/analysis/<filename>')
 def analysis_page(filename):
     """Muestra el texto extraído del documento y prepara para el análisis."""
+    # En modo segundo plano la página solo se renderiza y la traza la abre el trabajo de análisis;
+    # así no se guarda una traza vacía en cada visita.
+    if BACKGROUND_ANALYSIS:
+        return _render_analysis_page(filename)
+    with trace_analysis("analysis_page", document=filename):
+        return _render_analysis_page(filename)
+
+def _render_analysis_page(filename):
     file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
     
     if not os.path.exists(file_path):
         flash(f'Error: El fichero {filename} no fue encontrado.', 'error')
         return redirect(url_for('index'))
 
-    # Extraer el texto del documento usando nuestro nuevo servicio
-    extracted_text = extract_text_from_document(file_path)
+    # Extraer el texto del documento (o leerlo de la caché de extracción si el fichero no ha cambiado)
+    document = load_document(file_path)
+    extracted_text = document["text"]
 
     if not extracted_text:
         flash(f'No se pudo extraer texto del fichero {filename}. Puede que esté vacío, protegido o corrupto.', 'warning')
     
-    # Usamos el nombre del fichero (sin extensión) como nombre de la colección
+    # Usamos el nombre del fichero (sin extensión) como identificador del documento en la colección de fragmentos
     collection_name, _ = os.path.splitext(filename)
 
+    # En modo segundo plano la página se renderiza ya; el navegador crea el trabajo de análisis
+    # y va recibiendo los resultados a medida que se completan.
+    if BACKGROUND_ANALYSIS and extracted_text:
+        return render_template('analysis.html', title=f'Análisis de {filename}', filename=filename, extracted_text=extracted_text, analysis_results=[], collection_name=collection_name, background_analysis=True, force_refresh=request.args.get('refresh') == '1')
+
     # Crear o actualizar la base de datos vectorial para este documento
+    vector_store_ready = False
     if extracted_text:
         try:
-            create_vector_store(extracted_text, collection_name)
+            create_vector_store(extracted_text, collection_name, version=document["document_hash"], segments=document["segments"])
+            vector_store_ready = True
             flash(f'Documento "{filename}" procesado y listo para chatear.', 'success')
         except Exception as e:
             flash(f'Error al crear la base de datos vectorial: {e}', 'error')
@@ -147,7 +157,10 @@ def analysis_page(filename):
     analysis_results = []
     if extracted_text:
         # Renombramos la variable para mayor claridad
-        raw_analysis_results = analyze_document_coverage(extracted_text, applicable_controls_ids)
+        # Si el almacén vectorial está listo, el análisis puede limitarse a los fragmentos relevantes (ANALYSIS_CONTEXT_MODE=retrieval)
+        # Con ?refresh=1 se ignora la caché de resultados y se repite el análisis con la IA
+        force_refresh = request.args.get('refresh') == '1'
+        raw_analysis_results = analyze_document_coverage(extracted_text, applicable_controls_ids, collection_name=collection_name if vector_store_ready else None, use_cache=not force_refresh, document_hash=document["document_hash"])
         
         # Verificamos de forma más robusta si el análisis devolvió un error
         if raw_analysis_results and isinstance(raw_analysis_results[0], dict) and "error" in raw_analysis_results[0]:
@@ -158,6 +171,124 @@ def analysis_page(filename):
 
     return render_template('analysis.html', title=f'Análisis de {filename}', filename=filename, extracted_text=extracted_text, analysis_results=analysis_results, collection_name=collection_name)
 
+def _serialize_job(job: dict) -> dict:
+    """Convierte el documento de MongoDB de un trabajo en un diccionario serializable a JSON."""
+    return {
+        'job_id': job['_id'],
+        'filename': job['filename'],
+        'status': job['status'],
+        'total': job['total'],
+        'completed': job['completed'],
+        'results': job['results'],
+        'messages': job['messages'],
+        'error': job['error'],
+        'trace_id': job.get('trace_id'),
+        'failed_controls': job.get('failed_controls', 0),
+    }
+
+@app.route('/analysis/<filename>/jobs', methods=['POST'])
+def create_analysis_job_endpoint(filename):
+    """
+    Crea un trabajo de análisis en segundo plano para el documento y devuelve su identificador.
+    Si ya hay uno en curso o terminado para el mismo fichero y controles, se devuelve ese.
+    """
+    filename = secure_filename(filename)
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if not os.path.exists(file_path):
+        return jsonify({'error': f'El fichero {filename} no fue encontrado.'}), 404
+
+    collection_name, _ = os.path.splitext(filename)
+    applicable_controls_ids = session.get('applicable_controls', [])
+    # Con ?refresh=1 se ignora la caché de resultados y se repite el análisis con la IA
+    force_refresh = request.args.get('refresh') == '1'
+    job_id = get_or_create_analysis_job(filename, file_path, collection_name, applicable_controls_ids, use_cache=not force_refresh)
+    return jsonify({'job_id': job_id, 'status_url': url_for('analysis_job_status', job_id=job_id), 'events_url': url_for('analysis_job_events', job_id=job_id)}), 202
+
+@app.route('/analysis/jobs/<job_id>')
+def analysis_job_status(job_id):
+    """Devuelve el estado de un trabajo y los resultados a partir de ?since=N (sondeo periódico)."""
+    since = request.args.get('since', 0, type=int)
+    job = get_analysis_job(job_id, since)
+    if not job:
+        return jsonify({'error': 'Trabajo de análisis no encontrado.'}), 404
+    return jsonify(_serialize_job(job))
+
+@app.route('/analysis/jobs/<job_id>/resume', methods=['POST'])
+def resume_analysis_job_endpoint(job_id):
+    """Reanuda un trabajo fallido o interrumpido sin repetir los controles ya analizados."""
+    if not get_analysis_job(job_id):
+        return jsonify({'error': 'Trabajo de análisis no encontrado.'}), 404
+    if not resume_analysis_job(job_id):
+        return jsonify({'error': 'El trabajo está en curso o ya se completó sin errores.'}), 409
+    return jsonify({'job_id': job_id, 'status_url': url_for('analysis_job_status', job_id=job_id), 'events_url': url_for('analysis_job_events', job_id=job_id)}), 202
+
+# Segundos entre dos lecturas del trabajo al emitir su progreso como Server-Sent Events
+JOB_EVENTS_POLL_SECONDS = 0.5
+
+def _sse_event(event: str, data: dict, event_id: str | None = None) -> str:
+    """Formatea un evento SSE; `event_id` es la posición que el navegador reenvía al reconectarse."""
+    id_line = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{id_line}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _get_events_position(last_event_id: str | None, since: int = 0) -> tuple:
+    """
+    Posición (resultados, mensajes) desde la que se emiten los eventos de un trabajo. Al
+    reconectarse, EventSource reenvía en la cabecera Last-Event-ID el id del último evento
+    recibido ('resultados:mensajes'); en la primera conexión se parte de ?since=N resultados.
+    """
+    try:
+        sent_results, sent_messages = (int(value) for value in last_event_id.split(":"))
+        return max(0, sent_results), max(0, sent_messages)
+    except (AttributeError, ValueError):
+        return max(0, since), 0
+
+def _job_events(job: dict | None, sent_results: int, sent_messages: int) -> list:
+    """
+    Eventos SSE de una lectura del trabajo: mensajes nuevos, resultados nuevos (el trabajo se lee
+    ya a partir del último resultado enviado), progreso y, si ha terminado, el evento final.
+    Cada evento lleva como id la posición alcanzada, para que una reconexión continúe desde ahí.
+    Si el trabajo ha desaparecido (por ejemplo, se borró mientras se seguía) se emite un evento
+    final de error.
+    """
+    if job is None:
+        return [_sse_event("done", {'status': JOB_FAILED, 'error': 'El trabajo de análisis ya no existe.'})]
+    messages = job['messages'][sent_messages:]
+    events = [_sse_event("message", message, f"{sent_results}:{sent_messages + index + 1}") for index, message in enumerate(messages)]
+    sent_messages += len(messages)
+    events += [_sse_event("result", result, f"{sent_results + index + 1}:{sent_messages}") for index, result in enumerate(job['results'])]
+    position = f"{sent_results + len(job['results'])}:{sent_messages}"
+    events.append(_sse_event("progress", {'completed': job['completed'], 'total': job['total'], 'status': job['status']}, position))
+    if job['status'] in (JOB_COMPLETED, JOB_FAILED):
+        events.append(_sse_event("done", {'status': job['status'], 'error': job['error']}, position))
+    return events
+
+def _is_job_finished(job: dict | None) -> bool:
+    """Indica si el seguimiento de un trabajo debe terminar: ha acabado o ya no existe."""
+    return job is None or job['status'] in (JOB_COMPLETED, JOB_FAILED)
+
+@app.route('/analysis/jobs/<job_id>/events')
+def analysis_job_events(job_id):
+    """
+    Emite el progreso de un trabajo como Server-Sent Events hasta que termina. Una reconexión
+    (cabecera Last-Event-ID) o ?since=N continúan sin repetir los resultados ya enviados.
+    """
+    if not get_analysis_job(job_id):
+        return jsonify({'error': 'Trabajo de análisis no encontrado.'}), 404
+    sent_results, sent_messages = _get_events_position(request.headers.get('Last-Event-ID'), request.args.get('since', 0, type=int))
+
+    def generate():
+        nonlocal sent_results, sent_messages
+        while True:
+            job = get_analysis_job(job_id, sent_results)
+            yield from _job_events(job, sent_results, sent_messages)
+            if _is_job_finished(job):
+                return
+            sent_messages = max(sent_messages, len(job['messages']))
+            sent_results += len(job['results'])
+            time.sleep(JOB_EVENTS_POLL_SECONDS)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/chat', methods=['POST'])
 def chat():
     """Endpoint para el chat interactivo."""
@@ -171,6 +302,22 @@ def chat():
     answer = answer_question_with_rag(question, collection_name)
     return jsonify({'answer': answer})
 
+def _stream_text(chunks):
+    """Devuelve una respuesta HTTP chunked que envía cada fragmento de texto en cuanto se genera."""
+    return Response(stream_with_context(chunks), mimetype='text/plain', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Versión en streaming del chat: envía los tokens de la respuesta a medida que se generan."""
+    data = request.get_json()
+    question = data.get('question')
+    collection_name = data.get('collection_name')
+
+    if not question or not collection_name:
+        return jsonify({'error': 'Falta la pregunta o el nombre de la colección.'}), 400
+
+    return _stream_text(stream_answer_question_with_rag(question, collection_name))
+
 @app.route('/generate_draft', methods=['POST'])
 def generate_draft():
     """Endpoint para generar un borrador de política."""
@@ -181,9 +328,21 @@ def generate_draft():
     if not control_id or not control_description:
         return jsonify({'error': 'Faltan datos del control.'}), 400
 
-    draft = generate_policy_draft(control_id, control_description)
+    draft = generate_policy_draft(control_id, control_description, regenerate=bool(data.get('regenerate')))
     return jsonify({'draft': draft})
 
+@app.route('/generate_draft/stream', methods=['POST'])
+def generate_draft_stream():
+    """Versión en streaming de la generación de borradores de política."""
+    data = request.get_json()
+    control_id = data.get('control_id')
+    control_description = data.get('control_description')
+
+    if not control_id or not control_description:
+        return jsonify({'error': 'Faltan datos del control.'}), 400
+
+    return _stream_text(stream_policy_draft(control_id, control_description, regenerate=bool(data.get('regenerate'))))
+
 @app.route('/identify_risks', methods=['POST'])
 def identify_risks():
     """Endpoint para identificar riesgos de un control no cubierto."""
@@ -194,11 +353,64 @@ def identify_risks():
     if not control_id or not control_description:
         return jsonify({'error': 'Faltan datos del control.'}), 400
 
-    risks = identify_risks_for_control(control_id, control_description)
+    risks = identify_risks_for_control(control_id, control_description, regenerate=bool(data.get('regenerate')))
     return jsonify({'risks': risks})
 
+@app.route('/identify_risks/stream', methods=['POST'])
+def identify_risks_stream():
+    """Versión en streaming de la identificación de riesgos."""
+    data = request.get_json()
+    control_id = data.get('control_id')
+    control_description = data.get('control_description')
+
+    if not control_id or not control_description:
+        return jsonify({'error': 'Faltan datos del control.'}), 400
+
+    return _stream_text(stream_risks_for_control(control_id, control_description, regenerate=bool(data.get('regenerate'))))
+
+@app.route('/metrics')
+def metrics():
+    """Métricas del proceso (duración por fase, llamadas y tokens del LLM, errores) en formato Prometheus."""
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/chat/cache/stats')
+def chat_cache_stats():
+    """Resumen de la caché semántica del chat: respuestas guardadas, aciertos y umbral de similitud."""
+    try:
+        return jsonify(get_chat_cache_stats())
+    except Exception as e:
+        return jsonify({"error": f"No se pudo leer la caché del chat: {e}"}), 500
+
+@app.route('/traces/<trace_id>')
+def analysis_trace(trace_id):
+    """Devuelve la traza de un análisis: cada fase y llamada al LLM con su documento, control y duración."""
+    trace = get_trace(trace_id)
+    if not trace:
+        return jsonify({'error': 'Traza no encontrada.'}), 404
+    trace['trace_id'] = trace.pop('_id')
+    return jsonify(trace)
+
+@app.route('/warmup', methods=['GET', 'POST'])
+def warmup_endpoint():
+    """
+    GET devuelve el informe de tiempos de arranque. POST precarga el modelo de embeddings,
+    el cliente de Vertex AI y la conexión a MongoDB (útil como readiness probe tras desplegar).
+    """
+    if request.method == 'POST':
+        try:
+            warmup(connect=True)
+        except Exception as e:
+            print(f"Error durante el calentamiento: {e}")
+            return jsonify({'error': str(e), **get_startup_report()}), 500
+    return jsonify(get_startup_report())
+
+record_startup_phase("app_import", time.perf_counter() - _app_import_started)
+print(f"--- Aplicación cargada en {get_startup_report()['phases']['app_import']:.2f}s (modelos y conexiones se inicializan bajo demanda) ---")
+
 # Esto permite ejecutar la aplicación directamente con `python app.py`
 # lo cual es útil para depurar. `debug=True` activa el recargado automático
 # y muestra páginas de error más detalladas.
 if __name__ == '__main__':
+    if os.getenv('WARMUP_ON_STARTUP', 'false').lower() in ('true', '1', 'yes'):
+        print(f"--- Calentamiento completado: {warmup(connect=True)} ---")
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,205 @@
+# Modo de servicio asíncrono (opcional): `uvicorn asgi:app --host 0.0.0.0 --port 8000`
+# Requiere `pip install -r requirements-asgi.txt` (incluye pymongo >= 4.13, con cliente asíncrono).
+# El chat, los borradores, los riesgos y el seguimiento de los trabajos de análisis se sirven con
+# vistas asíncronas (ainvoke/astream de LangChain y el cliente asíncrono de MongoDB), así que una
+# petición que espera al LLM o a Atlas no ocupa un hilo. Cada grupo de endpoints tiene un semáforo
+# que limita las peticiones en curso. El resto de rutas las sirve la aplicación Flask de app.py.
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+from app import app as flask_app, JOB_EVENTS_POLL_SECONDS, _get_events_position, _is_job_finished, _job_events, _serialize_job
+from services.ai_analyzer import aanswer_question_with_rag, agenerate_policy_draft, aidentify_risks_for_control
+from services.ai_analyzer import astream_answer_question_with_rag, astream_policy_draft, astream_risks_for_control
+from services.analysis_jobs import aget_analysis_job
+from services.runtime import warmup
+from services.metrics import increment, set_gauge
+
+# Peticiones en curso por grupo de endpoints. Las del seguimiento de trabajos duran todo el
+# análisis pero apenas consumen recursos, de ahí su límite más alto.
+DEFAULT_ENDPOINT_CONCURRENCY = {"chat": 256, "generation": 64, "job_events": 512}
+# Segundos que una petición espera un hueco antes de responder 503.
+DEFAULT_QUEUE_TIMEOUT_SECONDS = 10
+# Hilos para las rutas de Flask (subida, análisis, páginas HTML...).
+DEFAULT_WSGI_THREADS = 16
+# Hilos para las operaciones que aún son síncronas dentro de las vistas asíncronas: consultas a
+# las cachés del chat y de la biblioteca, creación de las cadenas (retriever y cliente del LLM),
+# embeddings de las preguntas y búsqueda vectorial.
+DEFAULT_BLOCKING_THREADS = 64
+
+def _get_env_int(name: str, default: int) -> int:
+    """Lee un entero positivo de una variable de entorno, con valor por defecto si no es válido."""
+    try:
+        return max(1, int(os.getenv(name, default)))
+    except ValueError:
+        return default
+
+class LimitedEndpoint:
+    """
+    Endpoint ASGI que solo atiende la petición si hay hueco en el semáforo de su grupo. El hueco
+    se mantiene hasta enviar la respuesta completa, también en las respuestas en streaming.
+    """
+
+    _semaphores = {}
+    _in_flight = {}
+
+    def __init__(self, group: str, handler):
+        self.group = group
+        self.handler = handler
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(self.group)
+        if semaphore is None:
+            limit = _get_env_int(f"ASGI_{self.group.upper()}_CONCURRENCY", DEFAULT_ENDPOINT_CONCURRENCY[self.group])
+            semaphore = self._semaphores[self.group] = asyncio.Semaphore(limit)
+            self._in_flight[self.group] = 0
+        return semaphore
+
+    def _update_in_flight(self, delta: int):
+        self._in_flight[self.group] += delta
+        set_gauge("asgi_in_flight_requests", self._in_flight[self.group], group=self.group)
+
+    async def __call__(self, scope, receive, send):
+        semaphore = self._get_semaphore()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), _get_env_int('ASGI_QUEUE_TIMEOUT_SECONDS', DEFAULT_QUEUE_TIMEOUT_SECONDS))
+        except asyncio.TimeoutError:
+            increment("asgi_rejected_total", group=self.group)
+            response = JSONResponse({'error': 'El servidor está ocupado. Por favor, inténtalo de nuevo en unos segundos.'}, status_code=503, headers={'Retry-After': '5'})
+            await response(scope, receive, send)
+            return
+        self._update_in_flight(1)
+        try:
+            response = await self.handler(Request(scope, receive))
+            await response(scope, receive, send)
+        finally:
+            self._update_in_flight(-1)
+            semaphore.release()
+
+async def _get_json(request: Request) -> dict:
+    """Cuerpo JSON de la petición, o {} si no es un objeto JSON válido."""
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def _stream_text(chunks):
+    """Respuesta HTTP chunked que envía cada fragmento de texto en cuanto se genera."""
+    return StreamingResponse(chunks, media_type='text/plain', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+async def chat(request: Request):
+    """Endpoint para el chat interactivo."""
+    data = await _get_json(request)
+    question = data.get('question')
+    collection_name = data.get('collection_name')
+    if not question or not collection_name:
+        return JSONResponse({'error': 'Falta la pregunta o el nombre de la colección.'}, status_code=400)
+    return JSONResponse({'answer': await aanswer_question_with_rag(question, collection_name)})
+
+async def chat_stream(request: Request):
+    """Versión en streaming del chat."""
+    data = await _get_json(request)
+    question = data.get('question')
+    collection_name = data.get('collection_name')
+    if not question or not collection_name:
+        return JSONResponse({'error': 'Falta la pregunta o el nombre de la colección.'}, status_code=400)
+    return _stream_text(astream_answer_question_with_rag(question, collection_name))
+
+async def _get_control(request: Request):
+    """Devuelve (control_id, descripción, regenerate) del cuerpo de la petición."""
+    data = await _get_json(request)
+    return data.get('control_id'), data.get('control_description'), bool(data.get('regenerate'))
+
+async def generate_draft(request: Request):
+    """Endpoint para generar un borrador de política."""
+    control_id, control_description, regenerate = await _get_control(request)
+    if not control_id or not control_description:
+        return JSONResponse({'error': 'Faltan datos del control.'}, status_code=400)
+    return JSONResponse({'draft': await agenerate_policy_draft(control_id, control_description, regenerate=regenerate)})
+
+async def generate_draft_stream(request: Request):
+    """Versión en streaming de la generación de borradores de política."""
+    control_id, control_description, regenerate = await _get_control(request)
+    if not control_id or not control_description:
+        return JSONResponse({'error': 'Faltan datos del control.'}, status_code=400)
+    return _stream_text(astream_policy_draft(control_id, control_description, regenerate=regenerate))
+
+async def identify_risks(request: Request):
+    """Endpoint para identificar riesgos de un control no cubierto."""
+    control_id, control_description, regenerate = await _get_control(request)
+    if not control_id or not control_description:
+        return JSONResponse({'error': 'Faltan datos del control.'}, status_code=400)
+    return JSONResponse({'risks': await aidentify_risks_for_control(control_id, control_description, regenerate=regenerate)})
+
+async def identify_risks_stream(request: Request):
+    """Versión en streaming de la identificación de riesgos."""
+    control_id, control_description, regenerate = await _get_control(request)
+    if not control_id or not control_description:
+        return JSONResponse({'error': 'Faltan datos del control.'}, status_code=400)
+    return _stream_text(astream_risks_for_control(control_id, control_description, regenerate=regenerate))
+
+async def analysis_job_status(request: Request):
+    """Devuelve el estado de un trabajo y los resultados a partir de ?since=N (sondeo periódico)."""
+    try:
+        since = int(request.query_params.get('since', 0))
+    except ValueError:
+        since = 0
+    job = await aget_analysis_job(request.path_params['job_id'], since)
+    if not job:
+        return JSONResponse({'error': 'Trabajo de análisis no encontrado.'}, status_code=404)
+    return JSONResponse(_serialize_job(job))
+
+async def analysis_job_events(request: Request):
+    """Emite el progreso de un trabajo como Server-Sent Events hasta que termina (ver app.analysis_job_events)."""
+    job_id = request.path_params['job_id']
+    if not await aget_analysis_job(job_id):
+        return JSONResponse({'error': 'Trabajo de análisis no encontrado.'}, status_code=404)
+    try:
+        since = int(request.query_params.get('since', 0))
+    except ValueError:
+        since = 0
+    sent_results, sent_messages = _get_events_position(request.headers.get('last-event-id'), since)
+
+    async def generate():
+        nonlocal sent_results, sent_messages
+        while True:
+            job = await aget_analysis_job(job_id, sent_results)
+            for event in _job_events(job, sent_results, sent_messages):
+                yield event
+            if _is_job_finished(job):
+                return
+            sent_messages = max(sent_messages, len(job['messages']))
+            sent_results += len(job['results'])
+            await asyncio.sleep(JOB_EVENTS_POLL_SECONDS)
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@asynccontextmanager
+async def lifespan(app):
+    # asyncio.to_thread y LangChain usan el ejecutor por defecto del bucle para el código síncrono
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(_get_env_int('ASGI_BLOCKING_THREADS', DEFAULT_BLOCKING_THREADS), thread_name_prefix="asgi-blocking"))
+    if os.getenv('WARMUP_ON_STARTUP', 'false').lower() in ('true', '1', 'yes'):
+        print(f"--- Calentamiento completado: {await asyncio.to_thread(warmup, connect=True)} ---")
+    yield
+
+app = Starlette(
+    routes=[
+        Route('/chat', LimitedEndpoint("chat", chat), methods=['POST']),
+        Route('/chat/stream', LimitedEndpoint("chat", chat_stream), methods=['POST']),
+        Route('/generate_draft', LimitedEndpoint("generation", generate_draft), methods=['POST']),
+        Route('/generate_draft/stream', LimitedEndpoint("generation", generate_draft_stream), methods=['POST']),
+        Route('/identify_risks', LimitedEndpoint("generation", identify_risks), methods=['POST']),
+        Route('/identify_risks/stream', LimitedEndpoint("generation", identify_risks_stream), methods=['POST']),
+        Route('/analysis/jobs/{job_id}', LimitedEndpoint("job_events", analysis_job_status), methods=['GET']),
+        Route('/analysis/jobs/{job_id}/events', LimitedEndpoint("job_events", analysis_job_events), methods=['GET']),
+        # Subida de documentos, creación y reanudación de trabajos, páginas HTML, /metrics, /warmup...
+        Mount('/', WSGIMiddleware(flask_app, workers=_get_env_int('ASGI_WSGI_THREADS', DEFAULT_WSGI_THREADS))),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,150 @@
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from typing import Any
+from google.api_core import exceptions as google_exceptions
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Estados que devuelve el LLM simulado, en función de si la descripción del control aparece en el documento.
+COVERED = "Covered"
+NOT_COVERED = "Not Covered"
+
+def estimate_tokens(text: str) -> int:
+    """Misma estimación que usa el analizador (~4 caracteres por token)."""
+    return len(text) // 4 + 1
+
+class FakeLLMStats:
+    """Contadores, seguros entre hilos, de las llamadas al LLM simulado."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+            self.rate_limited = 0
+
+    def record(self, prompt_tokens: int = 0, completion_tokens: int = 0, rate_limited: bool = False):
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.rate_limited += int(rate_limited)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "rate_limited": self.rate_limited,
+            }
+
+class FakeChatModel(BaseChatModel):
+    """
+    Sustituto local de ChatVertexAI para los benchmarks. Responde a los prompts de análisis
+    con JSON válido (el control está cubierto si su descripción aparece en el documento) y al
+    resto con texto. La latencia es `latency_ms` más el tiempo de generar la respuesta a
+    `tokens_per_second`, y una fracción `rate_limit_ratio` de las llamadas falla con un 429.
+    """
+    latency_ms: float = 200.0
+    tokens_per_second: float = 200.0
+    justification_tokens: int = 40
+    rate_limit_ratio: float = 0.0
+    seed: int = 0
+    stats: Any = None
+    rng: Any = None
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.stats is None:
+            self.stats = FakeLLMStats()
+        if self.rng is None:
+            self.rng = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark-chat"
+
+    def get_num_tokens(self, text: str) -> int:
+        # Sustituye al recuento de Vertex AI sin cargar ningún tokenizador
+        return estimate_tokens(text)
+
+    def _should_rate_limit(self) -> bool:
+        return self.rate_limit_ratio > 0 and self.rng.random() < self.rate_limit_ratio
+
+    def _respond(self, prompt: str) -> str:
+        justification = " ".join(["justificación"] * self.justification_tokens)
+        document = prompt.split("---")[1] if prompt.count("---") >= 2 else prompt
+        if "CONTROLES A ANALIZAR" in prompt:
+            controls = re.findall(r"- ID: (A\.\d+\.\d+) \| Descripción: (.+)", prompt)
+            return json.dumps({"results": [
+                {"control_id": control_id, "status": COVERED if description.strip() in document else NOT_COVERED, "justification": justification}
+                for control_id, description in controls
+            ]}, ensure_ascii=False)
+        if "CONTROL A ANALIZAR" in prompt:
+            match = re.search(r"- Descripción: (.+)", prompt)
+            covered = bool(match) and match.group(1).strip() in document
+            return json.dumps({"status": COVERED if covered else NOT_COVERED, "justification": justification}, ensure_ascii=False)
+        return " ".join(["respuesta"] * self.justification_tokens * 3)
+
+    def _prepare(self, messages) -> tuple:
+        prompt = "\n".join(str(message.content) for message in messages)
+        if self._should_rate_limit():
+            self.stats.record(prompt_tokens=estimate_tokens(prompt), rate_limited=True)
+            time.sleep(self.latency_ms / 1000 / 4)
+            raise google_exceptions.ResourceExhausted("429 Quota exceeded (LLM simulado del benchmark)")
+        return prompt, self._respond(prompt)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt, text = self._prepare(messages)
+        completion_tokens = estimate_tokens(text)
+        time.sleep(self.latency_ms / 1000 + completion_tokens / self.tokens_per_second)
+        self.stats.record(prompt_tokens=estimate_tokens(prompt), completion_tokens=completion_tokens)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt, text = self._prepare(messages)
+        time.sleep(self.latency_ms / 1000)
+        words = text.split(" ")
+        for index, word in enumerate(words):
+            time.sleep(1 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word if index == len(words) - 1 else word + " "))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+        self.stats.record(prompt_tokens=estimate_tokens(prompt), completion_tokens=estimate_tokens(text))
+
+class DeterministicEmbeddings(Embeddings):
+    """
+    Embeddings deterministas sin modelo: cada palabra se proyecta con un hash sobre `dimensions`
+    posiciones (bolsa de palabras con signo), así que los textos con vocabulario común son
+    similares y la recuperación se comporta de forma verosímil.
+    """
+
+    def __init__(self, dimensions: int = 384):
+        self.dimensions = dimensions
+
+    def _embed(self, text: str) -> list:
+        vector = [0.0] * self.dimensions
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = sum(value * value for value in vector) ** 0.5 or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts: list) -> list:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list:
+        return self._embed(text)
@@ -0,0 +1,263 @@
+"""
+Benchmark offline del pipeline de auditoría: rutas reales de `app` y servicios reales contra
+un LLM simulado (latencia, tokens y errores 429 configurables), embeddings deterministas,
+el backend vectorial local y MongoDB en memoria (mongomock). No necesita red.
+
+Uso:
+    python benchmarks/run_benchmark.py --pages 5 20 80 --output bench.json
+
+La salida JSON tiene siempre las mismas claves, para poder comparar resultados entre commits.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from contextlib import redirect_stdout
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(benchmarks_dir)
+sys.path.append(project_root)
+sys.path.append(os.path.join(project_root, "scripts"))
+
+from fakes import DeterministicEmbeddings, FakeChatModel
+
+# Caracteres aproximados por página de los documentos sintéticos.
+PAGE_CHARS = 3000
+# Fracción por defecto de los controles cuya descripción aparece en el documento sintético.
+DEFAULT_COVERED_RATIO = 0.4
+FILLER_SENTENCES = [
+    "La organización revisa esta política al menos una vez al año.",
+    "Los responsables de cada área deben conocer y aplicar este procedimiento.",
+    "Las excepciones se documentan y las aprueba el comité de seguridad.",
+    "El incumplimiento de esta norma puede dar lugar a medidas disciplinarias.",
+    "Los registros se conservan durante el periodo establecido por la legislación aplicable.",
+    "El departamento de sistemas proporciona los medios técnicos necesarios.",
+]
+
+def _get_max_rss_mb() -> float | None:
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo devuelve en KB y macOS en bytes
+    return round(max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024, 1)
+
+def _get_git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=project_root, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def generate_policy_document(path: str, pages: int, controls: list, seed: int, covered_ratio: float = DEFAULT_COVERED_RATIO) -> list:
+    """
+    Genera un DOCX sintético de unas `pages` páginas que menciona la descripción de una parte
+    de los controles. Devuelve los IDs de los controles mencionados.
+    """
+    from docx import Document
+    rng = random.Random(seed)
+    covered = [control for control in controls if rng.random() < covered_ratio]
+    doc = Document()
+    doc.add_heading("Política de Seguridad de la Información (documento sintético)", level=1)
+    for page in range(pages):
+        doc.add_heading(f"Sección {page + 1}", level=2)
+        written = 0
+        # Las menciones a controles se reparten entre todas las páginas
+        for control in covered[page::pages]:
+            paragraph = f"{control['description']}. {rng.choice(FILLER_SENTENCES)}"
+            doc.add_paragraph(paragraph)
+            written += len(paragraph)
+        while written < PAGE_CHARS:
+            paragraph = " ".join(rng.choice(FILLER_SENTENCES) for _ in range(4))
+            doc.add_paragraph(paragraph)
+            written += len(paragraph)
+    doc.save(path)
+    return [control["id"] for control in covered]
+
+class StageTimer:
+    """Mide una fase: tiempo, llamadas y tokens del LLM, memoria pico (opcional) y RSS máximo."""
+
+    def __init__(self, llm: FakeChatModel, trace_memory: bool):
+        self.llm = llm
+        self.trace_memory = trace_memory
+        self.stages = {}
+
+    def run(self, name: str, func):
+        self.llm.stats.reset()
+        if self.trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - started
+        stage = {"seconds": round(seconds, 4), "llm": self.llm.stats.snapshot()}
+        if self.trace_memory:
+            stage["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+            tracemalloc.stop()
+        stage["max_rss_mb"] = _get_max_rss_mb()
+        calls = stage["llm"]["calls"]
+        stage["llm_calls_per_second"] = round(calls / seconds, 2) if calls and seconds else 0
+        self.stages[name] = stage
+        return result
+
+def _configure_environment(args, work_dir: str):
+    """Variables de entorno del benchmark; deben fijarse antes de importar la aplicación."""
+    os.environ["VECTOR_BACKEND"] = "local"
+    os.environ["VECTOR_INDEX_DIR"] = os.path.join(work_dir, "vector_indexes")
+    os.environ["ANALYSIS_MAX_CONCURRENCY"] = str(args.concurrency)
+    os.environ["ANALYSIS_BATCH_SIZE"] = str(args.batch_size)
+    os.environ["ANALYSIS_BACKGROUND_JOBS"] = "false"
+    os.environ.setdefault("MONGO_URI", "mongodb://benchmark.invalid")
+    # app.py comprueba que existan unas credenciales; Vertex AI no llega a inicializarse.
+    if not os.path.exists(os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "")):
+        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.path.abspath(__file__)
+    os.environ.setdefault("GOOGLE_CLOUD_PROJECT", "benchmark")
+
+def _install_fakes(args) -> FakeChatModel:
+    """Sustituye el LLM, los embeddings y MongoDB por sus versiones locales."""
+    try:
+        import mongomock
+    except ImportError:
+        print("ERROR: El benchmark necesita mongomock (pip install -r requirements-dev.txt).")
+        sys.exit(1)
+    from services import ai_analyzer, vector_store_manager
+    from services.control_catalog import bump_catalog_version
+    from services.metrics import LLMMetricsCallback
+    from seed_database import ALL_ISO_27001_CONTROLS
+
+    vector_store_manager._mongo_client = mongomock.MongoClient()
+    vector_store_manager._embeddings = DeterministicEmbeddings()
+    llm = FakeChatModel(
+        latency_ms=args.latency_ms,
+        tokens_per_second=args.tokens_per_second,
+        justification_tokens=args.justification_tokens,
+        rate_limit_ratio=args.rate_limit_ratio,
+        seed=args.seed,
+        callbacks=[LLMMetricsCallback("benchmark")],
+    )
+    ai_analyzer._llm_instance = llm
+    vector_store_manager.get_mongo_collection("iso_27001_controls").insert_many([dict(control) for control in ALL_ISO_27001_CONTROLS])
+    bump_catalog_version()
+    return llm
+
+def _count_errors(results: list) -> int:
+    return int(bool(results) and isinstance(results[0], dict) and "error" in results[0])
+
+def benchmark_document(pages: int, args, llm: FakeChatModel, work_dir: str) -> dict:
+    """Ejecuta todas las fases sobre un documento sintético de `pages` páginas."""
+    import app as flask_app
+    from services.ai_analyzer import analyze_document_coverage, get_iso_controls_from_db
+    from services.document_processor import load_document
+    from services.vector_store_manager import create_vector_store
+    from calibrate_triage import calibrate
+
+    controls = get_iso_controls_from_db()
+    upload_dir = os.path.join(work_dir, "uploads")
+    os.makedirs(upload_dir, exist_ok=True)
+    filename = f"politica_{pages}p.docx"
+    path = os.path.join(upload_dir, filename)
+    covered_ids = generate_policy_document(path, pages, controls, args.seed + pages, args.covered_ratio)
+    doc_id = os.path.splitext(filename)[0]
+    timer = StageTimer(llm, args.trace_memory)
+
+    document = timer.run("extract_cold", lambda: load_document(path))
+    timer.run("extract_cached", lambda: load_document(path))
+    text = document["text"]
+    timer.run("index_cold", lambda: create_vector_store(text, doc_id, version=document["document_hash"], segments=document["segments"]))
+    timer.run("index_unchanged", lambda: create_vector_store(text, doc_id, version=document["document_hash"], segments=document["segments"]))
+
+    errors = {}
+    full = timer.run("analyze_full", lambda: analyze_document_coverage(text, [], use_cache=False, context_mode="full", document_hash=document["document_hash"]))
+    errors["analyze_full"] = _count_errors(full)
+    cached = timer.run("analyze_full_cached", lambda: analyze_document_coverage(text, [], context_mode="full", document_hash=document["document_hash"]))
+    errors["analyze_full_cached"] = _count_errors(cached)
+    retrieval = timer.run("analyze_retrieval", lambda: analyze_document_coverage(text, [], collection_name=doc_id, use_cache=False, context_mode="retrieval", document_hash=document["document_hash"]))
+    errors["analyze_retrieval"] = _count_errors(retrieval)
+    # El umbral del triaje se calibra con los veredictos del análisis completo, como haría scripts/calibrate_triage.py
+    calibration = calibrate({doc_id: {result["id"]: result for result in full}}, controls, args.triage_recall) if not errors["analyze_full"] else None
+    if calibration:
+        os.environ["ANALYSIS_TRIAGE_THRESHOLD"] = str(calibration["threshold"])
+    triaged = timer.run("analyze_full_triage", lambda: analyze_document_coverage(text, [], use_cache=False, context_mode="full", document_hash=document["document_hash"], collection_name=doc_id, incremental=False, triage=True))
+    errors["analyze_full_triage"] = _count_errors(triaged)
+
+    # Rutas reales de la aplicación Flask (análisis síncrono y chat RAG)
+    flask_app.app.config["UPLOAD_FOLDER"] = upload_dir
+    flask_app.BACKGROUND_ANALYSIS = False
+    client = flask_app.app.test_client()
+    route_status = {}
+    route_status["analysis_page"] = timer.run("route_analysis_page", lambda: client.get(f"/analysis/{filename}").status_code)
+    route_status["chat"] = timer.run("route_chat", lambda: client.post("/chat", json={"question": "¿Qué dice la política sobre el control de acceso?", "collection_name": doc_id}).status_code)
+
+    # Exactitud frente a los controles realmente mencionados en el documento sintético
+    found = {result["id"] for result in full if not _count_errors(full) and result.get("status") == "Covered"}
+    triage_kept = {result["id"] for result in triaged if not _count_errors(triaged) and not result.get("triaged")}
+    return {
+        "pages": pages,
+        "characters": len(text),
+        "stages": timer.stages,
+        "errors": errors,
+        # Controles que agotaron los reintentos ante los 429 simulados
+        "failed_controls": sum(1 for result in full if not _count_errors(full) and result.get("status") == "Error"),
+        "route_status": route_status,
+        "covered_expected": len(covered_ids),
+        "covered_found": len(found & set(covered_ids)),
+        # Controles mencionados que el triaje deja pasar al LLM (idealmente, todos)
+        "triage_covered_kept": len(triage_kept & set(covered_ids)),
+        "triage_threshold": calibration["threshold"] if calibration else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline del pipeline de auditoría.")
+    parser.add_argument("--pages", type=int, nargs="+", default=[5, 20, 80], help="Tamaños (en páginas) de los documentos sintéticos.")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Latencia fija por llamada al LLM simulado.")
+    parser.add_argument("--tokens-per-second", type=float, default=400.0, help="Velocidad de generación del LLM simulado.")
+    parser.add_argument("--justification-tokens", type=int, default=40, help="Palabras de cada justificación generada.")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="Fracción de llamadas que fallan con 429.")
+    parser.add_argument("--concurrency", type=int, default=8, help="ANALYSIS_MAX_CONCURRENCY durante el benchmark.")
+    parser.add_argument("--batch-size", type=int, default=1, help="ANALYSIS_BATCH_SIZE durante el benchmark.")
+    parser.add_argument("--covered-ratio", type=float, default=DEFAULT_COVERED_RATIO, help="Fracción de controles mencionados en cada documento (baja = política de un solo tema).")
+    parser.add_argument("--triage-recall", type=float, default=0.99, help="Recall objetivo al calibrar el umbral del triaje.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace-memory", action="store_true", help="Mide la memoria pico de cada fase con tracemalloc (más lento).")
+    parser.add_argument("--output", default=None, help="Fichero JSON de salida (por defecto, la salida estándar).")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="ia_auditor_bench_")
+    try:
+        _configure_environment(args, work_dir)
+        # Los mensajes de la aplicación van a stderr para que stdout contenga solo el JSON
+        with redirect_stdout(sys.stderr):
+            llm = _install_fakes(args)
+            started = time.perf_counter()
+            documents = [benchmark_document(pages, args, llm, work_dir) for pages in args.pages]
+        report = {
+            "commit": _get_git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {key: value for key, value in vars(args).items() if key != "output"},
+            "total_seconds": round(time.perf_counter() - started, 3),
+            "max_rss_mb": _get_max_rss_mb(),
+            "documents": documents,
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        print(f"Resultados guardados en {args.output}")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+# Configuración opcional para desplegar con gunicorn: `gunicorn -c gunicorn.conf.py app:app`
+# La aplicación se carga una sola vez en el proceso maestro y el modelo de embeddings se precarga
+# antes de hacer fork, de modo que todos los workers comparten sus páginas de memoria.
+# Las conexiones (Vertex AI, MongoDB) se crean después, dentro de cada worker.
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', 2))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+preload_app = True
+
+def on_starting(server):
+    from services.runtime import warmup
+    report = warmup(connect=False)
+    server.log.info(f"Precarga completada antes del fork: {report}")
@@ -0,0 +1,193 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+# Añadir el directorio raíz del proyecto al path para permitir importaciones desde 'services'
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from services.document_processor import SEGMENT_SEPARATORS, compute_file_hash, load_document
+from services.vector_store_manager import create_vector_store
+from services.ai_analyzer import analyze_document_coverage, get_iso_controls_from_db
+
+dotenv_path = os.path.join(project_root, '.env')
+if os.path.exists(dotenv_path):
+    load_dotenv(dotenv_path=dotenv_path)
+else:
+    print(f"ADVERTENCIA: No se encontró el fichero .env en la ruta esperada: {dotenv_path}")
+    load_dotenv()
+
+# Documentos que se auditan a la vez. Cada análisis hace a su vez hasta ANALYSIS_MAX_CONCURRENCY
+# llamadas simultáneas al LLM, así que la concurrencia total es el producto de ambos valores.
+DEFAULT_BATCH_AUDIT_WORKERS = 2
+# Orden de los estados de menor a mayor cobertura, para el resumen del conjunto de documentos.
+STATUS_RANK = {"Not Applicable": 0, "Not Covered": 1, "Partially Covered": 2, "Covered": 3}
+
+def _get_env_int(name: str, default: int) -> int:
+    """Lee un entero positivo de una variable de entorno, con valor por defecto si no es válido."""
+    try:
+        return max(1, int(os.getenv(name, default)))
+    except ValueError:
+        print(f"ADVERTENCIA: {name} no es un entero válido; se usa {default}.")
+        return default
+
+def find_documents(directory: str) -> list:
+    """Devuelve, ordenadas, las rutas de todos los PDF y DOCX del directorio y sus subdirectorios."""
+    documents = []
+    for root, dirs, files in os.walk(directory):
+        # No se recorren directorios ocultos (por ejemplo, la caché de extracción)
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in SEGMENT_SEPARATORS:
+                documents.append(os.path.join(root, name))
+    return documents
+
+class JsonlWriter:
+    """Escribe registros JSON, uno por línea, desde varios hilos a la vez."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "w", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+def audit_document(file_path: str, relative_path: str, file_hash: str, applicable_control_ids: list, writer: JsonlWriter, cache_dir: str, use_cache: bool) -> dict:
+    """
+    Extrae, indexa y analiza un documento, escribiendo cada resultado en el JSONL en cuanto
+    está disponible. Devuelve {id_de_control: estado} para la matriz de cobertura.
+    """
+    started = time.perf_counter()
+    doc_id = os.path.splitext(relative_path)[0].replace(os.sep, "/")
+    document = load_document(file_path, cache_dir=cache_dir, file_hash=file_hash)
+    if not document["text"]:
+        writer.write({"type": "document", "document": relative_path, "status": "failed", "error": "No se pudo extraer texto del documento."})
+        return {}
+
+    vector_store_ready = False
+    try:
+        create_vector_store(document["text"], doc_id, version=document["document_hash"], segments=document["segments"])
+        vector_store_ready = True
+    except Exception as e:
+        print(f"ADVERTENCIA: No se pudo indexar '{relative_path}', se analiza sin almacén vectorial: {e}")
+
+    def write_result(result: dict):
+        writer.write({"type": "result", "document": relative_path, "doc_id": doc_id, **result})
+
+    results = analyze_document_coverage(
+        document["text"],
+        applicable_control_ids,
+        collection_name=doc_id if vector_store_ready else None,
+        use_cache=use_cache,
+        on_result=write_result,
+        document_hash=document["document_hash"],
+    )
+    if results and isinstance(results[0], dict) and "error" in results[0]:
+        writer.write({"type": "document", "document": relative_path, "status": "failed", "error": results[0]["error"]})
+        return {}
+
+    statuses = {result["id"]: result["status"] for result in results}
+    counts = {}
+    for status in statuses.values():
+        counts[status] = counts.get(status, 0) + 1
+    writer.write({
+        "type": "document", "document": relative_path, "doc_id": doc_id, "status": "completed",
+        "file_hash": file_hash, "counts": counts, "seconds": round(time.perf_counter() - started, 2),
+    })
+    return statuses
+
+def write_coverage_matrix(path: str, controls: list, documents: list, statuses: dict, duplicates: dict | None = None):
+    """
+    Escribe la matriz de cobertura control × documento en CSV. La última columna es la mejor
+    cobertura que alcanza el control en el conjunto de documentos. Los documentos de
+    `duplicates` ({documento: original}) repiten los resultados del original y su cabecera lo indica.
+    """
+    duplicates = duplicates or {}
+    headers = [f"{document} (idéntico a {duplicates[document]})" if document in duplicates else document for document in documents]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["control_id", "description"] + headers + ["best_coverage"])
+        for control in controls:
+            row = [statuses.get(document, {}).get(control["id"], "") for document in documents]
+            best = max((status for status in row if status in STATUS_RANK), key=STATUS_RANK.get, default="")
+            writer.writerow([control["id"], control["description"]] + row + [best])
+
+def main():
+    parser = argparse.ArgumentParser(description="Audita todos los documentos (PDF/DOCX) de un directorio contra los controles de la ISO 27001.")
+    parser.add_argument("directory", help="Directorio con los documentos del SGSI, por ejemplo 'policies'.")
+    parser.add_argument("--output", default=None, help="Fichero JSONL de resultados (por defecto batch_audit_<fecha>.jsonl).")
+    parser.add_argument("--matrix", default=None, help="Fichero CSV con la matriz de cobertura (por defecto junto al JSONL).")
+    parser.add_argument("--workers", type=int, default=_get_env_int("BATCH_AUDIT_WORKERS", DEFAULT_BATCH_AUDIT_WORKERS), help="Documentos que se analizan a la vez.")
+    parser.add_argument("--controls", default="", help="IDs de los controles aplicables separados por comas (por defecto, todos).")
+    parser.add_argument("--no-cache", action="store_true", help="Ignora la caché de resultados y repite el análisis con la IA.")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        print(f"ERROR: No existe el directorio {args.directory}.")
+        sys.exit(1)
+    output_path = args.output or f"batch_audit_{time.strftime('%Y%m%d_%H%M%S')}.jsonl"
+    matrix_path = args.matrix or os.path.splitext(output_path)[0] + "_matrix.csv"
+    # La caché de extracción se guarda junto a la salida para no escribir en el directorio auditado
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(output_path)), ".cache")
+    applicable_control_ids = [control_id.strip() for control_id in args.controls.split(",") if control_id.strip()]
+
+    controls = get_iso_controls_from_db()
+    if not controls:
+        print("ERROR: No se pudieron cargar los controles. Ejecuta primero 'scripts/seed_database.py'.")
+        sys.exit(1)
+
+    writer = JsonlWriter(output_path)
+    # Los ficheros idénticos (mismo contenido) se analizan una sola vez y en la matriz reutilizan
+    # los resultados del original
+    unique_documents = {}
+    duplicates = {}
+    for file_path in find_documents(args.directory):
+        relative_path = os.path.relpath(file_path, args.directory)
+        file_hash = compute_file_hash(file_path)
+        if file_hash in unique_documents:
+            duplicates[relative_path] = unique_documents[file_hash][1]
+            writer.write({"type": "duplicate", "document": relative_path, "duplicate_of": duplicates[relative_path]})
+            print(f"'{relative_path}' es idéntico a '{duplicates[relative_path]}', se reutilizan sus resultados.")
+            continue
+        unique_documents[file_hash] = (file_path, relative_path)
+    print(f"Se auditarán {len(unique_documents)} documentos con {args.workers} en paralelo. Resultados en {output_path}.")
+
+    statuses = {}
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.workers), thread_name_prefix="batch-audit") as executor:
+        futures = {
+            executor.submit(audit_document, file_path, relative_path, file_hash, applicable_control_ids, writer, cache_dir, not args.no_cache): relative_path
+            for file_hash, (file_path, relative_path) in unique_documents.items()
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            relative_path = futures[future]
+            try:
+                statuses[relative_path] = future.result()
+                print(f"[{done}/{len(futures)}] {relative_path}: {'completado' if statuses[relative_path] else 'fallido'}.")
+            except Exception as e:
+                writer.write({"type": "document", "document": relative_path, "status": "failed", "error": str(e)})
+                print(f"[{done}/{len(futures)}] {relative_path}: error inesperado: {e}")
+    writer.close()
+
+    for relative_path, original in duplicates.items():
+        statuses[relative_path] = statuses.get(original, {})
+    documents = sorted(relative_path for relative_path, document_statuses in statuses.items() if document_statuses)
+    write_coverage_matrix(matrix_path, controls, documents, statuses, duplicates)
+    print(f"Auditoría completada en {time.perf_counter() - started:.1f}s. Matriz de cobertura en {matrix_path}.")
+
+if __name__ == "__main__":
+    print("--- Iniciando la auditoría por lotes ---")
+    main()
+    print("--- Script finalizado ---")
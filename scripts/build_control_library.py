@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+# Añadir el directorio raíz del proyecto al path para permitir importaciones desde 'services'
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from services.ai_analyzer import LIBRARY_PROMPT_VERSION, generate_library_text, get_iso_controls_from_db, get_llm_model_name
+from services.control_library import LIBRARY_KINDS, get_library_entries
+
+dotenv_path = os.path.join(project_root, '.env')
+if os.path.exists(dotenv_path):
+    load_dotenv(dotenv_path=dotenv_path)
+else:
+    print(f"ADVERTENCIA: No se encontró el fichero .env en la ruta esperada: {dotenv_path}")
+    load_dotenv()
+
+# Llamadas simultáneas al LLM. call_with_retry las reduce por su cuenta si Vertex AI devuelve 429.
+DEFAULT_LIBRARY_WORKERS = 8
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera los borradores de política y los riesgos de todos los controles y los guarda en la biblioteca de controles.")
+    parser.add_argument("--kinds", nargs="*", choices=LIBRARY_KINDS, default=list(LIBRARY_KINDS), help="Textos que se generan (por defecto, ambos).")
+    parser.add_argument("--controls", default="", help="IDs de los controles separados por comas (por defecto, todo el catálogo).")
+    parser.add_argument("--workers", type=int, default=DEFAULT_LIBRARY_WORKERS, help="Llamadas simultáneas al LLM.")
+    parser.add_argument("--force", action="store_true", help="Regenera también los textos que ya están en la biblioteca.")
+    args = parser.parse_args()
+
+    controls = get_iso_controls_from_db()
+    if not controls:
+        print("ERROR: No se pudieron cargar los controles. Ejecuta primero 'scripts/seed_database.py'.")
+        sys.exit(1)
+    if args.controls:
+        control_ids = {control_id.strip() for control_id in args.controls.split(",") if control_id.strip()}
+        controls = [control for control in controls if control["id"] in control_ids]
+
+    model_name = get_llm_model_name()
+    pending = []
+    for kind in args.kinds:
+        existing = {} if args.force else get_library_entries(kind, controls, model_name, LIBRARY_PROMPT_VERSION)
+        pending.extend((kind, control) for control in controls if control["id"] not in existing)
+        print(f"'{kind}': {len(controls) - len(existing)} de {len(controls)} controles por generar.")
+    if not pending:
+        print(f"La biblioteca ya está completa para '{model_name}' (prompt v{LIBRARY_PROMPT_VERSION}).")
+        return
+
+    start = time.perf_counter()
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, args.workers), thread_name_prefix="control-library") as executor:
+        futures = {executor.submit(generate_library_text, kind, control["id"], control["description"]): (kind, control["id"]) for kind, control in pending}
+        for done, future in enumerate(as_completed(futures), start=1):
+            kind, control_id = futures[future]
+            try:
+                future.result()
+                print(f"[{done}/{len(pending)}] {control_id} ({kind}) generado.")
+            except Exception as e:
+                failed.append((kind, control_id))
+                print(f"ERROR: [{done}/{len(pending)}] No se pudo generar {control_id} ({kind}): {e}")
+
+    print(f"Generados {len(pending) - len(failed)} textos en {time.perf_counter() - start:.1f} s con '{model_name}' (prompt v{LIBRARY_PROMPT_VERSION}).")
+    if failed:
+        print(f"ADVERTENCIA: {len(failed)} textos no se generaron; vuelve a ejecutar el script para reintentarlos.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    print("--- Iniciando la generación de la biblioteca de controles ---")
+    main()
+    print("--- Script finalizado ---")
@@ -0,0 +1,128 @@
+import os
+import sys
+import json
+import math
+import argparse
+from dotenv import load_dotenv
+
+# Añadir el directorio raíz del proyecto al path para permitir importaciones desde 'services'
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from services.vector_store_manager import EMBEDDING_MODEL, get_document_vectors, get_mongo_collection
+from services.ai_analyzer import get_iso_controls_from_db
+from services.analysis_jobs import ANALYSIS_JOBS_COLLECTION, JOB_COMPLETED
+from services.control_triage import compute_control_scores, save_triage_calibration
+
+dotenv_path = os.path.join(project_root, '.env')
+if os.path.exists(dotenv_path):
+    load_dotenv(dotenv_path=dotenv_path)
+else:
+    print(f"ADVERTENCIA: No se encontró el fichero .env en la ruta esperada: {dotenv_path}")
+    load_dotenv()
+
+# Estados del LLM que cuentan como "el documento trata el control" y como "no lo trata".
+POSITIVE_STATUSES = {"Covered", "Partially Covered"}
+NEGATIVE_STATUSES = {"Not Covered"}
+# Margen que se resta al umbral calculado, para no quedar justo en el positivo más bajo aceptado.
+THRESHOLD_MARGIN = 0.02
+# Por debajo de este número de positivos la calibración es poco fiable.
+MIN_POSITIVES = 20
+
+def load_labels_from_jobs() -> dict:
+    """Resultados del LLM de los trabajos completados: {doc_id: {control_id: estado}} (el más reciente por documento)."""
+    labels = {}
+    jobs = get_mongo_collection(ANALYSIS_JOBS_COLLECTION).find({"status": JOB_COMPLETED}, {"collection_name": 1, "results": 1}).sort("created_at", 1)
+    for job in jobs:
+        labels[job["collection_name"]] = {result["id"]: result for result in job.get("results", [])}
+    return labels
+
+def load_labels_from_jsonl(path: str) -> dict:
+    """Resultados de una auditoría por lotes (scripts/batch_audit.py): {doc_id: {control_id: resultado}}."""
+    labels = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get("type") == "result" and record.get("doc_id"):
+                labels.setdefault(record["doc_id"], {})[record["id"]] = record
+    return labels
+
+def calibrate(labels: dict, controls: list, recall: float) -> dict | None:
+    """
+    Calcula el umbral más alto que conserva al menos `recall` de los controles que el LLM
+    consideró cubiertos (total o parcialmente). Solo se usan resultados obtenidos con el LLM.
+    """
+    positives = []
+    negatives = []
+    for doc_id, results in labels.items():
+        if not len(get_document_vectors(doc_id)):
+            print(f"Se omite '{doc_id}': sus fragmentos ya no están en el almacén vectorial.")
+            continue
+        scores = compute_control_scores(controls, "", doc_id)
+        for control, score in zip(controls, scores.tolist()):
+            result = results.get(control["id"])
+            if not result or result.get("triaged") or result.get("carried_forward"):
+                continue
+            if result["status"] in POSITIVE_STATUSES:
+                positives.append(score)
+            elif result["status"] in NEGATIVE_STATUSES:
+                negatives.append(score)
+    if not positives:
+        return None
+
+    positives.sort()
+    # Índice del positivo más bajo que se conserva; se acota por si recall está fuera de (0, 1]
+    index = min(len(positives) - 1, max(0, math.floor((1 - recall) * len(positives))))
+    threshold = max(0.0, positives[index] - THRESHOLD_MARGIN)
+    skipped = sum(1 for score in negatives if score < threshold)
+    return {
+        "threshold": round(threshold, 4),
+        "target_recall": recall,
+        "recall": round(sum(1 for score in positives if score >= threshold) / len(positives), 4),
+        "positives": len(positives),
+        "negatives": len(negatives),
+        # Fracción de las llamadas al LLM de estos documentos que el triaje habría evitado
+        "llm_calls_saved_ratio": round(skipped / (len(positives) + len(negatives)), 4),
+        "documents": len(labels),
+    }
+
+def _parse_recall(value: str) -> float:
+    """Valida --recall: debe estar en el intervalo (0, 1]."""
+    try:
+        recall = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' no es un número.")
+    if not 0 < recall <= 1:
+        raise argparse.ArgumentTypeError(f"{value} no está en el intervalo (0, 1].")
+    return recall
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibra el umbral de similitud del triaje de controles con análisis anteriores del LLM.")
+    parser.add_argument("--jsonl", nargs="*", default=[], help="Salidas de scripts/batch_audit.py a usar además de los trabajos completados.")
+    parser.add_argument("--recall", type=_parse_recall, default=0.99, help="Fracción mínima de controles cubiertos que deben superar el umbral.")
+    parser.add_argument("--dry-run", action="store_true", help="Muestra el umbral sin guardarlo.")
+    args = parser.parse_args()
+
+    controls = get_iso_controls_from_db()
+    if not controls:
+        print("ERROR: No se pudieron cargar los controles. Ejecuta primero 'scripts/seed_database.py'.")
+        sys.exit(1)
+    labels = load_labels_from_jobs()
+    for path in args.jsonl:
+        labels.update(load_labels_from_jsonl(path))
+
+    calibration = calibrate(labels, controls, args.recall)
+    if calibration is None:
+        print("ERROR: No hay controles cubiertos en los análisis disponibles; analiza algunos documentos sin triaje antes de calibrar.")
+        sys.exit(1)
+    if calibration["positives"] < MIN_POSITIVES:
+        print(f"ADVERTENCIA: Solo hay {calibration['positives']} controles cubiertos; el umbral puede no ser representativo.")
+    print(f"Calibración para '{EMBEDDING_MODEL}': {calibration}")
+    if not args.dry_run:
+        save_triage_calibration(calibration.pop("threshold"), calibration)
+        print("Umbral guardado. Se usará en los análisis con ANALYSIS_TRIAGE_ENABLED=true salvo que se defina ANALYSIS_TRIAGE_THRESHOLD.")
+
+if __name__ == "__main__":
+    print("--- Iniciando la calibración del triaje ---")
+    main()
+    print("--- Script finalizado ---")
@@ -0,0 +1,110 @@
+import os
+import sys
+import argparse
+from dotenv import load_dotenv
+
+# Añadir el directorio raíz del proyecto al path para permitir importaciones desde 'services'
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from pymongo import InsertOne
+from services.mongo_collections import APPLICATION_COLLECTIONS
+from services.vector_store_manager import (
+    CHUNKS_COLLECTION, DB_NAME, EMBEDDING_MODEL, VECTOR_SEARCH_INDEX_NAME,
+    _compute_embedding_key, _get_mongo_client, compute_chunk_hash, get_chunks_collection, get_tenant,
+)
+
+dotenv_path = os.path.join(project_root, '.env')
+if os.path.exists(dotenv_path):
+    load_dotenv(dotenv_path=dotenv_path)
+else:
+    print(f"ADVERTENCIA: No se encontró el fichero .env en la ruta esperada: {dotenv_path}")
+    load_dotenv()
+
+BATCH_SIZE = 500
+
+# Definición del índice de Atlas Vector Search para la colección compartida.
+VECTOR_SEARCH_INDEX_DEFINITION = {
+    "fields": [
+        {"type": "vector", "path": "embedding", "numDimensions": 384, "similarity": "cosine"},
+        {"type": "filter", "path": "doc_id"},
+        {"type": "filter", "path": "tenant"},
+    ]
+}
+
+def _is_chunk_collection(collection) -> bool:
+    """Una colección por documento se reconoce porque sus elementos tienen texto y embedding."""
+    sample = collection.find_one({}, {"text": 1, "embedding": 1})
+    return bool(sample) and "text" in sample and "embedding" in sample
+
+def migrate_collection(collection, tenant: str, dry_run: bool) -> int:
+    """
+    Copia los fragmentos de una colección por documento a la colección compartida, con el nombre
+    de la colección como doc_id. Los embeddings se copian tal cual, sin recalcularlos.
+    Devuelve el número de fragmentos copiados.
+    """
+    doc_id = collection.name
+    target = get_chunks_collection()
+    already_migrated = {doc["embedding_key"] for doc in target.find({"tenant": tenant, "doc_id": doc_id}, {"_id": 0, "embedding_key": 1})}
+
+    operations = []
+    copied = 0
+    for position, doc in enumerate(collection.find({}).sort("chunk_id", 1)):
+        key = _compute_embedding_key(doc["text"])
+        if key in already_migrated:
+            continue
+        already_migrated.add(key)
+        operations.append(InsertOne({
+            "embedding_key": key,
+            "text": doc["text"],
+            # Las colecciones anteriores a las claves por hash pueden no tener chunk_id
+            "chunk_id": doc.get("chunk_id", position),
+            "chunk_hash": compute_chunk_hash(doc["text"]),
+            "embedding_model": doc.get("embedding_model", EMBEDDING_MODEL),
+            "doc_id": doc_id,
+            "tenant": tenant,
+            "version": None,
+            "embedding": doc["embedding"],
+        }))
+        if len(operations) >= BATCH_SIZE:
+            if not dry_run:
+                target.bulk_write(operations, ordered=False)
+            copied += len(operations)
+            operations = []
+    if operations:
+        if not dry_run:
+            target.bulk_write(operations, ordered=False)
+        copied += len(operations)
+    return copied
+
+def main():
+    parser = argparse.ArgumentParser(description=f"Migra las colecciones de fragmentos por documento a la colección compartida '{CHUNKS_COLLECTION}'.")
+    parser.add_argument("--tenant", default=None, help="Tenant de los documentos migrados (por defecto TENANT_ID o 'default').")
+    parser.add_argument("--drop", action="store_true", help="Elimina cada colección antigua tras migrarla.")
+    parser.add_argument("--dry-run", action="store_true", help="Muestra lo que se migraría sin escribir nada.")
+    args = parser.parse_args()
+    tenant = args.tenant or get_tenant()
+
+    database = _get_mongo_client()[DB_NAME]
+    total = 0
+    for name in sorted(database.list_collection_names()):
+        if name in APPLICATION_COLLECTIONS or name.startswith("system."):
+            continue
+        collection = database[name]
+        if not _is_chunk_collection(collection):
+            print(f"Se omite la colección '{name}': no contiene fragmentos con embeddings.")
+            continue
+        copied = migrate_collection(collection, tenant, args.dry_run)
+        total += copied
+        print(f"Colección '{name}': {copied} fragmentos {'se migrarían' if args.dry_run else 'migrados'} como doc_id='{name}'.")
+        if args.drop and not args.dry_run:
+            collection.drop()
+            print(f"Colección '{name}' eliminada.")
+
+    print(f"Total: {total} fragmentos. Recuerda definir en Atlas el índice vectorial '{VECTOR_SEARCH_INDEX_NAME}' "
+          f"sobre '{CHUNKS_COLLECTION}' con esta definición: {VECTOR_SEARCH_INDEX_DEFINITION}")
+
+if __name__ == "__main__":
+    print(f"--- Iniciando la migración a la colección compartida '{CHUNKS_COLLECTION}' ---")
+    main()
+    print("--- Script finalizado ---")
@@ -0,0 +1,34 @@
+import os
+import sys
+from dotenv import load_dotenv
+
+# Añadir el directorio raíz del proyecto al path para permitir importaciones desde 'services'
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+# Cargar variables de entorno de forma robusta, especificando la ruta al fichero .env
+dotenv_path = os.path.join(project_root, '.env')
+if os.path.exists(dotenv_path):
+    load_dotenv(dotenv_path=dotenv_path)
+else:
+    print(f"ADVERTENCIA: No se encontró el fichero .env en la ruta esperada: {dotenv_path}")
+    load_dotenv()
+
+from services.embedding_service import serve_embeddings
+from services.vector_store_manager import EMBEDDING_MODEL, create_local_embeddings
+
+if __name__ == "__main__":
+    # Misma dirección que usarán los workers de la aplicación para conectarse.
+    address = os.getenv('EMBEDDING_SERVICE_ADDRESS')
+    if not address:
+        print("ERROR: Define EMBEDDING_SERVICE_ADDRESS (ruta de un socket Unix o 'host:puerto') en el fichero .env.")
+        sys.exit(1)
+    if not os.getenv('EMBEDDING_SERVICE_AUTHKEY'):
+        print("ERROR: Define EMBEDDING_SERVICE_AUTHKEY con una clave secreta (la misma en el servicio y en la aplicación). Genera una con: python -c \"import secrets; print(secrets.token_hex(32))\"")
+        sys.exit(1)
+
+    print(f"--- Cargando el modelo de embeddings '{EMBEDDING_MODEL}' ---")
+    try:
+        serve_embeddings(create_local_embeddings(), address)
+    except KeyboardInterrupt:
+        print("--- Servicio de embeddings detenido ---")
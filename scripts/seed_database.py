@@ -7,6 +7,8 @@ project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(project_root)
 
 from services.vector_store_manager import get_mongo_collection
+from services.control_catalog import bump_catalog_version
+from services.mongo_collections import CONTROLS_COLLECTION
 
 # Cargar variables de entorno de forma robusta, especificando la ruta al fichero .env
 # Esto asegura que el script funcione sin importar desde qué directorio se ejecute.
@@ -126,7 +128,7 @@ def seed_controls():
     """
     try:
         # El nombre de la colección donde se guardarán los controles.
-        controls_collection_name = "iso_27001_controls"
+        controls_collection_name = CONTROLS_COLLECTION
         controls_collection = get_mongo_collection(controls_collection_name)
 
         print(f"Conectado a la base de datos. Preparando para poblar la colección '{controls_collection_name}'...")
@@ -138,6 +140,10 @@ def seed_controls():
         # Insertar la lista completa de controles
         result = controls_collection.insert_many(ALL_ISO_27001_CONTROLS)
         print(f"¡Éxito! Se han insertado {len(result.inserted_ids)} controles en la colección '{controls_collection_name}'.")
+
+        # Nueva versión del catálogo: las aplicaciones en marcha recargan su copia en memoria
+        version = bump_catalog_version(controls_collection_name)
+        print(f"Catálogo '{controls_collection_name}' actualizado a la versión {version}.")
         print("La base de datos está lista para ser usada por la aplicación.")
 
     except Exception as e:
@@ -1,20 +1,38 @@
 import os
-from langchain_google_vertexai import ChatVertexAI
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from langchain_core.prompts import PromptTemplate
 # Importar la excepción específica para una mejor gestión de errores
 from google.api_core import exceptions as google_exceptions
 from langchain_core.output_parsers import JsonOutputParser
 from pydantic import BaseModel, Field
 from langchain_core.runnables import RunnablePassthrough
-from .vector_store_manager import get_vector_store_retriever, get_mongo_collection
+from .vector_store_manager import get_retriever_pool_key, get_tenant, get_vector_store_retriever, retrieve_relevant_chunks, split_document, compute_chunk_hash
+from .analysis_cache import get_cached_results, is_cache_enabled, store_results
+from .document_processor import compute_document_hash
+from .control_catalog import DEFAULT_CATALOG, get_control_catalog, get_control_theme
+from .analysis_history import get_previous_analysis, save_analysis
+from .runtime import init_vertex_ai, timed_phase
+from .metrics import LLMMetricsCallback, increment, span, trace_analysis
+from .rate_limiter import RETRYABLE_EXCEPTIONS, acall_with_retry, astream_with_retry, call_with_retry, stream_with_retry
+from .control_triage import is_triage_enabled, triage_controls
+from .lru_cache import LRUCache
+from .chat_cache import find_cached_answer, get_chat_cache_scope, store_answer
+from .control_library import LIBRARY_POLICY_DRAFT, LIBRARY_RISKS, get_library_entry, store_library_entry
+from .token_budget import PROMPT_OVERHEAD_TOKENS, check_token_budget, estimate_tokens, get_context_cache_variant, merge_section_verdicts, plan_document_context
 from langchain_core.output_parsers import StrOutputParser
 
 # --- Refactorización: Inicialización diferida (Lazy Loading) del LLM ---
 # No creamos la instancia del modelo al cargar el fichero.
-# La crearemos la primera vez que se necesite para asegurar que `vertexai.init()`
-# ya ha sido llamado por la aplicación principal (app.py).
+# La crearemos la primera vez que se necesite; antes se inicializa Vertex AI
+# (también de forma diferida), así que importar este módulo no conecta con Google Cloud.
 _llm_instance = None
 
+def get_llm_model_name() -> str:
+    """Nombre del modelo Gemini configurado en GEMINI_MODEL_NAME."""
+    return os.getenv('GEMINI_MODEL_NAME', 'gemini-2.5-flash') # Usar un fallback robusto
+
 def get_llm():
     """
     Obtiene una instancia singleton del modelo LLM.
@@ -22,25 +40,75 @@ def get_llm():
     """
     global _llm_instance
     if _llm_instance is None:
+        init_vertex_ai()
+        with timed_phase("llm_client"):
+            from langchain_google_vertexai import ChatVertexAI
         # La temperatura se puede variar si es necesario, pero para análisis es mejor 0.
         # Siendo explícitos con la ubicación para evitar ambigüedades.
         location = os.getenv('GOOGLE_CLOUD_LOCATION')
-        model_name = os.getenv('GEMINI_MODEL_NAME', 'gemini-2.5-flash') # Usar un fallback robusto
+        model_name = get_llm_model_name()
         _llm_instance = ChatVertexAI(
             model_name=model_name,
             temperature=0,
-            location=location
+            location=location,
+            # Los reintentos los hacen call_with_retry (que además adapta la concurrencia a la cuota)
+            # y sus variantes para streams y llamadas asíncronas, en todas las rutas que usan el LLM
+            max_retries=0,
+            callbacks=[LLMMetricsCallback(model_name)],
         )
     return _llm_instance
 
-def get_iso_controls_from_db() -> list:
+# Número máximo de llamadas simultáneas al LLM durante el análisis de cobertura.
+# Con 1 se recupera el comportamiento secuencial original.
+DEFAULT_ANALYSIS_MAX_CONCURRENCY = 8
+
+def _get_env_int(name: str, default: int) -> int:
+    """Lee un entero positivo de una variable de entorno, con valor por defecto si no es válido."""
+    try:
+        return max(1, int(os.getenv(name, default)))
+    except ValueError:
+        return default
+
+def _get_analysis_max_concurrency() -> int:
+    """Lee el límite de concurrencia del análisis desde ANALYSIS_MAX_CONCURRENCY."""
+    return _get_env_int('ANALYSIS_MAX_CONCURRENCY', DEFAULT_ANALYSIS_MAX_CONCURRENCY)
+
+def _run_concurrently(func, items: list, max_concurrency: int, on_complete=None) -> list:
     """
-    Obtiene la lista completa de controles de la ISO 27001 desde la base de datos MongoDB.
+    Ejecuta `func` sobre cada elemento con un pool acotado de hilos y devuelve
+    los resultados en el mismo orden que `items`.
+    Si se indica, `on_complete(resultado)` se llama en cuanto termina cada elemento.
+    Si alguna llamada falla, se cancelan las pendientes y se relanza la excepción.
+    """
+    if max_concurrency <= 1 or len(items) <= 1:
+        results = []
+        for item in items:
+            results.append(func(item))
+            if on_complete:
+                on_complete(results[-1])
+        return results
+
+    results = [None] * len(items)
+    executor = ThreadPoolExecutor(max_workers=min(max_concurrency, len(items)))
+    try:
+        # Cada tarea se ejecuta con una copia del contexto para conservar la traza y sus etiquetas
+        futures = {executor.submit(contextvars.copy_context().run, func, item): index for index, item in enumerate(items)}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            if on_complete:
+                on_complete(results[futures[future]])
+    finally:
+        # Si ha habido un error no tiene sentido seguir gastando cuota en el resto.
+        executor.shutdown(wait=True, cancel_futures=True)
+    return results
+
+def get_iso_controls_from_db(catalog_name: str = DEFAULT_CATALOG) -> list:
+    """
+    Obtiene la lista completa de controles de la ISO 27001. El catálogo se lee de MongoDB
+    una vez y se mantiene en memoria hasta que cambia su versión (ver control_catalog.py).
     """
     try:
-        controls_collection = get_mongo_collection("iso_27001_controls")
-        # Proyectamos para excluir el _id de MongoDB y solo devolver id y description
-        controls = list(controls_collection.find({}, {"_id": 0, "id": 1, "description": 1}))
+        controls = list(get_control_catalog(catalog_name).controls)
         if not controls:
             print("ADVERTENCIA: La colección de controles 'iso_27001_controls' está vacía o no existe.")
             print("Por favor, ejecuta el script 'scripts/seed_database.py' para poblarla.")
@@ -55,19 +123,21 @@ class ControlAnalysis(BaseModel):
     status: str = Field(description="Uno de: 'Covered', 'Partially Covered', 'Not Covered', 'Not Applicable'")
     justification: str = Field(description="Explicación concisa del razonamiento basado en el documento.")
 
-def analyze_document_coverage(document_text: str, applicable_control_ids: list) -> list:
-    """
-    Analiza el texto de un documento contra los controles de la ISO 27001,
-    considerando cuáles han sido marcados como aplicables por el usuario.
-    """
-    # Si no se pasaron IDs, se asume que todos son aplicables (comportamiento por defecto)
-    all_applicable = not bool(applicable_control_ids)
-    iso_controls = get_iso_controls_from_db()
-    if not iso_controls:
-        return [{"error": "No se pudieron cargar los controles de la ISO 27001 desde la base de datos. Ejecuta el script de inicialización 'scripts/seed_database.py'."}]
+# Estado de un control que no se pudo analizar tras agotar los reintentos. No se guarda en la
+# caché, de modo que al repetir el análisis se vuelve a intentar.
+CONTROL_ERROR_STATUS = "Error"
 
-    try:
-        prompt_template = """
+class ControlAnalysisItem(ControlAnalysis):
+    control_id: str = Field(description="ID exacto del control analizado, por ejemplo 'A.5.1'.")
+
+class ControlAnalysisBatch(BaseModel):
+    results: list[ControlAnalysisItem] = Field(description="Un elemento por cada control solicitado.")
+
+# Versión de los prompts de análisis. Debe incrementarse cada vez que se modifiquen
+# CONTROL_ANALYSIS_PROMPT o BATCH_CONTROL_ANALYSIS_PROMPT para invalidar la caché de resultados.
+PROMPT_TEMPLATE_VERSION = "1"
+
+CONTROL_ANALYSIS_PROMPT = """
         Eres un experto auditor de ciberseguridad especializado en la norma ISO 27001:2022.
         Tu tarea es analizar el texto del documento proporcionado y determinar si cubre el control específico del Anexo A.
 
@@ -84,31 +154,438 @@ def analyze_document_coverage(document_text: str, applicable_control_ids: list)
         {format_instructions}
         """
 
-        # Usar un parser de JSON para una salida estructurada y fiable.
-        output_parser = JsonOutputParser(pydantic_object=ControlAnalysis)
-        
-        prompt = PromptTemplate(
-            template=prompt_template,
-            input_variables=["document_text", "control_id", "control_description"],
-            partial_variables={"format_instructions": output_parser.get_format_instructions()},
-        )
-        
-        chain = prompt | get_llm() | output_parser
+BATCH_CONTROL_ANALYSIS_PROMPT = """
+        Eres un experto auditor de ciberseguridad especializado en la norma ISO 27001:2022.
+        Tu tarea es analizar el texto del documento proporcionado y determinar, para CADA UNO de los controles del Anexo A listados, si el documento lo cubre.
 
-        results = []
-        for control in iso_controls:
-            if all_applicable or control["id"] in applicable_control_ids:
-                # Si el control es aplicable, se analiza con la IA
-                analysis_result = chain.invoke({"document_text": document_text, "control_id": control["id"], "control_description": control["description"]})
-                results.append({**control, **analysis_result})
-            else:
-                # Si no es aplicable, se marca como tal sin llamar a la IA
-                results.append({
-                    **control, 
-                    "status": "Not Applicable", 
-                    "justification": "Definido como no aplicable por el usuario en la Declaración de Aplicabilidad."})
+        DOCUMENTO: 
+        ---
+        {document_text}
+        ---
 
-        return results
+        CONTROLES A ANALIZAR:
+        {controls}
+
+        Devuelve exactamente un resultado por control, usando su ID tal y como aparece en la lista.
+        RESPONDE ÚNICAMENTE con un objeto JSON que se ajuste al siguiente esquema. No añadas texto antes o después del JSON.
+        {format_instructions}
+        """
+
+# Número de controles que se evalúan en una misma llamada al LLM (modo por lotes).
+# Con 1 cada control se analiza con su propio prompt.
+DEFAULT_ANALYSIS_BATCH_SIZE = 1
+
+def _get_analysis_batch_size() -> int:
+    """Lee el tamaño de lote del análisis desde ANALYSIS_BATCH_SIZE."""
+    return _get_env_int('ANALYSIS_BATCH_SIZE', DEFAULT_ANALYSIS_BATCH_SIZE)
+
+# Contexto que recibe el LLM para cada control:
+#  - 'full': el texto completo del documento (comportamiento original).
+#  - 'retrieval': solo los fragmentos más relevantes para el control, recuperados del almacén vectorial.
+DEFAULT_ANALYSIS_CONTEXT_MODE = 'full'
+# Número de fragmentos recuperados por control y presupuesto aproximado de tokens de evidencia por control.
+DEFAULT_EVIDENCE_TOP_K = 4
+DEFAULT_EVIDENCE_TOKEN_BUDGET = 2000
+
+def _build_evidence(retrieve, controls: list, top_k: int, token_budget: int) -> tuple:
+    """
+    Recupera (con `retrieve(control)`) los fragmentos más relevantes para cada control y los combina en un bloque
+    de evidencia etiquetado con el ID de cada fragmento, sin superar el presupuesto de
+    tokens (`token_budget` por control). Los fragmentos se van tomando por orden de
+    relevancia de forma alterna entre controles para que todos reciban evidencia.
+
+    Devuelve (texto_de_evidencia, {control_id: [fragmentos usados]}).
+    """
+    retrieved = {control["id"]: retrieve(control) for control in controls}
+
+    budget = token_budget * len(controls)
+    used_tokens = 0
+    included = {}
+    for rank in range(top_k):
+        for control in controls:
+            chunks = retrieved[control["id"]]
+            if rank >= len(chunks) or chunks[rank]["chunk_id"] in included:
+                continue
+            chunk_tokens = estimate_tokens(chunks[rank]["text"])
+            if used_tokens + chunk_tokens > budget and included:
+                continue
+            included[chunks[rank]["chunk_id"]] = chunks[rank]["text"]
+            used_tokens += chunk_tokens
+
+    evidence_text = "\n\n".join(
+        f"[Fragmento {chunk_id}]\n{text}" for chunk_id, text in sorted(included.items(), key=lambda item: (item[0] is None, item[0] or 0))
+    )
+    evidence_chunks = {
+        control["id"]: [chunk for chunk in retrieved[control["id"]] if chunk["chunk_id"] in included]
+        for control in controls
+    }
+    return evidence_text, evidence_chunks
+
+def _set_evidence(result: dict, chunks: list):
+    """Anota en el resultado los fragmentos usados como evidencia y su página o párrafo en el documento."""
+    result["evidence_chunk_ids"] = [chunk["chunk_id"] for chunk in chunks]
+    result["evidence_locations"] = [chunk.get("location") for chunk in chunks]
+
+def _group_controls(controls: list, batch_size: int) -> list:
+    """
+    Agrupa los controles en lotes de como máximo `batch_size` elementos,
+    sin mezclar controles de distintos temas del Anexo A (A.5, A.6, A.7, A.8).
+    """
+    if batch_size <= 1:
+        return [[control] for control in controls]
+
+    # Los temas salen del índice del catálogo en memoria, en el orden del catálogo
+    pending = {control["id"]: control for control in controls}
+    themes = {}
+    for theme, theme_controls in get_control_catalog().by_theme.items():
+        themes[theme] = [pending.pop(control["id"]) for control in theme_controls if control["id"] in pending]
+    for control in pending.values():
+        # Controles que no están en el catálogo por defecto
+        themes.setdefault(get_control_theme(control["id"]), []).append(control)
+
+    groups = []
+    for theme_controls in themes.values():
+        for i in range(0, len(theme_controls), batch_size):
+            groups.append(theme_controls[i:i + batch_size])
+    return groups
+
+def _build_control_chain():
+    """Construye la cadena LCEL que analiza un único control."""
+    output_parser = JsonOutputParser(pydantic_object=ControlAnalysis)
+    prompt = PromptTemplate(
+        template=CONTROL_ANALYSIS_PROMPT,
+        input_variables=["document_text", "control_id", "control_description"],
+        partial_variables={"format_instructions": output_parser.get_format_instructions()},
+    )
+    return prompt | get_llm() | output_parser
+
+def _build_batch_chain():
+    """Construye la cadena LCEL que analiza varios controles en una sola llamada."""
+    output_parser = JsonOutputParser(pydantic_object=ControlAnalysisBatch)
+    prompt = PromptTemplate(
+        template=BATCH_CONTROL_ANALYSIS_PROMPT,
+        input_variables=["document_text", "controls"],
+        partial_variables={"format_instructions": output_parser.get_format_instructions()},
+    )
+    return prompt | get_llm() | output_parser
+
+def _parse_batch_response(response, expected_ids: set) -> dict:
+    """
+    Valida la respuesta del modo por lotes y la indexa por ID de control.
+    Los elementos mal formados o con IDs que no se pidieron se descartan.
+    """
+    parsed = {}
+    items = response.get("results", []) if isinstance(response, dict) else []
+    for item in items:
+        try:
+            analysis = ControlAnalysisItem(**item)
+        except Exception:
+            continue
+        if analysis.control_id in expected_ids and analysis.control_id not in parsed:
+            parsed[analysis.control_id] = {"status": analysis.status, "justification": analysis.justification}
+    return parsed
+
+def _carry_forward_unchanged(previous: dict, chunk_hashes: list, controls: list, get_evidence_hashes, max_concurrency: int) -> list:
+    """
+    Compara los fragmentos actuales con los del análisis anterior y devuelve, para los controles
+    cuya evidencia (anterior y actual) no contiene fragmentos añadidos ni eliminados, el
+    resultado anterior marcado con 'carried_forward'.
+    """
+    changed_chunks = set(chunk_hashes) ^ set(previous.get("chunk_hashes", []))
+    previous_results = {result["id"]: result for result in previous.get("results", [])}
+    previous_evidence = {entry["control_id"]: set(entry["chunk_hashes"]) for entry in previous.get("evidence", [])}
+
+    candidates = [control for control in controls if control["id"] in previous_results and control["id"] in previous_evidence]
+    current_evidence = _run_concurrently(get_evidence_hashes, candidates, max_concurrency)
+
+    carried = []
+    for control, evidence_hashes in zip(candidates, current_evidence):
+        if changed_chunks & (previous_evidence[control["id"]] | set(evidence_hashes)):
+            continue
+        carried.append({**previous_results[control["id"]], **control, "carried_forward": True})
+    return carried
+
+def _estimate_analysis_tokens(groups: list, sections: list, evidence_token_budget: int) -> tuple:
+    """
+    Estima los tokens de entrada y el número de llamadas al LLM necesarios para analizar `groups`:
+    cada grupo se envía una vez por sección en el modo 'full' (`sections`) o con su evidencia en
+    el modo 'retrieval' (`sections` vacío). Devuelve (tokens, llamadas).
+    """
+    tokens = 0
+    calls = 0
+    for group in groups:
+        controls_tokens = sum(estimate_tokens(control["description"]) for control in group)
+        if sections:
+            tokens += sum(estimate_tokens(section) + controls_tokens + PROMPT_OVERHEAD_TOKENS for section in sections)
+            calls += len(sections)
+        else:
+            tokens += evidence_token_budget * len(group) + controls_tokens + PROMPT_OVERHEAD_TOKENS
+            calls += 1
+    return tokens, calls
+
+def analyze_document_coverage(document_text: str, applicable_control_ids: list, max_concurrency: int | None = None, batch_size: int | None = None, collection_name: str | None = None, context_mode: str | None = None, use_cache: bool = True, incremental: bool | None = None, on_result=None, document_hash: str | None = None, completed_results: list | None = None, triage: bool | None = None) -> list:
+    """
+    Analiza el texto de un documento contra los controles de la ISO 27001,
+    considerando cuáles han sido marcados como aplicables por el usuario.
+    Los controles aplicables se analizan en paralelo (hasta `max_concurrency` llamadas
+    simultáneas, por defecto ANALYSIS_MAX_CONCURRENCY) y los resultados se devuelven
+    en el orden del catálogo.
+    Con `batch_size` > 1 (por defecto ANALYSIS_BATCH_SIZE) se evalúan varios controles
+    del mismo tema en una sola llamada; los que falten en la respuesta se analizan
+    después de forma individual.
+    Con `context_mode='retrieval'` (por defecto ANALYSIS_CONTEXT_MODE) cada control se
+    evalúa solo contra los fragmentos de `collection_name` más relevantes para él, y el
+    resultado incluye en 'evidence_chunk_ids' los fragmentos usados.
+    Los resultados se guardan en una caché de MongoDB indexada por el hash del documento,
+    el control, el modelo y la versión del prompt; `use_cache=False` fuerza un nuevo
+    análisis (el resultado se sigue guardando).
+    Con `incremental=True` (por defecto ANALYSIS_INCREMENTAL) y `collection_name`, se compara
+    el documento con su análisis anterior fragmento a fragmento y solo se vuelven a analizar
+    los controles cuya evidencia toca fragmentos modificados; el resto se arrastra del
+    análisis anterior marcado con 'carried_forward'.
+    Si se indica, `on_result(resultado)` se llama con el resultado de cada control en cuanto
+    está disponible (en orden de finalización), para poder mostrar el progreso.
+    `document_hash` es el hash del texto ya calculado por `load_document`; si no se indica, se calcula.
+    En el modo 'full', un documento que supera ANALYSIS_PROMPT_TOKEN_LIMIT se analiza por secciones
+    y se combinan los veredictos de cada control, o se avisa o rechaza según ANALYSIS_OVERSIZE_POLICY
+    (ver token_budget.py). Los tokens de entrada estimados del análisis se comparan con
+    ANALYSIS_TOKEN_BUDGET antes de llamar al LLM.
+    Las llamadas al LLM pasan por un limitador de concurrencia adaptativo y los errores
+    transitorios (429, 503...) se reintentan con espera exponencial (ver rate_limiter.py). Si se
+    agotan los reintentos, el control se devuelve con estado 'Error' y el resto sigue adelante.
+    Cada grupo de resultados se guarda en la caché en cuanto termina, así que un análisis
+    interrumpido se reanuda desde la caché; `completed_results` son resultados ya obtenidos por
+    una ejecución anterior (por ejemplo, los de un trabajo), que no se repiten ni se notifican.
+    Con `triage=True` (por defecto ANALYSIS_TRIAGE_ENABLED) los controles cuya descripción no se
+    parece a ningún fragmento del documento se marcan como 'Not Covered' con 'triaged' sin
+    llamar al LLM (ver control_triage.py).
+    """
+    with trace_analysis("analysis", document=collection_name), span("analysis", document=collection_name):
+        return _analyze_document_coverage(document_text, applicable_control_ids, max_concurrency, batch_size, collection_name, context_mode, use_cache, incremental, on_result, document_hash, completed_results, triage)
+
+def _analyze_document_coverage(document_text: str, applicable_control_ids: list, max_concurrency: int | None = None, batch_size: int | None = None, collection_name: str | None = None, context_mode: str | None = None, use_cache: bool = True, incremental: bool | None = None, on_result=None, document_hash: str | None = None, completed_results: list | None = None, triage: bool | None = None) -> list:
+    """Implementación de analyze_document_coverage, dentro de su traza."""
+    # Si no se pasaron IDs, se asume que todos son aplicables (comportamiento por defecto)
+    all_applicable = not bool(applicable_control_ids)
+    iso_controls = get_iso_controls_from_db()
+    if not iso_controls:
+        return [{"error": "No se pudieron cargar los controles de la ISO 27001 desde la base de datos. Ejecuta el script de inicialización 'scripts/seed_database.py'."}]
+
+    if context_mode is None:
+        context_mode = os.getenv('ANALYSIS_CONTEXT_MODE', DEFAULT_ANALYSIS_CONTEXT_MODE).lower()
+    use_retrieval = context_mode == 'retrieval'
+    if use_retrieval and not collection_name:
+        print("ADVERTENCIA: El modo 'retrieval' necesita la colección vectorial del documento. Se usará el texto completo.")
+        use_retrieval = False
+    evidence_top_k = _get_env_int('ANALYSIS_EVIDENCE_TOP_K', DEFAULT_EVIDENCE_TOP_K)
+    evidence_token_budget = _get_env_int('ANALYSIS_EVIDENCE_TOKEN_BUDGET', DEFAULT_EVIDENCE_TOKEN_BUDGET)
+    # En el modo 'full' el documento se envía completo o, si no cabe en un prompt, por secciones.
+    # Las secciones se calculan (contando tokens con el modelo) solo si quedan controles por analizar.
+    sections = []
+
+    if incremental is None:
+        incremental = os.getenv('ANALYSIS_INCREMENTAL', 'false').lower() in ('true', '1', 'yes')
+    if incremental and not collection_name:
+        print("ADVERTENCIA: El modo incremental necesita la colección vectorial del documento. Se hará un análisis completo.")
+        incremental = False
+
+    # Los fragmentos recuperados para cada control se reutilizan entre la evidencia del prompt
+    # y el seguimiento de cambios del modo incremental.
+    retrieved_chunks = {}
+
+    def retrieve_for_control(control: dict) -> list:
+        if control["id"] not in retrieved_chunks:
+            retrieved_chunks[control["id"]] = retrieve_relevant_chunks(collection_name, f"{control['id']} {control['description']}", k=evidence_top_k)
+        return retrieved_chunks[control["id"]]
+
+    def get_context(group: list) -> tuple:
+        """Devuelve el texto que verá el LLM para el grupo y los fragmentos citados por control."""
+        if not use_retrieval:
+            return document_text, {}
+        return _build_evidence(retrieve_for_control, group, evidence_top_k, evidence_token_budget)
+
+    def get_evidence_hashes(control: dict) -> list:
+        """Hashes de los fragmentos que sirven de evidencia para el control."""
+        return [compute_chunk_hash(chunk["text"]) for chunk in retrieve_for_control(control)]
+
+    try:
+        # Las cadenas se construyen solo si hay controles que analizar con el LLM
+        chain = None
+        batch_chain = None
+
+        def analyze_control(control: dict, context: str | None = None, evidence_chunks: dict | None = None) -> dict:
+            if context is None:
+                context, evidence_chunks = get_context([control])
+            with span("llm_call", control_id=control["id"]):
+                analysis_result = call_with_retry(lambda: chain.invoke({"document_text": context, "control_id": control["id"], "control_description": control["description"]}))
+            result = {**control, **analysis_result}
+            if use_retrieval:
+                _set_evidence(result, evidence_chunks.get(control["id"], []))
+            return result
+
+        def analyze_group(group: list) -> list:
+            try:
+                if len(sections) > 1:
+                    return analyze_group_by_sections(group)
+                context, evidence_chunks = get_context(group)
+                return analyze_group_in_context(group, context, evidence_chunks)
+            except RETRYABLE_EXCEPTIONS as e:
+                # Solo se pierden los controles de este grupo; el resto del análisis continúa
+                print(f"ERROR: No se pudo analizar {', '.join(control['id'] for control in group)} tras agotar los reintentos: {e}")
+                increment("analysis_control_errors_total", len(group), error_type=type(e).__name__)
+                return [{
+                    **control,
+                    "status": CONTROL_ERROR_STATUS,
+                    "justification": "No se pudo analizar el control por un error temporal del servicio de IA (cuota o disponibilidad). Vuelve a lanzar el análisis para completarlo: los controles ya analizados no se repiten.",
+                } for control in group]
+
+        def analyze_group_by_sections(group: list) -> list:
+            """Map-reduce: analiza el grupo en cada sección y combina los veredictos de cada control."""
+            section_results = [analyze_group_in_context(group, section, {}) for section in sections]
+            merged = []
+            for index, control in enumerate(group):
+                verdicts = [results[index] for results in section_results]
+                merged.append({**control, **merge_section_verdicts(verdicts), "sections_analyzed": len(sections)})
+            return merged
+
+        def analyze_group_in_context(group: list, context: str, evidence_chunks: dict) -> list:
+            if len(group) == 1:
+                return [analyze_control(group[0], context, evidence_chunks)]
+
+            controls_text = "\n        ".join(f"- ID: {control['id']} | Descripción: {control['description']}" for control in group)
+            with span("llm_call", control_id=",".join(control["id"] for control in group)):
+                response = call_with_retry(lambda: batch_chain.invoke({"document_text": context, "controls": controls_text}))
+            parsed = _parse_batch_response(response, {control["id"] for control in group})
+
+            group_results = []
+            for control in group:
+                if control["id"] in parsed:
+                    result = {**control, **parsed[control["id"]]}
+                    if use_retrieval:
+                        _set_evidence(result, evidence_chunks.get(control["id"], []))
+                    group_results.append(result)
+                else:
+                    # El modelo omitió este control: se reintenta con un prompt individual
+                    print(f"ADVERTENCIA: El control {control['id']} no aparece en la respuesta por lotes. Se analiza individualmente.")
+                    group_results.append(analyze_control(control, context, evidence_chunks))
+            return group_results
+
+        def report(result: dict):
+            if on_result:
+                on_result(result)
+
+        # Solo los controles aplicables se envían a la IA
+        applicable_ids = set(applicable_control_ids or [])
+        pending_controls = [control for control in iso_controls if all_applicable or control["id"] in applicable_ids]
+        pending_ids = {control["id"] for control in pending_controls}
+        # Si no es aplicable, se marca como tal sin llamar a la IA
+        not_applicable = {
+            control["id"]: {
+                **control,
+                "status": "Not Applicable",
+                "justification": "Definido como no aplicable por el usuario en la Declaración de Aplicabilidad."}
+            for control in iso_controls if control["id"] not in pending_ids
+        }
+        # Los resultados de una ejecución anterior interrumpida ya se notificaron: no se repiten
+        reported_ids = {result.get("id") for result in completed_results or [] if result.get("status") != CONTROL_ERROR_STATUS}
+        for result in not_applicable.values():
+            if result["id"] not in reported_ids:
+                report(result)
+        if max_concurrency is None:
+            max_concurrency = _get_analysis_max_concurrency()
+        if batch_size is None:
+            batch_size = _get_analysis_batch_size()
+
+        # Los controles ya analizados con el mismo documento, modelo y prompt se sirven desde la caché
+        analyzed = {}
+        # Los resultados de una ejecución anterior se conservan sin volver a analizarlos
+        for result in completed_results or []:
+            if result.get("id") in pending_ids and result.get("status") != CONTROL_ERROR_STATUS:
+                analyzed[result["id"]] = result
+        pending_controls = [control for control in pending_controls if control["id"] not in analyzed]
+        if document_hash is None:
+            document_hash = compute_document_hash(document_text)
+        model_name = get_llm_model_name()
+        cache_variant = f"retrieval:k={evidence_top_k}:budget={evidence_token_budget}" if use_retrieval else "full" + get_context_cache_variant()
+        cache_enabled = is_cache_enabled()
+        if cache_enabled:
+            if use_cache:
+                cached = get_cached_results(document_hash, [control["id"] for control in pending_controls], model_name, PROMPT_TEMPLATE_VERSION, cache_variant)
+                for control in pending_controls:
+                    if control["id"] in cached:
+                        analyzed[control["id"]] = {**control, **cached[control["id"]]}
+                        report(analyzed[control["id"]])
+                pending_controls = [control for control in pending_controls if control["id"] not in analyzed]
+                if cached:
+                    print(f"Caché de análisis: {len(cached)} controles recuperados, {len(pending_controls)} pendientes de analizar.")
+
+        def checkpoint(results: list):
+            """Guarda en la caché los resultados en cuanto se obtienen, salvo los fallidos."""
+            if cache_enabled:
+                store_results(document_hash, [result for result in results if result["status"] != CONTROL_ERROR_STATUS], model_name, PROMPT_TEMPLATE_VERSION, cache_variant)
+
+        # Re-auditoría incremental: se arrastran los resultados de los controles cuya evidencia no ha cambiado
+        if incremental:
+            chunk_hashes = [compute_chunk_hash(chunk) for chunk in split_document(document_text)]
+            previous = get_previous_analysis(collection_name, model_name, PROMPT_TEMPLATE_VERSION, cache_variant)
+            if previous and use_cache and pending_controls:
+                carried = _carry_forward_unchanged(previous, chunk_hashes, pending_controls, get_evidence_hashes, max_concurrency)
+                for result in carried:
+                    if use_retrieval:
+                        # Las posiciones de los fragmentos pueden haber cambiado entre versiones
+                        _set_evidence(result, retrieved_chunks[result["id"]])
+                    analyzed[result["id"]] = result
+                    report(result)
+                checkpoint(carried)
+                pending_controls = [control for control in pending_controls if control["id"] not in analyzed]
+                print(f"Re-auditoría incremental: {len(carried)} controles sin cambios, {len(pending_controls)} pendientes de analizar.")
+
+        # Triaje por similitud: los controles que el documento no trata no llegan al LLM
+        if triage is None:
+            triage = is_triage_enabled()
+        if triage and pending_controls:
+            pending_controls, triaged = triage_controls(pending_controls, document_text, collection_name)
+            for result in triaged:
+                analyzed[result["id"]] = result
+                report(result)
+
+        groups = _group_controls(pending_controls, batch_size)
+        if pending_controls:
+            if not use_retrieval:
+                context_plan = plan_document_context(document_text, get_llm())
+                if context_plan["error"]:
+                    return [{"error": context_plan["error"]}]
+                sections = context_plan["sections"]
+            budget_error = check_token_budget(*_estimate_analysis_tokens(groups, sections, evidence_token_budget))
+            if budget_error:
+                return [{"error": budget_error}]
+            chain = _build_control_chain()
+            if batch_size > 1:
+                batch_chain = _build_batch_chain()
+
+        def report_group(group_results: list):
+            checkpoint(group_results)
+            for result in group_results:
+                report(result)
+
+        for group_results in _run_concurrently(analyze_group, groups, max_concurrency, on_complete=report_group):
+            for result in group_results:
+                analyzed[result["id"]] = result
+
+        failed = sum(1 for result in analyzed.values() if result["status"] == CONTROL_ERROR_STATUS)
+        if failed:
+            print(f"ADVERTENCIA: {failed} controles no se pudieron analizar. Se completarán al repetir el análisis.")
+
+        if incremental:
+            # Los controles fallidos o descartados en el triaje no se registran, para que no se arrastren en la siguiente versión
+            applicable_results = [result for result in analyzed.values() if result["status"] != CONTROL_ERROR_STATUS and not result.get("triaged")]
+            evidence = dict(zip(
+                (result["id"] for result in applicable_results),
+                _run_concurrently(get_evidence_hashes, applicable_results, max_concurrency)
+            ))
+            save_analysis(collection_name, document_hash, chunk_hashes, applicable_results, evidence, model_name, PROMPT_TEMPLATE_VERSION, cache_variant)
+
+        return [analyzed.get(control["id"]) or not_applicable[control["id"]] for control in iso_controls]
 
     except google_exceptions.NotFound as e:
         # Capturamos el error específico 404 y devolvemos un mensaje claro.
@@ -130,16 +607,7 @@ def analyze_document_coverage(document_text: str, applicable_control_ids: list)
         print(f"Ha ocurrido un error inesperado durante el análisis de la IA: {e}")
         return [{"error": "Ocurrió un error inesperado al contactar con el servicio de IA. Revisa la consola para más detalles."}]
 
-def answer_question_with_rag(question: str, collection_name: str) -> str:
-    """
-    Responde una pregunta utilizando el contexto de un documento (RAG).
-    """
-    try:
-        # 1. Obtener el retriever para la colección del documento específico
-        retriever = get_vector_store_retriever(collection_name)
-
-        # 2. Definir el prompt para el chat
-        prompt_template = """
+RAG_PROMPT_TEMPLATE = """
         Eres un asistente experto en la norma ISO 27001. Tu tarea es responder la pregunta del usuario basándote únicamente en el contexto proporcionado.
         Si el contexto no contiene la respuesta, di "La información no se encuentra en el documento proporcionado".
         Sé claro y conciso.
@@ -152,27 +620,49 @@ def answer_question_with_rag(question: str, collection_name: str) -> str:
 
         RESPUESTA:
         """
-        prompt = PromptTemplate.from_template(prompt_template)
-
-        # 3. Construir la cadena RAG con LCEL
-        rag_chain = (
-            {"context": retriever, "question": RunnablePassthrough()}
-            | prompt
-            | get_llm()
-            | StrOutputParser()
-        )
 
-        return rag_chain.invoke(question)
-    except Exception as e:
-        print(f"Error en la cadena RAG: {e}")
-        return "Ocurrió un error al procesar tu pregunta. Por favor, inténtalo de nuevo."
+# Número de cadenas RAG (una por documento) que se mantienen construidas, como los retrievers.
+DEFAULT_RAG_POOL_SIZE = 128
+_rag_prompt = None
+_rag_chains = None
 
-def generate_policy_draft(control_id: str, control_description: str) -> str:
+def _build_rag_chain(retriever):
+    """Construye la cadena RAG (LCEL) que responde preguntas sobre un documento."""
+    global _rag_prompt
+    # El prompt se analiza una sola vez y se comparte entre todas las cadenas
+    if _rag_prompt is None:
+        _rag_prompt = PromptTemplate.from_template(RAG_PROMPT_TEMPLATE)
+    return (
+        {"context": retriever, "question": RunnablePassthrough()}
+        | _rag_prompt
+        | get_llm()
+        | StrOutputParser()
+    )
+
+def _get_rag_chain(collection_name: str, version: str | None = None):
     """
-    Genera un borrador de política para un control de la ISO 27001 no cubierto.
+    Devuelve la cadena RAG del documento desde un pool LRU (RAG_POOL_SIZE), para no recomponerla
+    en cada pregunta. La clave es la misma que la de los retrievers (backend, tenant, documento y
+    versión) más el modelo configurado.
     """
-    try:
-        prompt_template = """
+    global _rag_chains
+    if _rag_chains is None:
+        _rag_chains = LRUCache("rag_chains", _get_env_int('RAG_POOL_SIZE', DEFAULT_RAG_POOL_SIZE))
+    key = get_retriever_pool_key(collection_name, get_tenant(), version) + (get_llm_model_name(),)
+    return _rag_chains.get_or_create(key, lambda: _build_rag_chain(get_vector_store_retriever(collection_name, version)))
+
+def _get_scope_version(scope: dict | None) -> str | None:
+    """Versión del documento ya consultada para la caché del chat (None si la caché no se usa)."""
+    return scope["version"] if scope else None
+
+# Versión de los prompts de borradores de política y riesgos. Debe incrementarse cada vez que se
+# modifiquen _build_policy_draft_chain o _build_risks_chain para que no se sirvan textos de la
+# biblioteca generados con el prompt anterior (ver control_library.py).
+LIBRARY_PROMPT_VERSION = "1"
+
+def _build_policy_draft_chain():
+    """Construye la cadena que redacta un borrador de política para un control."""
+    prompt_template = """
         Eres un consultor experto en ciberseguridad y la norma ISO 27001:2022.
         Tu tarea es redactar un borrador de una política o procedimiento básico para una organización que necesita cubrir un control específico del Anexo A.
         El borrador debe ser claro, conciso y práctico. Debe incluir un objetivo, un alcance y las principales directrices o responsabilidades.
@@ -185,23 +675,15 @@ def generate_policy_draft(control_id: str, control_description: str) -> str:
         No incluyas placeholders como "[Nombre de la Empresa]". Sé genérico.
         El formato de salida debe ser texto plano en Markdown.
         """
-        prompt = PromptTemplate.from_template(prompt_template)
-
-        # Para tareas creativas, es bueno aumentar la temperatura.
-        # Usamos .with_options() para no afectar la instancia global.
-        chain = prompt | get_llm().with_options(temperature=0.3) | StrOutputParser()
+    prompt = PromptTemplate.from_template(prompt_template)
 
-        return chain.invoke({"control_id": control_id, "control_description": control_description})
-    except Exception as e:
-        print(f"Error al generar el borrador de política: {e}")
-        return "Ocurrió un error al generar el borrador. Por favor, revisa la consola para más detalles."
+    # Para tareas creativas, es bueno aumentar la temperatura.
+    # Usamos .bind() para no afectar la instancia global.
+    return prompt | get_llm().bind(temperature=0.3) | StrOutputParser()
 
-def identify_risks_for_control(control_id: str, control_description: str) -> str:
-    """
-    Identifica riesgos potenciales para un control de la ISO 27001 no implementado.
-    """
-    try:
-        prompt_template = """
+def _build_risks_chain():
+    """Construye la cadena que identifica riesgos de un control no implementado."""
+    prompt_template = """
         Eres un experto en gestión de riesgos de ciberseguridad y la norma ISO 27001:2022.
         Tu tarea es identificar y describir brevemente 2 o 3 riesgos comunes que una organización enfrentaría si NO implementara el siguiente control.
 
@@ -215,12 +697,244 @@ def identify_risks_for_control(control_id: str, control_description: str) -> str
 
         Formatea la salida en Markdown. Usa encabezados para cada riesgo.
         """
-        prompt = PromptTemplate.from_template(prompt_template)
+    prompt = PromptTemplate.from_template(prompt_template)
 
-        # Aumentamos la temperatura para la generación de riesgos.
-        chain = prompt | get_llm().with_options(temperature=0.5) | StrOutputParser()
+    # Aumentamos la temperatura para la generación de riesgos.
+    return prompt | get_llm().bind(temperature=0.5) | StrOutputParser()
 
-        return chain.invoke({"control_id": control_id, "control_description": control_description})
+_LIBRARY_CHAIN_BUILDERS = {LIBRARY_POLICY_DRAFT: _build_policy_draft_chain, LIBRARY_RISKS: _build_risks_chain}
+
+def generate_library_text(kind: str, control_id: str, control_description: str) -> str:
+    """
+    Genera con el LLM el borrador o los riesgos de un control (sin consultar la biblioteca) y
+    lo guarda en la biblioteca. Los errores transitorios se reintentan; los demás se propagan.
+    """
+    chain = _LIBRARY_CHAIN_BUILDERS[kind]()
+    text = call_with_retry(lambda: chain.invoke({"control_id": control_id, "control_description": control_description}))
+    store_library_entry(kind, control_id, control_description, text, get_llm_model_name(), LIBRARY_PROMPT_VERSION)
+    return text
+
+def _get_catalog_description(control_id: str, control_description: str) -> str:
+    """
+    Descripción del control según el catálogo en memoria, para que la clave de la biblioteca
+    coincida con la de scripts/build_control_library.py aunque el cliente envíe otro texto.
+    Los controles que no están en el catálogo conservan la descripción recibida.
+    """
+    try:
+        control = get_control_catalog().by_id.get(control_id)
+    except Exception as e:
+        print(f"ADVERTENCIA: No se pudo consultar el catálogo de controles: {e}")
+        control = None
+    return control["description"] if control else control_description
+
+def _get_library_text(kind: str, control_id: str, control_description: str, regenerate: bool) -> str:
+    """Devuelve el texto precalculado del control o, si no existe o se pide `regenerate`, lo genera."""
+    control_description = _get_catalog_description(control_id, control_description)
+    if not regenerate:
+        text = get_library_entry(kind, control_id, control_description, get_llm_model_name(), LIBRARY_PROMPT_VERSION)
+        if text is not None:
+            return text
+    return generate_library_text(kind, control_id, control_description)
+
+def _stream_library_text(kind: str, control_id: str, control_description: str, regenerate: bool):
+    """Versión en streaming de `_get_library_text`: el texto precalculado se envía de una vez."""
+    control_description = _get_catalog_description(control_id, control_description)
+    if not regenerate:
+        text = get_library_entry(kind, control_id, control_description, get_llm_model_name(), LIBRARY_PROMPT_VERSION)
+        if text is not None:
+            yield text
+            return
+    chain = _LIBRARY_CHAIN_BUILDERS[kind]()
+    chunks = []
+    for chunk in stream_with_retry(lambda: chain.stream({"control_id": control_id, "control_description": control_description})):
+        chunks.append(chunk)
+        yield chunk
+    store_library_entry(kind, control_id, control_description, "".join(chunks), get_llm_model_name(), LIBRARY_PROMPT_VERSION)
+
+async def _aget_library_text(kind: str, control_id: str, control_description: str, regenerate: bool) -> str:
+    """Versión asíncrona de `_get_library_text`: la llamada al modelo se espera sin ocupar un hilo."""
+    model_name = get_llm_model_name()
+    control_description = await asyncio.to_thread(_get_catalog_description, control_id, control_description)
+    if not regenerate:
+        text = await asyncio.to_thread(get_library_entry, kind, control_id, control_description, model_name, LIBRARY_PROMPT_VERSION)
+        if text is not None:
+            return text
+    chain = await asyncio.to_thread(_LIBRARY_CHAIN_BUILDERS[kind])
+    text = await acall_with_retry(lambda: chain.ainvoke({"control_id": control_id, "control_description": control_description}))
+    await asyncio.to_thread(store_library_entry, kind, control_id, control_description, text, model_name, LIBRARY_PROMPT_VERSION)
+    return text
+
+async def _astream_library_text(kind: str, control_id: str, control_description: str, regenerate: bool):
+    """Versión asíncrona de `_stream_library_text`."""
+    model_name = get_llm_model_name()
+    control_description = await asyncio.to_thread(_get_catalog_description, control_id, control_description)
+    if not regenerate:
+        text = await asyncio.to_thread(get_library_entry, kind, control_id, control_description, model_name, LIBRARY_PROMPT_VERSION)
+        if text is not None:
+            yield text
+            return
+    chain = await asyncio.to_thread(_LIBRARY_CHAIN_BUILDERS[kind])
+    chunks = []
+    async for chunk in astream_with_retry(lambda: chain.astream({"control_id": control_id, "control_description": control_description})):
+        chunks.append(chunk)
+        yield chunk
+    await asyncio.to_thread(store_library_entry, kind, control_id, control_description, "".join(chunks), model_name, LIBRARY_PROMPT_VERSION)
+
+def answer_question_with_rag(question: str, collection_name: str) -> str:
+    """
+    Responde una pregunta utilizando el contexto de un documento (RAG).
+    Si ya se respondió una pregunta casi idéntica sobre la misma versión del documento, se
+    devuelve esa respuesta sin recuperar fragmentos ni llamar al LLM (ver chat_cache.py).
+    """
+    try:
+        scope = get_chat_cache_scope(collection_name, question, get_llm_model_name())
+        if scope:
+            cached_answer = find_cached_answer(scope)
+            if cached_answer is not None:
+                return cached_answer
+        chain = _get_rag_chain(collection_name, _get_scope_version(scope))
+        answer = call_with_retry(lambda: chain.invoke(question))
+        if scope:
+            store_answer(scope, question, answer)
+        return answer
+    except Exception as e:
+        print(f"Error en la cadena RAG: {e}")
+        return "Ocurrió un error al procesar tu pregunta. Por favor, inténtalo de nuevo."
+
+def stream_answer_question_with_rag(question: str, collection_name: str):
+    """
+    Versión en streaming de `answer_question_with_rag`: genera los fragmentos de texto
+    de la respuesta a medida que el modelo los produce.
+    """
+    try:
+        scope = get_chat_cache_scope(collection_name, question, get_llm_model_name())
+        if scope:
+            cached_answer = find_cached_answer(scope)
+            if cached_answer is not None:
+                yield cached_answer
+                return
+        chain = _get_rag_chain(collection_name, _get_scope_version(scope))
+        chunks = []
+        for chunk in stream_with_retry(lambda: chain.stream(question)):
+            chunks.append(chunk)
+            yield chunk
+        # Solo se guarda la respuesta completa (si el cliente se desconecta, el generador se cierra antes)
+        if scope:
+            store_answer(scope, question, "".join(chunks))
+    except Exception as e:
+        print(f"Error en la cadena RAG: {e}")
+        yield "Ocurrió un error al procesar tu pregunta. Por favor, inténtalo de nuevo."
+
+async def aanswer_question_with_rag(question: str, collection_name: str) -> str:
+    """
+    Versión asíncrona de `answer_question_with_rag`: el embedding de la pregunta, la recuperación
+    y la llamada al modelo se esperan sin ocupar un hilo del servidor durante la petición.
+    """
+    try:
+        # La caché usa el cliente síncrono de MongoDB: sus consultas se hacen en un hilo aparte
+        scope = await asyncio.to_thread(get_chat_cache_scope, collection_name, question, get_llm_model_name())
+        if scope:
+            cached_answer = await asyncio.to_thread(find_cached_answer, scope)
+            if cached_answer is not None:
+                return cached_answer
+        # Crear la cadena puede crear el retriever y el cliente del LLM (llamadas bloqueantes)
+        chain = await asyncio.to_thread(_get_rag_chain, collection_name, _get_scope_version(scope))
+        answer = await acall_with_retry(lambda: chain.ainvoke(question))
+        if scope:
+            await asyncio.to_thread(store_answer, scope, question, answer)
+        return answer
+    except Exception as e:
+        print(f"Error en la cadena RAG: {e}")
+        return "Ocurrió un error al procesar tu pregunta. Por favor, inténtalo de nuevo."
+
+async def astream_answer_question_with_rag(question: str, collection_name: str):
+    """Versión asíncrona de `stream_answer_question_with_rag`."""
+    try:
+        scope = await asyncio.to_thread(get_chat_cache_scope, collection_name, question, get_llm_model_name())
+        if scope:
+            cached_answer = await asyncio.to_thread(find_cached_answer, scope)
+            if cached_answer is not None:
+                yield cached_answer
+                return
+        chain = await asyncio.to_thread(_get_rag_chain, collection_name, _get_scope_version(scope))
+        chunks = []
+        async for chunk in astream_with_retry(lambda: chain.astream(question)):
+            chunks.append(chunk)
+            yield chunk
+        if scope:
+            await asyncio.to_thread(store_answer, scope, question, "".join(chunks))
+    except Exception as e:
+        print(f"Error en la cadena RAG: {e}")
+        yield "Ocurrió un error al procesar tu pregunta. Por favor, inténtalo de nuevo."
+
+def generate_policy_draft(control_id: str, control_description: str, regenerate: bool = False) -> str:
+    """
+    Genera un borrador de política para un control de la ISO 27001 no cubierto. Si el borrador
+    ya está en la biblioteca de controles se devuelve sin llamar al LLM, salvo con `regenerate`.
+    """
+    try:
+        return _get_library_text(LIBRARY_POLICY_DRAFT, control_id, control_description, regenerate)
+    except Exception as e:
+        print(f"Error al generar el borrador de política: {e}")
+        return "Ocurrió un error al generar el borrador. Por favor, revisa la consola para más detalles."
+
+def stream_policy_draft(control_id: str, control_description: str, regenerate: bool = False):
+    """Versión en streaming de `generate_policy_draft`."""
+    try:
+        yield from _stream_library_text(LIBRARY_POLICY_DRAFT, control_id, control_description, regenerate)
+    except Exception as e:
+        print(f"Error al generar el borrador de política: {e}")
+        yield "Ocurrió un error al generar el borrador. Por favor, revisa la consola para más detalles."
+
+async def agenerate_policy_draft(control_id: str, control_description: str, regenerate: bool = False) -> str:
+    """Versión asíncrona de `generate_policy_draft`."""
+    try:
+        return await _aget_library_text(LIBRARY_POLICY_DRAFT, control_id, control_description, regenerate)
+    except Exception as e:
+        print(f"Error al generar el borrador de política: {e}")
+        return "Ocurrió un error al generar el borrador. Por favor, revisa la consola para más detalles."
+
+async def astream_policy_draft(control_id: str, control_description: str, regenerate: bool = False):
+    """Versión asíncrona de `stream_policy_draft`."""
+    try:
+        async for chunk in _astream_library_text(LIBRARY_POLICY_DRAFT, control_id, control_description, regenerate):
+            yield chunk
+    except Exception as e:
+        print(f"Error al generar el borrador de política: {e}")
+        yield "Ocurrió un error al generar el borrador. Por favor, revisa la consola para más detalles."
+
+def identify_risks_for_control(control_id: str, control_description: str, regenerate: bool = False) -> str:
+    """
+    Identifica riesgos potenciales para un control de la ISO 27001 no implementado. Como los
+    borradores, se sirven desde la biblioteca de controles salvo con `regenerate`.
+    """
+    try:
+        return _get_library_text(LIBRARY_RISKS, control_id, control_description, regenerate)
+    except Exception as e:
+        print(f"Error al identificar riesgos: {e}")
+        return "Ocurrió un error al identificar los riesgos. Por favor, revisa la consola."
+
+def stream_risks_for_control(control_id: str, control_description: str, regenerate: bool = False):
+    """Versión en streaming de `identify_risks_for_control`."""
+    try:
+        yield from _stream_library_text(LIBRARY_RISKS, control_id, control_description, regenerate)
+    except Exception as e:
+        print(f"Error al identificar riesgos: {e}")
+        yield "Ocurrió un error al identificar los riesgos. Por favor, revisa la consola."
+
+async def aidentify_risks_for_control(control_id: str, control_description: str, regenerate: bool = False) -> str:
+    """Versión asíncrona de `identify_risks_for_control`."""
+    try:
+        return await _aget_library_text(LIBRARY_RISKS, control_id, control_description, regenerate)
+    except Exception as e:
+        print(f"Error al identificar riesgos: {e}")
+        return "Ocurrió un error al identificar los riesgos. Por favor, revisa la consola."
+
+async def astream_risks_for_control(control_id: str, control_description: str, regenerate: bool = False):
+    """Versión asíncrona de `stream_risks_for_control`."""
+    try:
+        async for chunk in _astream_library_text(LIBRARY_RISKS, control_id, control_description, regenerate):
+            yield chunk
     except Exception as e:
         print(f"Error al identificar riesgos: {e}")
-        return "Ocurrió un error al identificar los riesgos. Por favor, revisa la consola."
\ No newline at end of file
+        yield "Ocurrió un error al identificar los riesgos. Por favor, revisa la consola."
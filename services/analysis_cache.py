@@ -0,0 +1,83 @@
+import os
+import hashlib
+from datetime import datetime, timezone
+from pymongo import ASCENDING, UpdateOne
+from .vector_store_manager import get_mongo_collection
+from .mongo_retention import ensure_ttl_index, evict_oldest
+from .metrics import span
+from .mongo_collections import ANALYSIS_CACHE_COLLECTION
+
+# Los resultados caducan a los 30 días y como máximo se conservan 50.000 entradas.
+DEFAULT_CACHE_TTL_SECONDS = 30 * 24 * 3600
+DEFAULT_CACHE_MAX_ENTRIES = 50000
+
+_indexes_ready = False
+
+def is_cache_enabled() -> bool:
+    """La caché está activa salvo que ANALYSIS_CACHE_ENABLED sea 'false' o '0'."""
+    return os.getenv('ANALYSIS_CACHE_ENABLED', 'true').lower() not in ('false', '0', 'no')
+
+def _build_cache_key(document_hash: str, control_id: str, model_name: str, prompt_version: str, variant: str) -> str:
+    """Clave de la caché: depende de todo lo que puede cambiar el veredicto de un control."""
+    raw_key = "|".join([document_hash, control_id, model_name, prompt_version, variant])
+    return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+def _get_cache_collection():
+    """Devuelve la colección de caché, creando sus índices la primera vez."""
+    global _indexes_ready
+    collection = get_mongo_collection(ANALYSIS_CACHE_COLLECTION)
+    if not _indexes_ready:
+        ensure_ttl_index(collection, "created_at", int(os.getenv('ANALYSIS_CACHE_TTL_SECONDS', DEFAULT_CACHE_TTL_SECONDS)))
+        collection.create_index([("document_hash", ASCENDING)], name="document_hash")
+        _indexes_ready = True
+    return collection
+
+def get_cached_results(document_hash: str, control_ids: list, model_name: str, prompt_version: str, variant: str) -> dict:
+    """
+    Busca en una sola consulta los resultados guardados para los controles indicados.
+    Devuelve un diccionario {control_id: resultado}. Si la caché falla, devuelve {}.
+    """
+    if not control_ids:
+        return {}
+    try:
+        keys = {_build_cache_key(document_hash, control_id, model_name, prompt_version, variant): control_id for control_id in control_ids}
+        collection = _get_cache_collection()
+        cached = {}
+        for entry in collection.find({"_id": {"$in": list(keys)}}, {"result": 1}):
+            cached[keys[entry["_id"]]] = entry["result"]
+        return cached
+    except Exception as e:
+        print(f"ADVERTENCIA: No se pudo leer la caché de análisis: {e}")
+        return {}
+
+def store_results(document_hash: str, results: list, model_name: str, prompt_version: str, variant: str):
+    """
+    Guarda los resultados de los controles analizados. Si se supera ANALYSIS_CACHE_MAX_ENTRIES
+    se eliminan las entradas más antiguas. Los errores se registran sin interrumpir el análisis.
+    """
+    if not results:
+        return
+    try:
+        collection = _get_cache_collection()
+        now = datetime.now(timezone.utc)
+        operations = []
+        for result in results:
+            key = _build_cache_key(document_hash, result["id"], model_name, prompt_version, variant)
+            operations.append(UpdateOne(
+                {"_id": key},
+                {"$set": {
+                    "document_hash": document_hash,
+                    "control_id": result["id"],
+                    "model_name": model_name,
+                    "prompt_version": prompt_version,
+                    "variant": variant,
+                    "result": result,
+                    "created_at": now,
+                }},
+                upsert=True,
+            ))
+        with span("mongo_write", operation="analysis_cache"):
+            collection.bulk_write(operations, ordered=False)
+            evict_oldest(collection, int(os.getenv('ANALYSIS_CACHE_MAX_ENTRIES', DEFAULT_CACHE_MAX_ENTRIES)))
+    except Exception as e:
+        print(f"ADVERTENCIA: No se pudo escribir en la caché de análisis: {e}")
@@ -0,0 +1,45 @@
+from datetime import datetime, timezone
+from .vector_store_manager import get_mongo_collection
+from .metrics import span
+from .mongo_collections import ANALYSIS_HISTORY_COLLECTION
+
+def get_previous_analysis(document_key: str, model_name: str, prompt_version: str, variant: str) -> dict | None:
+    """
+    Devuelve el último análisis guardado para el documento si se hizo con el mismo modelo,
+    versión de prompt y modo de contexto; en otro caso (o si falla la lectura) devuelve None.
+    """
+    try:
+        previous = get_mongo_collection(ANALYSIS_HISTORY_COLLECTION).find_one({"_id": document_key})
+    except Exception as e:
+        print(f"ADVERTENCIA: No se pudo leer el análisis anterior de '{document_key}': {e}")
+        return None
+    if not previous:
+        return None
+    if (previous.get("model_name"), previous.get("prompt_version"), previous.get("variant")) != (model_name, prompt_version, variant):
+        return None
+    return previous
+
+def save_analysis(document_key: str, document_hash: str, chunk_hashes: list, results: list, evidence: dict, model_name: str, prompt_version: str, variant: str):
+    """
+    Guarda el análisis actual del documento junto con los hashes de sus fragmentos y,
+    para cada control, los hashes de los fragmentos que constituyen su evidencia.
+    """
+    try:
+        with span("mongo_write", operation="analysis_history"):
+            get_mongo_collection(ANALYSIS_HISTORY_COLLECTION).replace_one(
+                {"_id": document_key},
+                {
+                    "document_hash": document_hash,
+                    "chunk_hashes": chunk_hashes,
+                    "results": results,
+                    # Los IDs de control contienen puntos, por lo que no pueden usarse como claves en MongoDB.
+                    "evidence": [{"control_id": control_id, "chunk_hashes": hashes} for control_id, hashes in evidence.items()],
+                    "model_name": model_name,
+                    "prompt_version": prompt_version,
+                    "variant": variant,
+                    "updated_at": datetime.now(timezone.utc),
+                },
+                upsert=True,
+            )
+    except Exception as e:
+        print(f"ADVERTENCIA: No se pudo guardar el análisis de '{document_key}': {e}")
@@ -0,0 +1,213 @@
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pymongo import ReturnDocument
+from .vector_store_manager import get_async_mongo_collection, get_mongo_collection, create_vector_store
+from .document_processor import compute_file_hash, load_document
+from .ai_analyzer import CONTROL_ERROR_STATUS, analyze_document_coverage
+from .control_catalog import get_control_catalog
+from .metrics import span, trace_analysis
+from .mongo_collections import ANALYSIS_JOBS_COLLECTION
+
+# Número de análisis que se ejecutan a la vez en segundo plano en cada proceso.
+DEFAULT_ANALYSIS_JOB_WORKERS = 2
+# Segundos sin progreso tras los que un trabajo en curso se considera interrumpido (por ejemplo,
+# porque se reinició el proceso) y se puede reanudar.
+DEFAULT_ANALYSIS_JOB_STALE_SECONDS = 600
+
+# Estados posibles de un trabajo
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+# --- Pool de trabajadores singleton, creado la primera vez que se encola un análisis ---
+_job_executor = None
+
+def _get_job_executor() -> ThreadPoolExecutor:
+    """Devuelve el pool de hilos que ejecuta los trabajos de análisis."""
+    global _job_executor
+    if _job_executor is None:
+        try:
+            max_workers = max(1, int(os.getenv('ANALYSIS_JOB_WORKERS', DEFAULT_ANALYSIS_JOB_WORKERS)))
+        except ValueError:
+            max_workers = DEFAULT_ANALYSIS_JOB_WORKERS
+        _job_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis-job")
+    return _job_executor
+
+def _get_stale_seconds() -> int:
+    try:
+        return max(1, int(os.getenv('ANALYSIS_JOB_STALE_SECONDS', DEFAULT_ANALYSIS_JOB_STALE_SECONDS)))
+    except ValueError:
+        return DEFAULT_ANALYSIS_JOB_STALE_SECONDS
+
+def create_analysis_job(filename: str, file_path: str, collection_name: str, applicable_control_ids: list, use_cache: bool = True, file_hash: str | None = None) -> str:
+    """
+    Registra un trabajo de análisis en MongoDB, lo encola en el pool de trabajadores
+    y devuelve su identificador. `file_hash` evita recalcular el hash del fichero.
+    """
+    job_id = uuid.uuid4().hex
+    applicable_control_ids = sorted(applicable_control_ids)
+    get_mongo_collection(ANALYSIS_JOBS_COLLECTION).insert_one({
+        "_id": job_id,
+        "filename": filename,
+        "file_hash": file_hash or compute_file_hash(file_path),
+        "collection_name": collection_name,
+        "status": JOB_QUEUED,
+        "total": 0,
+        "completed": 0,
+        "results": [],
+        "messages": [],
+        "error": None,
+        "trace_id": None,
+        "failed_controls": 0,
+        # Lo necesario para reanudar el trabajo si se interrumpe
+        "file_path": file_path,
+        "applicable_control_ids": applicable_control_ids,
+        "use_cache": use_cache,
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc),
+        "finished_at": None,
+    })
+    _get_job_executor().submit(_run_analysis_job, job_id, file_path, collection_name, applicable_control_ids, use_cache)
+    return job_id
+
+def get_or_create_analysis_job(filename: str, file_path: str, collection_name: str, applicable_control_ids: list, use_cache: bool = True) -> str:
+    """
+    Devuelve el trabajo en curso o completado del mismo fichero, con el mismo
+    contenido y los mismos controles aplicables, para que recargar la página de análisis no
+    lance otro análisis. Si no lo hay, o con `use_cache=False`, crea uno nuevo.
+    """
+    applicable_control_ids = sorted(applicable_control_ids)
+    file_hash = compute_file_hash(file_path)
+    if use_cache:
+        # Los trabajos interrumpidos (sin progreso reciente) no se reutilizan: no van a terminar
+        active_since = datetime.now(timezone.utc) - timedelta(seconds=_get_stale_seconds())
+        job = get_mongo_collection(ANALYSIS_JOBS_COLLECTION).find_one(
+            {"filename": filename, "file_hash": file_hash, "applicable_control_ids": applicable_control_ids, "$or": [
+                {"status": JOB_COMPLETED},
+                {"status": {"$in": [JOB_QUEUED, JOB_RUNNING]}, "updated_at": {"$gte": active_since}},
+            ]},
+            {"_id": 1},
+            sort=[("created_at", -1)],
+        )
+        if job:
+            return job["_id"]
+    return create_analysis_job(filename, file_path, collection_name, applicable_control_ids, use_cache, file_hash)
+
+def resume_analysis_job(job_id: str) -> bool:
+    """
+    Reanuda un trabajo fallido, completado con controles en estado 'Error' o interrumpido (en
+    curso pero sin progreso desde hace ANALYSIS_JOB_STALE_SECONDS). Se conservan los resultados
+    ya obtenidos y solo se analizan los controles que faltan o fallaron.
+    Devuelve False si el trabajo no existe o no se puede reanudar.
+    """
+    stale_seconds = _get_stale_seconds()
+    now = datetime.now(timezone.utc)
+    jobs = get_mongo_collection(ANALYSIS_JOBS_COLLECTION)
+    # La actualización es atómica: si varios procesos intentan reanudar el trabajo, solo uno lo consigue
+    job = jobs.find_one_and_update(
+        {"_id": job_id, "file_path": {"$exists": True}, "$or": [
+            {"status": JOB_FAILED},
+            {"status": JOB_COMPLETED, "failed_controls": {"$gt": 0}},
+            {"status": {"$in": [JOB_QUEUED, JOB_RUNNING]}, "updated_at": {"$lt": now - timedelta(seconds=stale_seconds)}},
+        ]},
+        {"$set": {"status": JOB_QUEUED, "error": None, "finished_at": None, "updated_at": now}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if job is None:
+        return False
+    completed_results = [result for result in job["results"] if result["status"] != CONTROL_ERROR_STATUS]
+    jobs.update_one({"_id": job_id}, {"$set": {"results": completed_results, "completed": len(completed_results), "failed_controls": 0}})
+    _add_job_message(job_id, "info", f"Análisis reanudado: se conservan {len(completed_results)} controles ya analizados.")
+    _get_job_executor().submit(_run_analysis_job, job_id, job["file_path"], job["collection_name"], job["applicable_control_ids"], job["use_cache"], completed_results)
+    return True
+
+def get_analysis_job(job_id: str, since: int = 0) -> dict | None:
+    """
+    Devuelve el estado de un trabajo con los resultados a partir de la posición `since`,
+    para que los clientes solo reciban los controles que aún no tienen.
+    """
+    return get_mongo_collection(ANALYSIS_JOBS_COLLECTION).find_one(
+        {"_id": job_id},
+        {"results": {"$slice": [since, 100000]}, "collection_name": 0},
+    )
+
+async def aget_analysis_job(job_id: str, since: int = 0) -> dict | None:
+    """Versión asíncrona de `get_analysis_job`, para el modo ASGI."""
+    return await get_async_mongo_collection(ANALYSIS_JOBS_COLLECTION).find_one(
+        {"_id": job_id},
+        {"results": {"$slice": [since, 100000]}, "collection_name": 0},
+    )
+
+def _add_job_message(job_id: str, category: str, text: str):
+    """Añade un mensaje para el usuario (equivalente a un flash) al trabajo."""
+    get_mongo_collection(ANALYSIS_JOBS_COLLECTION).update_one(
+        {"_id": job_id}, {"$push": {"messages": {"category": category, "text": text}}}
+    )
+
+def _run_analysis_job(job_id: str, file_path: str, collection_name: str, applicable_control_ids: list, use_cache: bool, completed_results: list | None = None):
+    """Ejecuta el trabajo dentro de su propia traza, cuyo ID queda registrado en el trabajo."""
+    with trace_analysis("analysis_job", job_id=job_id, document=collection_name) as trace:
+        _execute_analysis_job(job_id, file_path, collection_name, applicable_control_ids, use_cache, trace.trace_id, completed_results)
+
+def _execute_analysis_job(job_id: str, file_path: str, collection_name: str, applicable_control_ids: list, use_cache: bool, trace_id: str, completed_results: list | None = None):
+    """
+    Ejecuta en segundo plano la extracción, la indexación vectorial y el análisis de cobertura.
+    `completed_results` son los resultados que el trabajo ya tenía si se está reanudando.
+    """
+    jobs = get_mongo_collection(ANALYSIS_JOBS_COLLECTION)
+    try:
+        jobs.update_one({"_id": job_id}, {"$set": {"status": JOB_RUNNING, "trace_id": trace_id, "updated_at": datetime.now(timezone.utc)}})
+        filename = os.path.basename(file_path)
+
+        document = load_document(file_path)
+        extracted_text = document["text"]
+        if not extracted_text:
+            _add_job_message(job_id, "warning", f"No se pudo extraer texto del fichero {filename}. Puede que esté vacío, protegido o corrupto.")
+            jobs.update_one({"_id": job_id}, {"$set": {"status": JOB_FAILED, "error": "El documento no contiene texto analizable.", "finished_at": datetime.now(timezone.utc)}})
+            return
+
+        vector_store_ready = False
+        try:
+            create_vector_store(extracted_text, collection_name, version=document["document_hash"], segments=document["segments"])
+            vector_store_ready = True
+            _add_job_message(job_id, "success", f'Documento "{filename}" procesado y listo para chatear.')
+        except Exception as e:
+            _add_job_message(job_id, "error", f"Error al crear la base de datos vectorial: {e}")
+
+        # Posición de cada control en el catálogo, para que la interfaz pueda ordenarlos al recibirlos
+        catalog_order = get_control_catalog().order
+        jobs.update_one({"_id": job_id}, {"$set": {"total": len(catalog_order)}})
+
+        def save_result(result: dict):
+            with span("mongo_write", operation="analysis_job_result", control_id=result["id"]):
+                jobs.update_one(
+                    {"_id": job_id},
+                    {
+                        "$push": {"results": {**result, "order": catalog_order.get(result["id"], len(catalog_order))}},
+                        "$inc": {"completed": 1, "failed_controls": int(result["status"] == CONTROL_ERROR_STATUS)},
+                        "$set": {"updated_at": datetime.now(timezone.utc)},
+                    },
+                )
+
+        results = analyze_document_coverage(
+            extracted_text,
+            applicable_control_ids,
+            collection_name=collection_name if vector_store_ready else None,
+            use_cache=use_cache,
+            on_result=save_result,
+            document_hash=document["document_hash"],
+            completed_results=completed_results,
+        )
+        if results and isinstance(results[0], dict) and "error" in results[0]:
+            jobs.update_one({"_id": job_id}, {"$set": {"status": JOB_FAILED, "error": results[0]["error"], "finished_at": datetime.now(timezone.utc)}})
+        else:
+            failed = sum(1 for result in results if result["status"] == CONTROL_ERROR_STATUS)
+            if failed:
+                _add_job_message(job_id, "warning", f"{failed} controles no se pudieron analizar por errores temporales del servicio de IA. Reanuda el análisis para completarlos.")
+            jobs.update_one({"_id": job_id}, {"$set": {"status": JOB_COMPLETED, "finished_at": datetime.now(timezone.utc)}})
+    except Exception as e:
+        print(f"Error inesperado en el trabajo de análisis {job_id}: {e}")
+        jobs.update_one({"_id": job_id}, {"$set": {"status": JOB_FAILED, "error": "Ocurrió un error inesperado durante el análisis. Revisa la consola para más detalles.", "finished_at": datetime.now(timezone.utc)}})
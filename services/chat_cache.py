@@ -0,0 +1,120 @@
+import os
+from datetime import datetime, timezone
+import numpy as np
+from pymongo import ASCENDING, DESCENDING
+from .vector_store_manager import get_document_version, get_mongo_collection, get_query_embeddings, get_tenant
+from .metrics import increment, span
+from .mongo_collections import CHAT_CACHE_COLLECTION
+from .mongo_retention import ensure_ttl_index, evict_oldest
+
+# --- Caché semántica de respuestas del chat, por documento y versión del documento ---
+# Una pregunta cuyo embedding es casi idéntico (similitud coseno >= CHAT_CACHE_THRESHOLD) al de
+# una pregunta anterior sobre la misma versión del documento recibe la respuesta guardada.
+DEFAULT_CHAT_CACHE_THRESHOLD = 0.95
+# Las respuestas caducan a los 7 días y como máximo se conservan 20.000 entradas.
+DEFAULT_CHAT_CACHE_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_CHAT_CACHE_MAX_ENTRIES = 20000
+# Preguntas anteriores (las más recientes) con las que se compara cada pregunta nueva.
+MAX_CANDIDATES = 500
+
+_indexes_ready = False
+
+def is_chat_cache_enabled() -> bool:
+    """La caché está activa salvo que CHAT_CACHE_ENABLED sea 'false' o '0'."""
+    return os.getenv('CHAT_CACHE_ENABLED', 'true').lower() not in ('false', '0', 'no')
+
+def _get_threshold() -> float:
+    try:
+        return float(os.getenv('CHAT_CACHE_THRESHOLD', DEFAULT_CHAT_CACHE_THRESHOLD))
+    except ValueError:
+        return DEFAULT_CHAT_CACHE_THRESHOLD
+
+def _get_chat_cache_collection():
+    """Devuelve la colección de la caché, creando sus índices la primera vez."""
+    global _indexes_ready
+    collection = get_mongo_collection(CHAT_CACHE_COLLECTION)
+    if not _indexes_ready:
+        ensure_ttl_index(collection, "created_at", int(os.getenv('CHAT_CACHE_TTL_SECONDS', DEFAULT_CHAT_CACHE_TTL_SECONDS)))
+        collection.create_index(
+            [("tenant", ASCENDING), ("doc_id", ASCENDING), ("version", ASCENDING), ("model_name", ASCENDING), ("created_at", DESCENDING)],
+            name="document_version",
+        )
+        _indexes_ready = True
+    return collection
+
+def get_chat_cache_scope(collection_name: str, question: str, model_name: str) -> dict | None:
+    """
+    Prepara la consulta a la caché: documento, tenant, versión del documento, modelo y embedding
+    de la pregunta. Devuelve None si la caché está desactivada, el documento no está indexado
+    o falla algún paso (la pregunta se responde entonces sin caché).
+    """
+    if not is_chat_cache_enabled():
+        return None
+    try:
+        tenant = get_tenant()
+        version = get_document_version(collection_name, tenant)
+        if version is None:
+            return None
+        # El embedding se cachea, así que el retriever no vuelve a calcularlo en un fallo
+        vector = get_query_embeddings().embed_query(question)
+    except Exception as e:
+        print(f"ADVERTENCIA: No se pudo consultar la caché del chat: {e}")
+        return None
+    return {"doc_id": collection_name, "tenant": tenant, "version": version, "model_name": model_name, "vector": vector}
+
+def find_cached_answer(scope: dict) -> str | None:
+    """Devuelve la respuesta guardada de la pregunta anterior más parecida, si supera el umbral."""
+    try:
+        with span("chat_cache_lookup", doc_id=scope["doc_id"]):
+            collection = _get_chat_cache_collection()
+            query = {key: scope[key] for key in ("tenant", "doc_id", "version", "model_name")}
+            entries = list(collection.find(query, {"question_embedding": 1, "answer": 1}).sort("created_at", DESCENDING).limit(MAX_CANDIDATES))
+            best = None
+            if entries:
+                matrix = np.asarray([entry["question_embedding"] for entry in entries], dtype=np.float32)
+                vector = np.asarray(scope["vector"], dtype=np.float32)
+                norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(vector) or 1.0)
+                norms[norms == 0] = 1.0
+                similarities = matrix @ vector / norms
+                index = int(similarities.argmax())
+                if similarities[index] >= _get_threshold():
+                    best = entries[index]
+        if best is None:
+            increment("chat_cache_total", result="miss")
+            return None
+        increment("chat_cache_total", result="hit")
+        collection.update_one({"_id": best["_id"]}, {"$inc": {"hits": 1}, "$set": {"last_hit_at": datetime.now(timezone.utc)}})
+        return best["answer"]
+    except Exception as e:
+        print(f"ADVERTENCIA: No se pudo leer la caché del chat: {e}")
+        return None
+
+def store_answer(scope: dict, question: str, answer: str):
+    """Guarda la respuesta de una pregunta. Si se supera CHAT_CACHE_MAX_ENTRIES se eliminan las más antiguas."""
+    try:
+        collection = _get_chat_cache_collection()
+        with span("mongo_write", operation="chat_cache"):
+            collection.insert_one({
+                "tenant": scope["tenant"],
+                "doc_id": scope["doc_id"],
+                "version": scope["version"],
+                "model_name": scope["model_name"],
+                "question": question,
+                "question_embedding": [float(value) for value in scope["vector"]],
+                "answer": answer,
+                "hits": 0,
+                "created_at": datetime.now(timezone.utc),
+            })
+            evict_oldest(collection, int(os.getenv('CHAT_CACHE_MAX_ENTRIES', DEFAULT_CHAT_CACHE_MAX_ENTRIES)))
+    except Exception as e:
+        print(f"ADVERTENCIA: No se pudo escribir en la caché del chat: {e}")
+
+def get_chat_cache_stats() -> dict:
+    """Resumen de la caché: entradas guardadas, respuestas servidas desde la caché y umbral de similitud."""
+    collection = _get_chat_cache_collection()
+    totals = list(collection.aggregate([{"$group": {"_id": None, "entries": {"$sum": 1}, "hits": {"$sum": "$hits"}}}]))
+    return {
+        "entries": totals[0]["entries"] if totals else 0,
+        "hits": totals[0]["hits"] if totals else 0,
+        "threshold": _get_threshold(),
+    }
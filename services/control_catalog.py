@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from pymongo import ReturnDocument
+from .vector_store_manager import get_mongo_collection
+from .mongo_collections import CATALOG_VERSIONS_COLLECTION, CONTROLS_COLLECTION
+
+# Catálogo por defecto: controles del Anexo A de ISO 27001:2022 (scripts/seed_database.py).
+# Cada catálogo se identifica por el nombre de su colección, de modo que pueden convivir
+# varios (por ejemplo, una colección con los controles de la versión 2013).
+DEFAULT_CATALOG = CONTROLS_COLLECTION
+# Cada cuánto (segundos) se comprueba la versión del catálogo en MongoDB; 0 = en cada acceso.
+DEFAULT_CATALOG_CHECK_SECONDS = 30
+
+class ControlCatalog:
+    """
+    Catálogo de controles cargado en memoria, con búsqueda O(1) por ID de control
+    y por tema del Anexo A ('A.5', 'A.6', ...).
+    """
+
+    def __init__(self, name: str, version, controls: list):
+        self.name = name
+        self.version = version
+        self.controls = controls
+        self.by_id = {control["id"]: control for control in controls}
+        # Posición de cada control en el catálogo, para ordenar resultados que llegan desordenados
+        self.order = {control["id"]: index for index, control in enumerate(controls)}
+        self.by_theme = {}
+        for control in controls:
+            self.by_theme.setdefault(get_control_theme(control["id"]), []).append(control)
+        self.checked_at = time.monotonic()
+
+def get_control_theme(control_id: str) -> str:
+    """Devuelve el tema del Anexo A de un control ('A.5.15' -> 'A.5')."""
+    return ".".join(control_id.split(".")[:2])
+
+# --- Catálogos cargados en este proceso, por nombre ---
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+_watcher_started = False
+_watcher_failed = False
+
+def _get_check_interval() -> float:
+    try:
+        return max(0.0, float(os.getenv('CONTROL_CATALOG_CHECK_SECONDS', DEFAULT_CATALOG_CHECK_SECONDS)))
+    except ValueError:
+        return DEFAULT_CATALOG_CHECK_SECONDS
+
+def _read_catalog_version(name: str):
+    """Versión actual del catálogo en MongoDB (None si nunca se ha registrado)."""
+    version_doc = get_mongo_collection(CATALOG_VERSIONS_COLLECTION).find_one({"_id": name}, {"version": 1})
+    return version_doc.get("version") if version_doc else None
+
+def _load_catalog(name: str) -> ControlCatalog:
+    version = _read_catalog_version(name)
+    # Proyectamos para excluir el _id de MongoDB y solo devolver id y description
+    controls = list(get_mongo_collection(name).find({}, {"_id": 0, "id": 1, "description": 1}))
+    return ControlCatalog(name, version, controls)
+
+def get_control_catalog(name: str = DEFAULT_CATALOG) -> ControlCatalog:
+    """
+    Devuelve el catálogo de controles desde la memoria del proceso. Se recarga de MongoDB
+    cuando su versión cambia (comprobada como mucho cada CONTROL_CATALOG_CHECK_SECONDS, o al
+    instante si está activo el change stream). Si MongoDB no responde y ya hay un catálogo
+    cargado, se sigue usando ese. Los catálogos vacíos no se guardan en memoria.
+    """
+    _start_watcher()
+    catalog = _catalogs.get(name)
+    if catalog is not None:
+        if _watcher_started or time.monotonic() - catalog.checked_at < _get_check_interval():
+            return catalog
+        try:
+            # Sin documento de versión (catálogo sembrado sin bump_catalog_version) no hay forma
+            # de saber si ha cambiado, así que se recarga en cada comprobación.
+            version = _read_catalog_version(name)
+            if version is not None and version == catalog.version:
+                catalog.checked_at = time.monotonic()
+                return catalog
+        except Exception as e:
+            print(f"ADVERTENCIA: No se pudo comprobar la versión del catálogo '{name}', se usa la copia en memoria: {e}")
+            return catalog
+
+    with _catalogs_lock:
+        current = _catalogs.get(name)
+        if current is not None and current is not catalog:
+            # Otro hilo lo ha recargado mientras se esperaba el cerrojo
+            return current
+        catalog = _load_catalog(name)
+        if catalog.controls:
+            _catalogs[name] = catalog
+        else:
+            _catalogs.pop(name, None)
+    return catalog
+
+def invalidate_control_catalog(name: str | None = None):
+    """Descarta de la memoria un catálogo (o todos) para que se recargue en el siguiente acceso."""
+    with _catalogs_lock:
+        if name is None:
+            _catalogs.clear()
+        else:
+            _catalogs.pop(name, None)
+
+def preload_control_catalogs(names: list | None = None):
+    """Carga en memoria los catálogos indicados (por defecto CONTROL_CATALOGS o el catálogo por defecto)."""
+    if names is None:
+        names = [name.strip() for name in os.getenv('CONTROL_CATALOGS', DEFAULT_CATALOG).split(",") if name.strip()]
+    for name in names:
+        get_control_catalog(name)
+
+def bump_catalog_version(name: str = DEFAULT_CATALOG) -> int:
+    """
+    Incrementa la versión del catálogo tras modificar sus controles. Los procesos que lo
+    tienen en memoria lo recargan en su siguiente comprobación. Devuelve la nueva versión.
+    """
+    version_doc = get_mongo_collection(CATALOG_VERSIONS_COLLECTION).find_one_and_update(
+        {"_id": name},
+        {"$inc": {"version": 1}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    invalidate_control_catalog(name)
+    return version_doc["version"]
+
+def _start_watcher():
+    """
+    Con CONTROL_CATALOG_WATCH=true, abre un change stream sobre las versiones de los catálogos
+    para invalidarlos en cuanto cambian, en lugar de comprobarlos periódicamente. Requiere un
+    replica set (como Atlas); si el change stream falla se vuelve a la comprobación periódica.
+    """
+    global _watcher_started
+    if _watcher_started or _watcher_failed or os.getenv('CONTROL_CATALOG_WATCH', 'false').lower() not in ('true', '1', 'yes'):
+        return
+    with _catalogs_lock:
+        if _watcher_started:
+            return
+        _watcher_started = True
+    threading.Thread(target=_watch_catalog_versions, name="control-catalog-watcher", daemon=True).start()
+
+def _watch_catalog_versions():
+    global _watcher_started, _watcher_failed
+    try:
+        with get_mongo_collection(CATALOG_VERSIONS_COLLECTION).watch() as stream:
+            for change in stream:
+                invalidate_control_catalog(change["documentKey"]["_id"])
+    except Exception as e:
+        print(f"ADVERTENCIA: Change stream de catálogos no disponible, se comprobará la versión periódicamente: {e}")
+    # Se descarta lo cargado, ya que pudo cambiar mientras no había vigilancia.
+    invalidate_control_catalog()
+    _watcher_failed = True
+    _watcher_started = False
@@ -0,0 +1,74 @@
+import hashlib
+from datetime import datetime, timezone
+from pymongo import UpdateOne
+from .vector_store_manager import get_mongo_collection
+from .metrics import increment, span
+from .mongo_collections import CONTROL_LIBRARY_COLLECTION
+
+# --- Biblioteca precalculada de borradores de política y riesgos por control ---
+# Ambos textos dependen solo del control (no del documento subido), así que se generan una vez
+# por control, modelo y versión del prompt (scripts/build_control_library.py) y se sirven desde aquí.
+LIBRARY_POLICY_DRAFT = "policy_draft"
+LIBRARY_RISKS = "risks"
+LIBRARY_KINDS = (LIBRARY_POLICY_DRAFT, LIBRARY_RISKS)
+
+def _build_library_key(kind: str, control_id: str, control_description: str, model_name: str, prompt_version: str) -> str:
+    """Clave de la biblioteca: incluye la descripción para no servir un texto de otra versión del catálogo."""
+    raw_key = "|".join([kind, control_id, control_description, model_name, prompt_version])
+    return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+def get_library_entries(kind: str, controls: list, model_name: str, prompt_version: str) -> dict:
+    """
+    Busca en una sola consulta los textos guardados para los controles indicados.
+    Devuelve un diccionario {control_id: texto}. Si la consulta falla, devuelve {}.
+    """
+    if not controls:
+        return {}
+    try:
+        keys = {_build_library_key(kind, control["id"], control["description"], model_name, prompt_version): control["id"] for control in controls}
+        entries = {}
+        for entry in get_mongo_collection(CONTROL_LIBRARY_COLLECTION).find({"_id": {"$in": list(keys)}}, {"text": 1}):
+            entries[keys[entry["_id"]]] = entry["text"]
+        return entries
+    except Exception as e:
+        print(f"ADVERTENCIA: No se pudo leer la biblioteca de controles: {e}")
+        return {}
+
+def get_library_entry(kind: str, control_id: str, control_description: str, model_name: str, prompt_version: str) -> str | None:
+    """Devuelve el texto guardado para un control, o None si aún no se ha generado."""
+    text = get_library_entries(kind, [{"id": control_id, "description": control_description}], model_name, prompt_version).get(control_id)
+    increment("control_library_total", kind=kind, result="hit" if text is not None else "miss")
+    return text
+
+def store_library_entries(kind: str, entries: list, model_name: str, prompt_version: str):
+    """
+    Guarda (o sustituye) los textos generados. `entries` es una lista de diccionarios con
+    'id', 'description' y 'text'. Los errores se registran sin interrumpir la petición.
+    """
+    if not entries:
+        return
+    try:
+        now = datetime.now(timezone.utc)
+        operations = []
+        for entry in entries:
+            key = _build_library_key(kind, entry["id"], entry["description"], model_name, prompt_version)
+            operations.append(UpdateOne(
+                {"_id": key},
+                {"$set": {
+                    "kind": kind,
+                    "control_id": entry["id"],
+                    "model_name": model_name,
+                    "prompt_version": prompt_version,
+                    "text": entry["text"],
+                    "created_at": now,
+                }},
+                upsert=True,
+            ))
+        with span("mongo_write", operation="control_library"):
+            get_mongo_collection(CONTROL_LIBRARY_COLLECTION).bulk_write(operations, ordered=False)
+    except Exception as e:
+        print(f"ADVERTENCIA: No se pudo escribir en la biblioteca de controles: {e}")
+
+def store_library_entry(kind: str, control_id: str, control_description: str, text: str, model_name: str, prompt_version: str):
+    """Guarda el texto generado para un control."""
+    store_library_entries(kind, [{"id": control_id, "description": control_description, "text": text}], model_name, prompt_version)
@@ -0,0 +1,136 @@
+import os
+import hashlib
+import threading
+from datetime import datetime, timezone
+import numpy as np
+from .vector_store_manager import EMBEDDING_MODEL, get_document_vectors, get_embeddings, get_mongo_collection, split_document
+from .control_catalog import get_control_catalog
+from .metrics import increment, span
+from .mongo_collections import TRIAGE_CALIBRATION_COLLECTION
+
+# --- Triaje de controles por similitud de embeddings, antes de llamar al LLM ---
+# Cada control se compara con todos los fragmentos del documento; si ninguno se parece lo
+# suficiente a su descripción, el control se marca como 'Not Covered' sin consultar al LLM.
+# Umbral de similitud coseno usado si no hay calibración ni ANALYSIS_TRIAGE_THRESHOLD. Es
+# deliberadamente bajo: un falso 'Not Covered' es peor que una llamada de más al LLM.
+DEFAULT_TRIAGE_THRESHOLD = 0.25
+
+def is_triage_enabled() -> bool:
+    """Indica si el triaje está activo (ANALYSIS_TRIAGE_ENABLED, desactivado por defecto)."""
+    return os.getenv('ANALYSIS_TRIAGE_ENABLED', 'false').lower() in ('true', '1', 'yes')
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+# --- Embeddings de las descripciones de los controles, calculados una vez por catálogo ---
+_control_matrices = {}
+_control_matrices_lock = threading.Lock()
+
+def get_control_matrix(controls: list) -> np.ndarray:
+    """
+    Devuelve la matriz (controles × dimensiones) de embeddings normalizados de las descripciones
+    de `controls`. Si todos son controles del catálogo, se toman sus filas de la matriz del
+    catálogo completo, que se calcula una sola vez aunque cada análisis triaje otros controles.
+    """
+    catalog = get_control_catalog()
+    if all(catalog.by_id.get(control["id"], {}).get("description") == control["description"] for control in controls):
+        return _get_description_matrix(catalog.controls)[[catalog.order[control["id"]] for control in controls]]
+    return _get_description_matrix(controls)
+
+def _get_description_matrix(controls: list) -> np.ndarray:
+    """Embeddings normalizados de las descripciones, calculados una vez por conjunto de descripciones y modelo."""
+    digest = hashlib.sha256(EMBEDDING_MODEL.encode("utf-8"))
+    for control in controls:
+        digest.update(f"\x00{control['id']}\x00{control['description']}".encode("utf-8"))
+    key = digest.hexdigest()
+    matrix = _control_matrices.get(key)
+    if matrix is None:
+        with _control_matrices_lock:
+            matrix = _control_matrices.get(key)
+            if matrix is None:
+                with span("embedding", target="controls", chunks=len(controls)):
+                    vectors = get_embeddings().embed_documents([control["description"] for control in controls])
+                matrix = _normalize(np.asarray(vectors, dtype=np.float32))
+                _control_matrices[key] = matrix
+    return matrix
+
+def _get_chunk_matrix(document_text: str, collection_name: str | None) -> np.ndarray:
+    """Embeddings normalizados de los fragmentos del documento, reutilizando los del almacén vectorial."""
+    vectors = []
+    if collection_name:
+        try:
+            vectors = get_document_vectors(collection_name)
+        except Exception as e:
+            print(f"ADVERTENCIA: No se pudieron leer los embeddings de '{collection_name}', se calculan de nuevo: {e}")
+    if not len(vectors):
+        with span("embedding", target="triage"):
+            vectors = get_embeddings().embed_documents(split_document(document_text))
+    return _normalize(np.asarray(vectors, dtype=np.float32))
+
+def compute_control_scores(controls: list, document_text: str, collection_name: str | None = None) -> np.ndarray:
+    """
+    Calcula la matriz de similitud fragmentos × controles con un único producto de matrices y
+    devuelve, para cada control, la similitud de su fragmento más parecido.
+    """
+    chunk_matrix = _get_chunk_matrix(document_text, collection_name)
+    if not len(chunk_matrix):
+        return np.zeros(len(controls), dtype=np.float32)
+    return (chunk_matrix @ get_control_matrix(controls).T).max(axis=0)
+
+def get_triage_threshold() -> float:
+    """
+    Umbral de similitud: ANALYSIS_TRIAGE_THRESHOLD si se define; si no, el calibrado para el
+    modelo de embeddings actual; y si no hay calibración, DEFAULT_TRIAGE_THRESHOLD.
+    """
+    value = os.getenv('ANALYSIS_TRIAGE_THRESHOLD')
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            print(f"ADVERTENCIA: ANALYSIS_TRIAGE_THRESHOLD no es un número válido: '{value}'.")
+    try:
+        calibration = get_mongo_collection(TRIAGE_CALIBRATION_COLLECTION).find_one({"_id": EMBEDDING_MODEL}, {"threshold": 1})
+        if calibration:
+            return float(calibration["threshold"])
+    except Exception as e:
+        print(f"ADVERTENCIA: No se pudo leer la calibración del triaje: {e}")
+    return DEFAULT_TRIAGE_THRESHOLD
+
+def save_triage_calibration(threshold: float, stats: dict):
+    """Guarda el umbral calibrado para el modelo de embeddings actual."""
+    get_mongo_collection(TRIAGE_CALIBRATION_COLLECTION).replace_one(
+        {"_id": EMBEDDING_MODEL},
+        {"threshold": threshold, **stats, "created_at": datetime.now(timezone.utc)},
+        upsert=True,
+    )
+
+def triage_controls(controls: list, document_text: str, collection_name: str | None = None) -> tuple:
+    """
+    Separa los controles plausibles (se analizan con el LLM) de los que ningún fragmento del
+    documento trata. Devuelve (controles_plausibles, resultados_descartados); los descartados
+    tienen estado 'Not Covered', 'triaged': True y su similitud máxima en 'triage_score'.
+    """
+    if not controls:
+        return [], []
+    with span("triage", document=collection_name):
+        scores = compute_control_scores(controls, document_text, collection_name)
+    threshold = get_triage_threshold()
+    plausible = []
+    triaged = []
+    for control, score in zip(controls, scores.tolist()):
+        if score >= threshold:
+            plausible.append(control)
+            continue
+        triaged.append({
+            **control,
+            "status": "Not Covered",
+            "justification": f"Descartado en el triaje previo: ningún fragmento del documento trata el tema del control (similitud máxima {score:.2f}, umbral {threshold:.2f}).",
+            "triaged": True,
+            "triage_score": round(score, 4),
+        })
+    increment("analysis_triage_total", len(plausible), outcome="plausible")
+    increment("analysis_triage_total", len(triaged), outcome="triaged")
+    print(f"Triaje: {len(triaged)} de {len(controls)} controles descartados sin llamar al LLM (umbral {threshold:.2f}).")
+    return plausible, triaged
@@ -1,37 +1,213 @@
 import os
-from docx import Document
-from pypdf import PdfReader
+import json
+import hashlib
+import unicodedata
+import multiprocessing
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from .metrics import increment, span
 
-def _extract_text_from_pdf(file_path: str) -> str:
-    """Extrae texto de un fichero PDF."""
+# Extracción de PDF en paralelo: número de procesos (1 = en este proceso) y tamaño mínimo
+# del documento, en páginas, a partir del cual compensa arrancar el pool de procesos.
+DEFAULT_EXTRACTION_WORKERS = min(4, os.cpu_count() or 1)
+DEFAULT_PARALLEL_MIN_PAGES = 40
+# Páginas que procesa cada tarea del pool.
+PAGES_PER_TASK = 10
+# Los procesos del pool no se crean con fork: el proceso que extrae tiene hilos (gunicorn, trabajos
+# de análisis, torch) y un fork puede heredar un cerrojo tomado y bloquear al hijo para siempre.
+# forkserver no existe en Windows, donde spawn ya es el método por defecto.
+POOL_START_METHOD = "spawn" if os.name == "nt" else "forkserver"
+# Separador entre segmentos consecutivos en el texto extraído, por tipo de fichero.
+SEGMENT_SEPARATORS = {'.pdf': "", '.docx': "\n"}
+# Directorio, junto a cada fichero subido, donde se guarda su texto extraído.
+EXTRACTION_CACHE_DIR = ".cache"
+# Versión del formato de la caché de extracción; si cambia la extracción, las entradas antiguas se ignoran.
+EXTRACTION_CACHE_VERSION = 1
+
+def _get_env_int(name: str, default: int) -> int:
+    """Lee un entero positivo de una variable de entorno, con valor por defecto si no es válido."""
     try:
-        reader = PdfReader(file_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() or ""
-        return text
-    except Exception as e:
-        print(f"Error al leer el PDF {file_path}: {e}")
-        return ""
+        return max(1, int(os.getenv(name, default)))
+    except ValueError:
+        return default
+
+def _extract_pdf_page_range(file_path: str, start: int, end: int) -> list:
+    """Extrae el texto de las páginas [start, end) de un PDF. Se ejecuta en los procesos del pool."""
+    from pypdf import PdfReader
+    reader = PdfReader(file_path)
+    return [reader.pages[number].extract_text() or "" for number in range(start, end)]
+
+def _iter_pdf_pages(file_path: str):
+    """
+    Genera el texto de cada página del PDF, en orden, como (número_de_página, texto).
+    En documentos grandes las páginas se reparten entre un pool de procesos; como mucho hay
+    dos tareas por proceso en vuelo, así que la memoria no crece con el tamaño del documento.
+    """
+    from pypdf import PdfReader
+    reader = PdfReader(file_path)
+    page_count = len(reader.pages)
+    workers = _get_env_int('DOCUMENT_EXTRACTION_WORKERS', DEFAULT_EXTRACTION_WORKERS)
+
+    if workers <= 1 or page_count < _get_env_int('DOCUMENT_PARALLEL_MIN_PAGES', DEFAULT_PARALLEL_MIN_PAGES):
+        for number, page in enumerate(reader.pages):
+            yield number + 1, page.extract_text() or ""
+        return
+
+    del reader
+    ranges = [(start, min(start + PAGES_PER_TASK, page_count)) for start in range(0, page_count, PAGES_PER_TASK)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(POOL_START_METHOD)) as executor:
+        pending = []
+        next_range = 0
+        while next_range < len(ranges) or pending:
+            while next_range < len(ranges) and len(pending) < workers * 2:
+                start, end = ranges[next_range]
+                pending.append((start, executor.submit(_extract_pdf_page_range, file_path, start, end)))
+                next_range += 1
+            start, future = pending.pop(0)
+            for offset, text in enumerate(future.result()):
+                yield start + offset + 1, text
 
-def _extract_text_from_docx(file_path: str) -> str:
-    """Extrae texto de un fichero DOCX."""
+def _iter_docx_paragraphs(file_path: str):
+    """Genera el texto de cada párrafo del DOCX como (número_de_párrafo, texto)."""
+    from docx import Document
+    doc = Document(file_path)
+    for number, para in enumerate(doc.paragraphs):
+        yield number + 1, para.text
+
+def iter_document_segments(file_path: str):
+    """
+    Genera los segmentos de un documento en orden, sin cargarlo entero en memoria:
+    {'page': n, 'text': ...} para cada página de un PDF o {'paragraph': n, 'text': ...}
+    para cada párrafo de un DOCX. Lanza ValueError si la extensión no está soportada.
+    """
+    _, extension = os.path.splitext(file_path)
+    if extension.lower() == '.pdf':
+        for number, text in _iter_pdf_pages(file_path):
+            yield {"page": number, "text": text}
+    elif extension.lower() == '.docx':
+        for number, text in _iter_docx_paragraphs(file_path):
+            yield {"paragraph": number, "text": text}
+    else:
+        raise ValueError(f"Tipo de fichero no soportado para extracción: {extension}")
+
+def extract_document(file_path: str) -> dict:
+    """
+    Extrae el texto de un documento (PDF o DOCX) junto con la posición de cada segmento.
+    Devuelve {'text': ..., 'segments': [...]}, donde cada segmento indica su página o párrafo
+    y sus posiciones 'start'/'end' dentro del texto. Las páginas de un PDF se concatenan tal cual
+    y los párrafos de un DOCX se separan con saltos de línea, como hasta ahora.
+    Si el documento no puede leerse, devuelve un texto vacío sin segmentos.
+    """
+    _, extension = os.path.splitext(file_path)
+    if extension.lower() not in SEGMENT_SEPARATORS:
+        print(f"Tipo de fichero no soportado para extracción: {extension}")
+        return {"text": "", "segments": []}
+    separator = SEGMENT_SEPARATORS[extension.lower()]
+    parts = []
+    segments = []
+    position = 0
     try:
-        doc = Document(file_path)
-        text = "\n".join([para.text for para in doc.paragraphs])
-        return text
+        for segment in iter_document_segments(file_path):
+            if segments and separator:
+                parts.append(separator)
+                position += len(separator)
+            text = segment.pop("text")
+            parts.append(text)
+            segments.append({**segment, "start": position, "end": position + len(text)})
+            position += len(text)
     except Exception as e:
-        print(f"Error al leer el DOCX {file_path}: {e}")
-        return ""
+        print(f"Error al leer el documento {file_path}: {e}")
+        return {"text": "", "segments": []}
+    return {"text": "".join(parts), "segments": segments}
+
+def locate_offsets(segments: list, offsets: list) -> list:
+    """
+    Devuelve, para cada posición del texto extraído, dónde está en el documento original:
+    'p. N' (página de un PDF) o 'párr. N' (párrafo de un DOCX). Sirve para citar la evidencia
+    de cada fragmento. Si no hay segmentos, todas las ubicaciones son None.
+    """
+    if not segments:
+        return [None] * len(offsets)
+    starts = [segment["start"] for segment in segments]
+    locations = []
+    for offset in offsets:
+        segment = segments[max(0, bisect_right(starts, offset) - 1)]
+        locations.append(f"p. {segment['page']}" if "page" in segment else f"párr. {segment['paragraph']}")
+    return locations
 
 def extract_text_from_document(file_path: str) -> str:
     """Extrae texto de un documento (PDF o DOCX) basado en su extensión."""
-    _, extension = os.path.splitext(file_path)
-    if extension.lower() == '.pdf':
-        return _extract_text_from_pdf(file_path)
-    elif extension.lower() == '.docx':
-        return _extract_text_from_docx(file_path)
-    
-    print(f"Tipo de fichero no soportado para extracción: {extension}")
-    return ""
+    return extract_document(file_path)["text"]
+
+def compute_file_hash(file_path: str) -> str:
+    """Hash SHA-256 del contenido del fichero, leído por bloques."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def normalize_text(text: str) -> str:
+    """
+    Normaliza el texto para calcular su identidad: forma Unicode NFC, saltos de línea
+    homogéneos y sin espacios al final de las líneas ni del documento.
+    """
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n")
+    return "\n".join(line.rstrip() for line in text.split("\n")).strip()
+
+def compute_document_hash(document_text: str) -> str:
+    """
+    Hash SHA-256 del texto normalizado del documento. Es su identidad en las cachés
+    posteriores (resultados del análisis, historial), independiente del fichero de origen.
+    """
+    return hashlib.sha256(normalize_text(document_text).encode("utf-8")).hexdigest()
+
+def is_extraction_cache_enabled() -> bool:
+    """La caché de extracción está activa salvo que EXTRACTION_CACHE_ENABLED sea 'false' o '0'."""
+    return os.getenv('EXTRACTION_CACHE_ENABLED', 'true').lower() not in ('false', '0', 'no')
+
+def _get_extraction_cache_path(file_path: str, file_hash: str, cache_dir: str | None = None) -> str:
+    return os.path.join(cache_dir or os.path.join(os.path.dirname(file_path), EXTRACTION_CACHE_DIR), f"{file_hash}.json")
+
+def load_document(file_path: str, cache_dir: str | None = None, file_hash: str | None = None) -> dict:
+    """
+    Devuelve el texto extraído del documento con sus segmentos ('text', 'segments'), el hash
+    del fichero ('file_hash') y el del texto normalizado ('document_hash').
+    El resultado se guarda junto al fichero bajo el hash de su contenido, de modo que al volver
+    a abrir el análisis no se analiza de nuevo el PDF; si el fichero cambia, cambia su hash y
+    se vuelve a extraer. Las extracciones vacías no se guardan.
+    `cache_dir` permite guardar la caché en otro directorio y `file_hash` evita recalcular
+    el hash si quien llama ya lo tiene.
+    """
+    if file_hash is None:
+        file_hash = compute_file_hash(file_path)
+    cache_path = _get_extraction_cache_path(file_path, file_hash, cache_dir)
+    cache_enabled = is_extraction_cache_enabled()
+
+    if cache_enabled and os.path.exists(cache_path):
+        try:
+            with open(cache_path, encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("version") == EXTRACTION_CACHE_VERSION:
+                increment("extraction_cache_total", result="hit")
+                return {key: cached[key] for key in ("text", "segments", "file_hash", "document_hash")}
+        except (OSError, ValueError, KeyError) as e:
+            print(f"ADVERTENCIA: Caché de extracción ilegible para {file_path}, se extrae de nuevo: {e}")
+
+    increment("extraction_cache_total", result="miss")
+    with span("extraction", document=os.path.basename(file_path)):
+        document = extract_document(file_path)
+    document["file_hash"] = file_hash
+    document["document_hash"] = compute_document_hash(document["text"])
 
+    if cache_enabled and document["text"]:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            # Se escribe con un nombre temporal para que otro proceso nunca lea una entrada a medias.
+            temp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": EXTRACTION_CACHE_VERSION, **document}, f, ensure_ascii=False)
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            print(f"ADVERTENCIA: No se pudo guardar la caché de extracción de {file_path}: {e}")
+    return document
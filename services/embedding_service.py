@@ -0,0 +1,178 @@
+import os
+import queue
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+from langchain_core.embeddings import Embeddings
+
+# Parámetros del micro-batching: tamaño máximo de lote (en textos) y espera máxima
+# para completar un lote antes de calcularlo.
+DEFAULT_MAX_BATCH = 64
+DEFAULT_MAX_LATENCY_MS = 10
+
+def _parse_address(address: str):
+    """
+    Convierte EMBEDDING_SERVICE_ADDRESS en una dirección de multiprocessing:
+    'host:puerto' para TCP (necesario en Windows) o la ruta de un socket Unix.
+    """
+    host, separator, port = address.rpartition(":")
+    if separator and port.isdigit():
+        return (host or "127.0.0.1", int(port))
+    return address
+
+def _get_authkey() -> bytes:
+    """
+    Clave compartida del servicio (EMBEDDING_SERVICE_AUTHKEY), obligatoria: las conexiones de
+    multiprocessing deserializan con pickle lo que reciben, así que sin una clave secreta
+    cualquiera que alcance la dirección del servicio podría ejecutar código en él.
+    """
+    authkey = os.getenv("EMBEDDING_SERVICE_AUTHKEY")
+    if not authkey:
+        raise ValueError("La variable de entorno EMBEDDING_SERVICE_AUTHKEY no está configurada; es obligatoria para usar el servicio de embeddings.")
+    return authkey.encode("utf-8")
+
+class RemoteEmbeddings(Embeddings):
+    """
+    Cliente del servicio de embeddings compartido. Cada hilo mantiene su propia conexión,
+    ya que las conexiones de multiprocessing no son seguras entre hilos.
+    """
+
+    def __init__(self, address: str):
+        self.address = _parse_address(address)
+        # Se valida ya al crear el cliente, no en la primera petición
+        self._authkey = _get_authkey()
+        self._local = threading.local()
+
+    def _get_connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = Client(self.address, authkey=self._authkey)
+            self._local.connection = connection
+        return connection
+
+    def _request(self, texts: list) -> list:
+        try:
+            connection = self._get_connection()
+            connection.send(("embed", list(texts)))
+            status, payload = connection.recv()
+        except (EOFError, OSError):
+            # El servicio se ha reiniciado: se reconecta una vez antes de fallar.
+            self._local.connection = None
+            connection = self._get_connection()
+            connection.send(("embed", list(texts)))
+            status, payload = connection.recv()
+        if status != "ok":
+            raise RuntimeError(f"El servicio de embeddings devolvió un error: {payload}")
+        return payload
+
+    def embed_documents(self, texts: list) -> list:
+        if not texts:
+            return []
+        return self._request(texts)
+
+    def embed_query(self, text: str) -> list:
+        return self._request([text])[0]
+
+class _PendingRequest:
+    """Petición de un cliente a la espera de que su lote se calcule."""
+
+    def __init__(self, texts: list):
+        self.texts = texts
+        self.vectors = None
+        self.error = None
+        self.done = threading.Event()
+
+class MicroBatcher:
+    """
+    Agrupa las peticiones concurrentes de todos los clientes en lotes de hasta `max_batch`
+    textos, esperando como máximo `max_latency` segundos desde la primera petición del lote.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch: int, max_latency: float):
+        self.embeddings = embeddings
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, name="embedding-batcher", daemon=True).start()
+
+    def embed(self, texts: list) -> list:
+        request = _PendingRequest(texts)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error:
+            raise request.error
+        return request.vectors
+
+    def _collect_batch(self) -> list:
+        batch = [self._queue.get()]
+        size = len(batch[0].texts)
+        deadline = time.monotonic() + self.max_latency
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            texts = [text for request in batch for text in request.texts]
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+                offset = 0
+                for request in batch:
+                    request.vectors = [list(map(float, vector)) for vector in vectors[offset:offset + len(request.texts)]]
+                    offset += len(request.texts)
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            for request in batch:
+                request.done.set()
+
+def _serve_connection(connection, batcher: MicroBatcher):
+    """Atiende las peticiones de un cliente hasta que cierra la conexión."""
+    with connection:
+        while True:
+            try:
+                command, texts = connection.recv()
+            except (EOFError, OSError):
+                return
+            if command != "embed":
+                connection.send(("error", f"Comando desconocido: {command}"))
+                continue
+            try:
+                connection.send(("ok", batcher.embed(texts)))
+            except Exception as e:
+                connection.send(("error", str(e)))
+
+def serve_embeddings(embeddings: Embeddings, address: str):
+    """
+    Arranca el servicio de embeddings compartido: un único proceso con el modelo cargado
+    que atiende a todos los workers de la aplicación y agrupa sus peticiones en micro-lotes.
+    """
+    authkey = _get_authkey()
+    max_batch = int(os.getenv("EMBEDDING_SERVICE_MAX_BATCH", DEFAULT_MAX_BATCH))
+    max_latency = int(os.getenv("EMBEDDING_SERVICE_MAX_LATENCY_MS", DEFAULT_MAX_LATENCY_MS)) / 1000
+    batcher = MicroBatcher(embeddings, max_batch, max_latency)
+
+    parsed_address = _parse_address(address)
+    if isinstance(parsed_address, str) and os.path.exists(parsed_address):
+        # Socket Unix huérfano de una ejecución anterior
+        os.remove(parsed_address)
+
+    with Listener(parsed_address, authkey=authkey) as listener:
+        print(f"Servicio de embeddings escuchando en {address} (lotes de hasta {max_batch} textos, espera máxima {max_latency * 1000:.0f} ms).")
+        while True:
+            try:
+                connection = listener.accept()
+            except Exception as e:
+                # Por ejemplo, un cliente con una clave de autenticación incorrecta
+                print(f"ADVERTENCIA: Conexión rechazada en el servicio de embeddings: {e}")
+                continue
+            threading.Thread(target=_serve_connection, args=(connection, batcher), daemon=True).start()
@@ -0,0 +1,158 @@
+import os
+import json
+import uuid
+import shutil
+import threading
+from typing import Any
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+# Directorio donde se guardan los índices locales (uno por colección/documento).
+DEFAULT_VECTOR_INDEX_DIR = "vector_indexes"
+EMBEDDINGS_FILE = "embeddings.npy"
+CHUNKS_FILE = "chunks.json"
+# Cada guardado escribe ambos ficheros en un subdirectorio nuevo; este fichero indica cuál es el
+# vigente y se sustituye de forma atómica, así que un lector nunca mezcla ficheros de dos versiones.
+CURRENT_FILE = "CURRENT"
+# Versiones que se conservan: la vigente y la anterior, que un lector puede estar abriendo aún.
+KEPT_VERSIONS = 2
+
+# Índices ya cargados en memoria, junto con la fecha de modificación de sus ficheros.
+_loaded_indexes = {}
+_loaded_indexes_lock = threading.Lock()
+
+def _get_index_dir(collection_name: str) -> str:
+    """Directorio del índice local de una colección."""
+    base_dir = os.getenv('VECTOR_INDEX_DIR', DEFAULT_VECTOR_INDEX_DIR)
+    return os.path.join(base_dir, collection_name)
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """Normaliza los vectores para que el producto escalar sea la similitud coseno."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+class LocalVectorIndex:
+    """
+    Índice vectorial en memoria de un documento: una matriz de embeddings normalizados
+    (mapeada desde disco) y los metadatos de cada fragmento en el mismo orden.
+    La búsqueda es exacta (producto matriz-vector), más que suficiente para los
+    cientos de fragmentos de un documento.
+    """
+
+    def __init__(self, vectors: np.ndarray, records: list):
+        self.vectors = vectors
+        self.records = records
+
+    def get_stored_vectors(self) -> dict:
+        """Devuelve {clave_del_fragmento: vector} para reutilizar embeddings ya calculados."""
+        return {record["_id"]: self.vectors[i] for i, record in enumerate(self.records)}
+
+    def search(self, query_vector: list, k: int) -> list:
+        """Devuelve los `k` fragmentos más similares como lista de (registro, puntuación)."""
+        if not self.records:
+            return []
+        query = _normalize(np.asarray(query_vector, dtype=np.float32))
+        scores = self.vectors @ query
+        k = min(k, len(self.records))
+        # argpartition selecciona los k mejores en O(n); solo esos se ordenan.
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.records[i], float(scores[i])) for i in top]
+
+def save_local_index(collection_name: str, records: list, vectors: list):
+    """
+    Guarda el índice local de una colección. `records` contiene los metadatos de cada
+    fragmento (con su clave en '_id' y su texto en 'text') en el mismo orden que `vectors`.
+    Ambos ficheros se escriben en un directorio de versión nuevo y después se cambia CURRENT
+    con un único `os.replace`, de modo que los lectores ven el índice anterior o el nuevo completo.
+    """
+    index_dir = _get_index_dir(collection_name)
+    version = f"v{uuid.uuid4().hex}"
+    version_dir = os.path.join(index_dir, version)
+    os.makedirs(version_dir)
+    matrix = _normalize(np.asarray(vectors, dtype=np.float32).reshape(len(records), -1)) if records else np.zeros((0, 0), dtype=np.float32)
+
+    with open(os.path.join(version_dir, EMBEDDINGS_FILE), "wb") as f:
+        np.save(f, matrix)
+    with open(os.path.join(version_dir, CHUNKS_FILE), "w", encoding="utf-8") as f:
+        json.dump(records, f, ensure_ascii=False)
+    current_path = os.path.join(index_dir, CURRENT_FILE)
+    with open(current_path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(current_path + ".tmp", current_path)
+    _remove_old_versions(index_dir, version)
+
+def _remove_old_versions(index_dir: str, current_version: str):
+    """Elimina los directorios de versión salvo la vigente y los más recientes (KEPT_VERSIONS en total)."""
+    versions = [entry for entry in os.scandir(index_dir) if entry.is_dir() and entry.name.startswith("v") and entry.name != current_version]
+    versions.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in versions[KEPT_VERSIONS - 1:]:
+        # En Windows un fichero mapeado no se puede borrar; se reintentará en el siguiente guardado
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+def _read_current_version(index_dir: str) -> str | None:
+    """Nombre del directorio de la versión vigente, o None si el índice no existe."""
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILE), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        # Índices guardados antes de usar versiones: los ficheros están en el propio directorio
+        return os.curdir if os.path.exists(os.path.join(index_dir, EMBEDDINGS_FILE)) else None
+
+def load_local_index(collection_name: str) -> LocalVectorIndex:
+    """
+    Carga (o reutiliza de memoria) el índice local de una colección. La matriz de embeddings
+    se abre como fichero mapeado en memoria, de modo que los procesos comparten las páginas.
+    Si el índice no existe se devuelve uno vacío.
+    """
+    index_dir = _get_index_dir(collection_name)
+    for attempt in range(3):
+        version = _read_current_version(index_dir)
+        if version is None:
+            return LocalVectorIndex(np.zeros((0, 0), dtype=np.float32), [])
+
+        with _loaded_indexes_lock:
+            cached = _loaded_indexes.get(collection_name)
+            if cached and cached[0] == version:
+                return cached[1]
+
+        # Los ficheros de una versión no cambian nunca, así que pueden mapearse en memoria sin riesgo
+        # (en Windows se cargan en memoria para que la versión pueda borrarse más adelante).
+        version_dir = os.path.join(index_dir, version)
+        try:
+            vectors = np.load(os.path.join(version_dir, EMBEDDINGS_FILE), mmap_mode=None if os.name == "nt" else "r")
+            with open(os.path.join(version_dir, CHUNKS_FILE), encoding="utf-8") as f:
+                records = json.load(f)
+            break
+        except FileNotFoundError:
+            # Entre leer CURRENT y abrir los ficheros se guardaron dos versiones nuevas: se vuelve a leer
+            if attempt == 2:
+                raise
+    index = LocalVectorIndex(vectors, records)
+    with _loaded_indexes_lock:
+        _loaded_indexes[collection_name] = (version, index)
+    return index
+
+def search_local_index(collection_name: str, query_vector: list, k: int) -> list:
+    """Busca en el índice local y devuelve los fragmentos como `Document` de LangChain."""
+    documents = []
+    for record, score in load_local_index(collection_name).search(query_vector, k):
+        metadata = {key: value for key, value in record.items() if key != "text"}
+        metadata["score"] = score
+        documents.append(Document(page_content=record["text"], metadata=metadata))
+    return documents
+
+class LocalVectorRetriever(BaseRetriever):
+    """Retriever de LangChain sobre un índice local, equivalente al de Atlas Vector Search."""
+    collection_name: str
+    embeddings: Any
+    k: int = 5
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> list:
+        return search_local_index(self.collection_name, self.embeddings.embed_query(query), self.k)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager=None) -> list:
+        # La búsqueda es un producto matriz-vector sobre un índice ya cargado: no merece un hilo
+        return search_local_index(self.collection_name, await self.embeddings.aembed_query(query), self.k)
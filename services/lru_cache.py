@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+from .metrics import increment
+
+class LRUCache:
+    """
+    Caché en memoria con expulsión del elemento usado hace más tiempo, segura entre hilos.
+    Los aciertos y fallos se publican en /metrics con la etiqueta `cache=name`.
+    """
+
+    def __init__(self, name: str, max_size: int):
+        self.name = name
+        self.max_size = max(1, max_size)
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                value = self._items[key]
+                hit = True
+            else:
+                value = default
+                hit = False
+        increment("lru_cache_total", cache=self.name, result="hit" if hit else "miss")
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def get_or_create(self, key, factory):
+        """
+        Devuelve el valor de `key` o lo crea con `factory()`. La creación se hace fuera del
+        cerrojo: si dos hilos la piden a la vez puede crearse dos veces, pero ambos reciben
+        el mismo valor.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        value = factory()
+        with self._lock:
+            current = self._items.get(key)
+            if current is not None:
+                return current
+            self._items[key] = value
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._items.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
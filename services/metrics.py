@@ -0,0 +1,323 @@
+import os
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from langchain_core.callbacks import BaseCallbackHandler
+from .mongo_collections import ANALYSIS_TRACES_COLLECTION
+from .mongo_retention import ensure_ttl_index
+
+# --- Métricas en memoria del proceso, expuestas en formato Prometheus en /metrics ---
+# Las etiquetas de Prometheus son de baja cardinalidad (fase, modelo, tipo de error); los IDs de
+# documento y de control solo se guardan en la traza de cada análisis. Con varios workers cada
+# proceso tiene sus propias métricas, como con el cliente oficial de Prometheus en modo simple.
+METRIC_PREFIX = "ia_auditor"
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Número máximo de eventos por traza, para acotar la memoria en documentos muy grandes.
+MAX_TRACE_EVENTS = 5000
+# Las trazas caducan a los 14 días (índice TTL de MongoDB).
+DEFAULT_TRACES_TTL_SECONDS = 14 * 24 * 3600
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_help = {
+    "stage_duration_seconds": "Duración de cada fase del pipeline de auditoría.",
+    "llm_latency_seconds": "Latencia de cada llamada al LLM.",
+    "llm_calls_total": "Llamadas al LLM por modelo y resultado.",
+    "llm_tokens_total": "Tokens de entrada y salida consumidos por el LLM.",
+    "llm_errors_total": "Errores de las llamadas al LLM por tipo.",
+    "llm_retries_total": "Reintentos de llamadas al LLM, por tipo de error.",
+    "stage_errors_total": "Errores en las fases del pipeline por tipo.",
+    "extraction_cache_total": "Aciertos y fallos de la caché de texto extraído.",
+    "analysis_oversize_total": "Documentos que superan el límite de tokens por prompt, por política aplicada.",
+    "analysis_budget_exceeded_total": "Análisis que superan el presupuesto total de tokens, por política aplicada.",
+    "llm_concurrency_limit": "Límite adaptativo de llamadas simultáneas al LLM del proceso.",
+    "analysis_control_errors_total": "Controles que no se pudieron analizar tras agotar los reintentos.",
+    "analysis_triage_total": "Controles plausibles y descartados por el triaje de similitud.",
+    "chat_cache_total": "Preguntas del chat respondidas desde la caché semántica (hit) o con el LLM (miss).",
+    "control_library_total": "Borradores de política y riesgos servidos desde la biblioteca de controles (hit) o generados con el LLM (miss).",
+    "asgi_in_flight_requests": "Peticiones en curso en el modo ASGI por grupo de endpoints.",
+    "asgi_rejected_total": "Peticiones rechazadas con 503 en el modo ASGI por no haber hueco en su grupo de endpoints.",
+    "lru_cache_total": "Aciertos y fallos de las cachés LRU en memoria (retrievers, cadenas RAG, embeddings de consultas).",
+}
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted((key, str(value)) for key, value in labels.items())))
+
+def increment(name: str, value: float = 1, **labels):
+    """Incrementa un contador."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name: str, value: float, **labels):
+    """Fija el valor actual de un indicador."""
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+def observe(name: str, value: float, **labels):
+    """Registra una observación en un histograma."""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": [0] * len(DURATION_BUCKETS), "sum": 0.0, "count": 0}
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                histogram["buckets"][index] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (f'{key}="{value}"'.replace("\n", " ") for key, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+def render_prometheus() -> str:
+    """Devuelve todas las métricas en el formato de texto de Prometheus."""
+    lines = []
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {key: {"buckets": list(h["buckets"]), "sum": h["sum"], "count": h["count"]} for key, h in _histograms.items()}
+    for name in sorted({key[0] for key in counters}):
+        full_name = f"{METRIC_PREFIX}_{name}"
+        lines.append(f"# HELP {full_name} {_help.get(name, name)}")
+        lines.append(f"# TYPE {full_name} counter")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{full_name}{_format_labels(labels)} {value}")
+    for name in sorted({key[0] for key in gauges}):
+        full_name = f"{METRIC_PREFIX}_{name}"
+        lines.append(f"# HELP {full_name} {_help.get(name, name)}")
+        lines.append(f"# TYPE {full_name} gauge")
+        for (metric, labels), value in sorted(gauges.items()):
+            if metric == name:
+                lines.append(f"{full_name}{_format_labels(labels)} {value}")
+    for name in sorted({key[0] for key in histograms}):
+        full_name = f"{METRIC_PREFIX}_{name}"
+        lines.append(f"# HELP {full_name} {_help.get(name, name)}")
+        lines.append(f"# TYPE {full_name} histogram")
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            for bound, count in zip(DURATION_BUCKETS, histogram["buckets"]):
+                lines.append(f"{full_name}_bucket{_format_labels(labels, (('le', bound),))} {count}")
+            lines.append(f"{full_name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {histogram['count']}")
+            lines.append(f"{full_name}_sum{_format_labels(labels)} {histogram['sum']}")
+            lines.append(f"{full_name}_count{_format_labels(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+# --- Trazas por análisis ---
+# La traza activa se propaga con contextvars; _run_concurrently copia el contexto a sus hilos.
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+# Etiquetas de las fases abiertas (documento, control...), heredadas por las llamadas al LLM que contienen.
+_current_tags = contextvars.ContextVar("current_tags", default={})
+
+class AnalysisTrace:
+    """Eventos (fases y llamadas al LLM) de un análisis, con sus etiquetas y tiempos relativos."""
+
+    def __init__(self, name: str, tags: dict):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.tags = tags
+        self.started = time.perf_counter()
+        self.started_at = datetime.now(timezone.utc)
+        self.events = []
+        self.dropped_events = 0
+        self._lock = threading.Lock()
+
+    def add_event(self, kind: str, name: str, seconds: float, **tags):
+        with self._lock:
+            if len(self.events) >= MAX_TRACE_EVENTS:
+                self.dropped_events += 1
+                return
+            self.events.append({
+                "kind": kind,
+                "name": name,
+                "offset": round(time.perf_counter() - self.started - seconds, 4),
+                "seconds": round(seconds, 4),
+                **{key: value for key, value in tags.items() if value is not None},
+            })
+
+    def summary(self) -> dict:
+        """Tiempo total por fase y totales del LLM, para localizar dónde se va el tiempo."""
+        stages = {}
+        llm = {"calls": 0, "input_tokens": 0, "output_tokens": 0, "errors": 0, "seconds": 0.0}
+        with self._lock:
+            for event in self.events:
+                if event["kind"] == "llm":
+                    llm["calls"] += 1
+                    llm["seconds"] = round(llm["seconds"] + event["seconds"], 4)
+                    llm["input_tokens"] += event.get("input_tokens", 0)
+                    llm["output_tokens"] += event.get("output_tokens", 0)
+                    llm["errors"] += int("error" in event)
+                else:
+                    stages[event["name"]] = round(stages.get(event["name"], 0) + event["seconds"], 4)
+        return {"stages": stages, "llm": llm}
+
+    def to_document(self) -> dict:
+        return {
+            "_id": self.trace_id,
+            "name": self.name,
+            "tags": self.tags,
+            "started_at": self.started_at,
+            "total_seconds": round(time.perf_counter() - self.started, 4),
+            "summary": self.summary(),
+            "events": list(self.events),
+            "dropped_events": self.dropped_events,
+        }
+
+def get_current_trace() -> AnalysisTrace | None:
+    return _current_trace.get()
+
+_trace_indexes_ready = False
+
+def _get_traces_collection():
+    """Devuelve la colección de trazas, creando su índice TTL la primera vez."""
+    global _trace_indexes_ready
+    from .vector_store_manager import get_mongo_collection
+    collection = get_mongo_collection(ANALYSIS_TRACES_COLLECTION)
+    if not _trace_indexes_ready:
+        ensure_ttl_index(collection, "started_at", int(os.getenv('ANALYSIS_TRACES_TTL_SECONDS', DEFAULT_TRACES_TTL_SECONDS)))
+        _trace_indexes_ready = True
+    return collection
+
+def _save_trace(trace: AnalysisTrace):
+    """Imprime el resumen de la traza y la guarda en MongoDB (si falla, solo se avisa)."""
+    document = trace.to_document()
+    print(f"Traza {trace.trace_id} ({trace.name}, {document['total_seconds']:.2f}s): {document['summary']}")
+    if os.getenv('ANALYSIS_TRACES_ENABLED', 'true').lower() in ('false', '0', 'no'):
+        return
+    try:
+        _get_traces_collection().insert_one(document)
+    except Exception as e:
+        print(f"ADVERTENCIA: No se pudo guardar la traza {trace.trace_id}: {e}")
+
+@contextmanager
+def trace_analysis(name: str, **tags):
+    """
+    Abre la traza de un análisis. Si ya hay una activa (por ejemplo, la del trabajo en segundo
+    plano que contiene el análisis) se reutiliza. Al cerrarse se guarda en ANALYSIS_TRACES_COLLECTION.
+    """
+    current = _current_trace.get()
+    if current is not None:
+        yield current
+        return
+    trace = AnalysisTrace(name, tags)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        _save_trace(trace)
+
+def get_trace(trace_id: str) -> dict | None:
+    """Devuelve una traza guardada."""
+    return _get_traces_collection().find_one({"_id": trace_id})
+
+@contextmanager
+def span(stage: str, **tags):
+    """
+    Mide una fase del pipeline: la registra en el histograma `stage_duration_seconds` y, si hay
+    una traza activa, como evento con sus etiquetas (documento, control, etc.). Los errores se
+    cuentan por tipo y se relanzan.
+    """
+    started = time.perf_counter()
+    error = None
+    tags_token = _current_tags.set({**_current_tags.get(), **tags})
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        increment("stage_errors_total", stage=stage, error_type=error)
+        raise
+    finally:
+        _current_tags.reset(tags_token)
+        seconds = time.perf_counter() - started
+        observe("stage_duration_seconds", seconds, stage=stage)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_event("stage", stage, seconds, error=error, **tags)
+
+def _extract_token_usage(response) -> tuple:
+    """Tokens de entrada y salida de una respuesta, según lo que informe el proveedor."""
+    input_tokens = output_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            if usage:
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+                continue
+            # Formato de Vertex AI en generation_info
+            usage = (generation.generation_info or {}).get("usage_metadata") or {}
+            input_tokens += usage.get("prompt_token_count", 0)
+            output_tokens += usage.get("candidates_token_count", 0)
+    if not input_tokens and not output_tokens:
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        input_tokens = token_usage.get("prompt_tokens", 0)
+        output_tokens = token_usage.get("completion_tokens", 0)
+    return input_tokens, output_tokens
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """
+    Callback de LangChain que mide cada llamada al LLM: latencia, tokens, reintentos y errores
+    por tipo. Si el proveedor no informa de los tokens se estiman (~4 caracteres por token).
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self._calls = {}
+        self._calls_lock = threading.Lock()
+
+    def _start(self, run_id, prompt_chars: int):
+        with self._calls_lock:
+            self._calls[run_id] = (time.perf_counter(), prompt_chars, _current_trace.get(), _current_tags.get())
+
+    def _finish(self, run_id):
+        with self._calls_lock:
+            return self._calls.pop(run_id, (time.perf_counter(), 0, None, {}))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, sum(len(str(message.content)) for batch in messages for message in batch))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, sum(len(prompt) for prompt in prompts))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started, prompt_chars, trace, tags = self._finish(run_id)
+        seconds = time.perf_counter() - started
+        input_tokens, output_tokens = _extract_token_usage(response)
+        if not input_tokens:
+            input_tokens = prompt_chars // 4 + 1
+        if not output_tokens:
+            output_tokens = sum(len(generation.text) for generations in response.generations for generation in generations) // 4 + 1
+        observe("llm_latency_seconds", seconds, model=self.model_name)
+        increment("llm_calls_total", model=self.model_name, status="ok")
+        increment("llm_tokens_total", input_tokens, model=self.model_name, direction="input")
+        increment("llm_tokens_total", output_tokens, model=self.model_name, direction="output")
+        if trace is not None:
+            trace.add_event("llm", self.model_name, seconds, input_tokens=input_tokens, output_tokens=output_tokens, **tags)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        started, _, trace, tags = self._finish(run_id)
+        seconds = time.perf_counter() - started
+        error_type = type(error).__name__
+        observe("llm_latency_seconds", seconds, model=self.model_name)
+        increment("llm_calls_total", model=self.model_name, status="error")
+        increment("llm_errors_total", model=self.model_name, error_type=error_type)
+        if trace is not None:
+            trace.add_event("llm", self.model_name, seconds, error=error_type, **tags)
+
+    def on_retry(self, retry_state, *, run_id, **kwargs):
+        # Mismas etiquetas que los reintentos de rate_limiter.call_with_retry
+        error = retry_state.outcome.exception() if retry_state.outcome is not None else None
+        increment("llm_retries_total", reason=type(error).__name__ if error is not None else "unknown")
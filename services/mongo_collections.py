@@ -0,0 +1,41 @@
+# --- Nombres de las colecciones de MongoDB que usa la aplicación ---
+# Se definen aquí para que los servicios y los scripts de mantenimiento (por ejemplo,
+# scripts/migrate_chunk_collections.py) compartan una única lista.
+
+# Colección única con los fragmentos de todos los documentos (backend 'atlas'). Cada fragmento
+# lleva el documento al que pertenece (doc_id), su tenant y la versión del documento, y las
+# búsquedas vectoriales se prefiltran por documento. El índice de Atlas Vector Search de esta
+# colección debe declarar 'doc_id' y 'tenant' como campos de filtro (ver README).
+CHUNKS_COLLECTION = "document_chunks"
+# Catálogo por defecto: controles del Anexo A de ISO 27001:2022 (scripts/seed_database.py).
+CONTROLS_COLLECTION = "iso_27001_controls"
+# Documento por catálogo con un número de versión que se incrementa cada vez que se reescribe.
+CATALOG_VERSIONS_COLLECTION = "catalog_versions"
+# Resultados del análisis por control.
+ANALYSIS_CACHE_COLLECTION = "control_analysis_cache"
+# Último análisis completo de cada documento, usado para las re-auditorías incrementales.
+ANALYSIS_HISTORY_COLLECTION = "analysis_history"
+# Estado y resultados parciales de cada trabajo de análisis en segundo plano.
+ANALYSIS_JOBS_COLLECTION = "analysis_jobs"
+# Traza de cada análisis.
+ANALYSIS_TRACES_COLLECTION = "analysis_traces"
+# Umbral de triaje calibrado para cada modelo de embeddings.
+TRIAGE_CALIBRATION_COLLECTION = "triage_calibration"
+# Caché semántica de respuestas del chat.
+CHAT_CACHE_COLLECTION = "chat_answer_cache"
+# Borradores de política y riesgos precalculados por control.
+CONTROL_LIBRARY_COLLECTION = "control_library"
+
+# Todas las colecciones propias de la aplicación (las que no son fragmentos de un documento).
+APPLICATION_COLLECTIONS = (
+    CHUNKS_COLLECTION,
+    CONTROLS_COLLECTION,
+    CATALOG_VERSIONS_COLLECTION,
+    ANALYSIS_CACHE_COLLECTION,
+    ANALYSIS_HISTORY_COLLECTION,
+    ANALYSIS_JOBS_COLLECTION,
+    ANALYSIS_TRACES_COLLECTION,
+    TRIAGE_CALIBRATION_COLLECTION,
+    CHAT_CACHE_COLLECTION,
+    CONTROL_LIBRARY_COLLECTION,
+)
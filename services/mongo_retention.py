@@ -0,0 +1,27 @@
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+
+# --- Retención de las colecciones que funcionan como caché o registro ---
+# Las entradas caducan con un índice TTL y, en las cachés, se limita además el número de
+# entradas eliminando las más antiguas.
+
+def ensure_ttl_index(collection, field: str, ttl_seconds: int):
+    """
+    Crea el índice TTL '<field>_ttl' para que MongoDB borre automáticamente los documentos
+    `ttl_seconds` después de la fecha de `field`. Si ya existe con otro TTL, se actualiza.
+    """
+    name = f"{field}_ttl"
+    try:
+        collection.create_index([(field, ASCENDING)], expireAfterSeconds=ttl_seconds, name=name)
+    except OperationFailure:
+        # El índice ya existe con otro TTL: se actualiza en lugar de recrearlo.
+        collection.database.command("collMod", collection.name, index={"name": name, "expireAfterSeconds": ttl_seconds})
+
+def evict_oldest(collection, max_entries: int, field: str = "created_at"):
+    """Elimina las entradas más antiguas (por `field`) cuando la colección supera `max_entries`."""
+    excess = collection.estimated_document_count() - max_entries
+    if excess <= 0:
+        return
+    oldest_ids = [entry["_id"] for entry in collection.find({}, {"_id": 1}).sort(field, ASCENDING).limit(excess)]
+    if oldest_ids:
+        collection.delete_many({"_id": {"$in": oldest_ids}})
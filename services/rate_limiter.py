@@ -0,0 +1,177 @@
+import os
+import time
+import asyncio
+import random
+import threading
+from google.api_core import exceptions as google_exceptions
+from .metrics import increment, set_gauge
+
+# --- Reintentos y control adaptativo de la concurrencia de las llamadas al LLM ---
+# Errores transitorios de Vertex AI que se reintentan. TooManyRequests incluye ResourceExhausted (429).
+RETRYABLE_EXCEPTIONS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+)
+# Errores que indican que se está superando la cuota o saturando el servicio: reducen la concurrencia.
+THROTTLING_EXCEPTIONS = (google_exceptions.TooManyRequests, google_exceptions.ServiceUnavailable)
+
+DEFAULT_RETRY_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_BASE_SECONDS = 1.0
+DEFAULT_RETRY_MAX_SECONDS = 32.0
+# Límite de llamadas simultáneas al LLM de todo el proceso (suma de todos los análisis en curso).
+DEFAULT_LLM_MAX_CONCURRENCY = 16
+
+def _get_env_number(name: str, default, cast):
+    try:
+        return max(cast(0), cast(os.getenv(name, default)))
+    except ValueError:
+        return default
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limita las llamadas simultáneas al LLM con un control AIMD: cada error de cuota divide el
+    límite a la mitad y cada llamada correcta lo aumenta en 1/límite (una unidad por cada
+    "ventana" de llamadas correctas). Así la concurrencia se ajusta a la cuota disponible en
+    lugar de seguir lanzando peticiones que fallan.
+    Los errores de cuota de llamadas lanzadas antes del último recorte no vuelven a recortar,
+    para que una ráfaga de 429 simultáneos cuente como una sola señal.
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(self.max_limit)
+        self._in_flight = 0
+        self._epoch = 0
+        self._condition = threading.Condition()
+        set_gauge("llm_concurrency_limit", self.max_limit)
+
+    def acquire(self) -> int:
+        """Espera a que haya hueco y devuelve la época de la llamada, que se pasa a `release`."""
+        with self._condition:
+            while self._in_flight >= int(self.limit):
+                self._condition.wait()
+            self._in_flight += 1
+            return self._epoch
+
+    def release(self, epoch: int, throttled: bool | None):
+        """
+        Libera el hueco de una llamada. `throttled=True` si falló por cuota, `False` si terminó
+        bien y `None` si falló por otro motivo (no cambia el límite).
+        """
+        with self._condition:
+            self._in_flight -= 1
+            if throttled and epoch == self._epoch:
+                self.limit = max(self.min_limit, self.limit / 2)
+                self._epoch += 1
+            elif throttled is False:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            set_gauge("llm_concurrency_limit", int(self.limit))
+            self._condition.notify_all()
+
+# --- Limitador singleton del proceso: la cuota de Vertex AI es compartida por todos los análisis ---
+_llm_limiter = None
+_llm_limiter_lock = threading.Lock()
+
+def get_llm_limiter() -> AdaptiveConcurrencyLimiter:
+    """Devuelve el limitador de concurrencia compartido, con tope LLM_MAX_CONCURRENCY."""
+    global _llm_limiter
+    if _llm_limiter is None:
+        with _llm_limiter_lock:
+            if _llm_limiter is None:
+                _llm_limiter = AdaptiveConcurrencyLimiter(_get_env_number('LLM_MAX_CONCURRENCY', DEFAULT_LLM_MAX_CONCURRENCY, int))
+    return _llm_limiter
+
+def _get_retry_policy() -> tuple:
+    """Devuelve (intentos, espera base, espera máxima) de LLM_RETRY_MAX_ATTEMPTS, LLM_RETRY_BASE_SECONDS y LLM_RETRY_MAX_SECONDS."""
+    return (
+        max(1, _get_env_number('LLM_RETRY_MAX_ATTEMPTS', DEFAULT_RETRY_MAX_ATTEMPTS, int)),
+        _get_env_number('LLM_RETRY_BASE_SECONDS', DEFAULT_RETRY_BASE_SECONDS, float),
+        _get_env_number('LLM_RETRY_MAX_SECONDS', DEFAULT_RETRY_MAX_SECONDS, float),
+    )
+
+def _get_backoff_seconds(attempt: int, base_seconds: float, max_seconds: float) -> float:
+    # "Full jitter": reparte los reintentos de los hilos que fallaron a la vez
+    return random.uniform(0, min(max_seconds, base_seconds * 2 ** (attempt - 1)))
+
+def call_with_retry(func, limiter: AdaptiveConcurrencyLimiter | None = None):
+    """
+    Ejecuta `func()` (una llamada al LLM) dentro del limitador de concurrencia, reintentando los
+    errores transitorios hasta LLM_RETRY_MAX_ATTEMPTS veces con espera exponencial con jitter
+    (LLM_RETRY_BASE_SECONDS, como mucho LLM_RETRY_MAX_SECONDS). Si se agotan los intentos se
+    relanza el último error.
+    """
+    limiter = limiter or get_llm_limiter()
+    max_attempts, base_seconds, max_seconds = _get_retry_policy()
+    for attempt in range(1, max_attempts + 1):
+        epoch = limiter.acquire()
+        try:
+            result = func()
+        except RETRYABLE_EXCEPTIONS as e:
+            # Los errores transitorios que no son de cuota (500, 504) no cambian el límite
+            limiter.release(epoch, throttled=True if isinstance(e, THROTTLING_EXCEPTIONS) else None)
+            if attempt == max_attempts:
+                raise
+            increment("llm_retries_total", reason=type(e).__name__)
+            time.sleep(_get_backoff_seconds(attempt, base_seconds, max_seconds))
+            continue
+        except Exception:
+            limiter.release(epoch, throttled=None)
+            raise
+        limiter.release(epoch, throttled=False)
+        return result
+
+# --- Reintentos de los streams y de las llamadas asíncronas (chat, borradores y riesgos) ---
+# Usan la misma política de reintentos, pero no pasan por el limitador adaptativo: un stream
+# ocuparía su hueco mientras el cliente lee la respuesta, y su espera bloquearía el bucle de
+# eventos del modo ASGI, donde la concurrencia ya la limitan los semáforos de cada endpoint.
+
+def stream_with_retry(func):
+    """
+    Itera el stream que devuelve `func()`, reintentando los errores transitorios solo mientras
+    no se ha recibido ningún fragmento. Una vez enviado texto al cliente, el error se propaga
+    para no repetir la respuesta desde el principio.
+    """
+    max_attempts, base_seconds, max_seconds = _get_retry_policy()
+    for attempt in range(1, max_attempts + 1):
+        started = False
+        try:
+            for chunk in func():
+                started = True
+                yield chunk
+            return
+        except RETRYABLE_EXCEPTIONS as e:
+            if started or attempt == max_attempts:
+                raise
+            increment("llm_retries_total", reason=type(e).__name__)
+            time.sleep(_get_backoff_seconds(attempt, base_seconds, max_seconds))
+
+async def acall_with_retry(func):
+    """Versión asíncrona de `call_with_retry` (sin limitador): `func()` devuelve la corrutina de la llamada."""
+    max_attempts, base_seconds, max_seconds = _get_retry_policy()
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return await func()
+        except RETRYABLE_EXCEPTIONS as e:
+            if attempt == max_attempts:
+                raise
+            increment("llm_retries_total", reason=type(e).__name__)
+            await asyncio.sleep(_get_backoff_seconds(attempt, base_seconds, max_seconds))
+
+async def astream_with_retry(func):
+    """Versión asíncrona de `stream_with_retry`: `func()` devuelve un iterador asíncrono."""
+    max_attempts, base_seconds, max_seconds = _get_retry_policy()
+    for attempt in range(1, max_attempts + 1):
+        started = False
+        try:
+            async for chunk in func():
+                started = True
+                yield chunk
+            return
+        except RETRYABLE_EXCEPTIONS as e:
+            if started or attempt == max_attempts:
+                raise
+            increment("llm_retries_total", reason=type(e).__name__)
+            await asyncio.sleep(_get_backoff_seconds(attempt, base_seconds, max_seconds))
@@ -0,0 +1,99 @@
+import os
+import importlib
+import threading
+import time
+from contextlib import contextmanager
+from .mongo_collections import CONTROLS_COLLECTION
+
+# --- Inicialización diferida de Vertex AI ---
+# vertexai.init() ya no se ejecuta al importar app.py: se llama la primera vez que se
+# necesita el LLM (o durante el calentamiento), de modo que los scripts y los tests que no
+# usan la IA no pagan el coste de importar y configurar el SDK.
+_vertex_initialized = False
+_vertex_lock = threading.Lock()
+
+# Librerías que se importan bajo demanda y que el calentamiento carga por adelantado.
+WARMUP_MODULES = ["pypdf", "docx", "langchain_text_splitters", "langchain_google_vertexai"]
+
+# Duración de cada fase de arranque/calentamiento, en el orden en que se registran.
+_startup_phases = {}
+
+def record_startup_phase(name: str, seconds: float):
+    """Registra la duración de una fase del arranque para el informe de inicio."""
+    _startup_phases[name] = round(seconds, 3)
+
+@contextmanager
+def timed_phase(name: str):
+    """Mide el bloque de código y lo registra como fase del arranque."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_startup_phase(name, time.perf_counter() - started)
+
+def get_startup_report() -> dict:
+    """
+    Devuelve la duración en segundos de cada fase registrada. Algunas fases incluyen a otras
+    (por ejemplo, 'warmup_llm' incluye 'vertex_ai_init'), por lo que no deben sumarse.
+    """
+    return {"phases": dict(_startup_phases)}
+
+def init_vertex_ai():
+    """
+    Inicializa Vertex AI con el proyecto y la ubicación de las variables de entorno.
+    Es idempotente y segura entre hilos. Lanza RuntimeError con un mensaje claro si falla.
+    """
+    global _vertex_initialized
+    if _vertex_initialized:
+        return
+    with _vertex_lock:
+        if _vertex_initialized:
+            return
+        project_id = os.getenv('GOOGLE_CLOUD_PROJECT')
+        location = os.getenv('GOOGLE_CLOUD_LOCATION')
+        with timed_phase("vertex_ai_init"):
+            import vertexai
+            import google.auth
+            try:
+                # Esto configura la librería para todas las llamadas posteriores.
+                vertexai.init(project=project_id, location=location)
+            except google.auth.exceptions.DefaultCredentialsError as e:
+                print(f"ERROR FATAL: Error de credenciales de Google. Causa: {e}")
+                raise RuntimeError(f"Error de credenciales de Google: {e}") from e
+            except Exception as e:
+                print("="*80)
+                print(f"ERROR FATAL: No se pudo inicializar Vertex AI. Causa: {e}")
+                print("Verifica que el proyecto exista, que la facturación esté habilitada y que la cuenta de servicio tenga el rol 'Usuario de Vertex AI'.")
+                print("="*80)
+                raise RuntimeError(f"No se pudo inicializar Vertex AI: {e}") from e
+        print(f"--- Vertex AI inicializado para el proyecto: {project_id} ---")
+        _vertex_initialized = True
+
+def warmup(connect: bool = True) -> dict:
+    """
+    Precarga todo lo que el resto de la aplicación inicializa de forma diferida: las librerías
+    pesadas, el modelo de embeddings y, con `connect=True`, el cliente de Vertex AI y la conexión
+    a MongoDB.
+
+    Antes de hacer fork de los workers (gunicorn.conf.py) debe llamarse con `connect=False`:
+    los clientes gRPC y de MongoDB no sobreviven a un fork, pero el modelo de embeddings sí,
+    y sus páginas de memoria quedan compartidas entre todos los workers.
+    """
+    from .vector_store_manager import get_embeddings, get_mongo_collection, get_vector_backend
+    from .ai_analyzer import get_llm
+    from .control_catalog import preload_control_catalogs
+
+    with timed_phase("warmup_imports"):
+        backend_module = "services.local_vector_index" if get_vector_backend() == 'local' else "langchain_community.vectorstores"
+        for module_name in WARMUP_MODULES + [backend_module]:
+            importlib.import_module(module_name)
+    with timed_phase("warmup_embeddings"):
+        get_embeddings().embed_query("warmup")
+    if connect:
+        with timed_phase("warmup_llm"):
+            get_llm()
+        with timed_phase("warmup_mongodb"):
+            get_mongo_collection(CONTROLS_COLLECTION).database.client.admin.command('ping')
+        with timed_phase("warmup_control_catalogs"):
+            preload_control_catalogs()
+    return get_startup_report()
@@ -0,0 +1,174 @@
+import os
+import hashlib
+from .metrics import increment
+from .lru_cache import LRUCache
+
+# --- Presupuesto de tokens del análisis de cobertura ---
+# Los tokens de cada prompt se estiman localmente (~4 caracteres por token) para no hacer una
+# llamada de recuento a Vertex AI por cada prompt. Para decidir si el documento cabe en un prompt
+# se cuentan con el tokenizador del modelo (una vez por documento), y la estimación queda como
+# alternativa si el recuento falla.
+DEFAULT_CHARS_PER_TOKEN = 4
+# Recuentos de tokens de documentos que se mantienen en memoria, por modelo y texto.
+TOKEN_COUNT_CACHE_SIZE = 256
+# Tokens máximos del contexto (documento o evidencia) de un prompt. Los documentos mayores se
+# tratan según ANALYSIS_OVERSIZE_POLICY.
+DEFAULT_PROMPT_TOKEN_LIMIT = 100000
+# Tokens de entrada estimados de todo un análisis (0 = sin límite). Al superarlo se aplica
+# ANALYSIS_TOKEN_BUDGET_POLICY.
+DEFAULT_TOKEN_BUDGET = 0
+# Tokens que añade la plantilla del prompt (instrucciones y formato JSON) a cada llamada.
+PROMPT_OVERHEAD_TOKENS = 600
+# Solapamiento entre secciones consecutivas, para no partir una cláusula entre dos secciones.
+SECTION_OVERLAP_TOKENS = 200
+
+# Políticas para un documento que no cabe en un prompt:
+#  - 'map_reduce': se analiza por secciones y se combinan los veredictos de cada control.
+#  - 'warn': se envía completo igualmente, avisando en la consola.
+#  - 'refuse': el análisis se rechaza con un error.
+OVERSIZE_POLICIES = ('map_reduce', 'warn', 'refuse')
+# Políticas al superar el presupuesto total: 'warn' o 'refuse'.
+BUDGET_POLICIES = ('warn', 'refuse')
+
+# Orden de los estados de menor a mayor cobertura, para combinar los veredictos por sección.
+STATUS_RANK = {"Not Applicable": 0, "Not Covered": 1, "Partially Covered": 2, "Covered": 3}
+
+def _get_env_int(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.getenv(name, default)))
+    except ValueError:
+        return default
+
+def _get_env_choice(name: str, default: str, choices: tuple) -> str:
+    value = os.getenv(name, default).lower()
+    if value not in choices:
+        print(f"ADVERTENCIA: Valor no válido para {name}: '{value}'. Se usa '{default}'.")
+        return default
+    return value
+
+def get_chars_per_token() -> int:
+    return max(1, _get_env_int('ANALYSIS_CHARS_PER_TOKEN', DEFAULT_CHARS_PER_TOKEN))
+
+def estimate_tokens(text: str) -> int:
+    """Estimación rápida del número de tokens de un texto."""
+    return len(text) // get_chars_per_token() + 1
+
+_token_counts = LRUCache("token_counts", TOKEN_COUNT_CACHE_SIZE)
+
+def count_tokens(text: str, llm=None) -> int:
+    """
+    Número de tokens del texto según el tokenizador del modelo (`llm.get_num_tokens`), guardado
+    en memoria por modelo y texto. Sin `llm`, o si el recuento falla, se usa estimate_tokens.
+    """
+    if llm is None:
+        return estimate_tokens(text)
+    key = (getattr(llm, "model_name", None) or type(llm).__name__, hashlib.sha256(text.encode("utf-8")).hexdigest())
+    tokens = _token_counts.get(key)
+    if tokens is None:
+        try:
+            tokens = llm.get_num_tokens(text)
+        except Exception as e:
+            print(f"ADVERTENCIA: No se pudieron contar los tokens con el modelo, se usa la estimación por caracteres: {e}")
+            return estimate_tokens(text)
+        _token_counts.put(key, tokens)
+    return tokens
+
+def get_prompt_token_limit() -> int:
+    return max(1, _get_env_int('ANALYSIS_PROMPT_TOKEN_LIMIT', DEFAULT_PROMPT_TOKEN_LIMIT))
+
+def get_oversize_policy() -> str:
+    return _get_env_choice('ANALYSIS_OVERSIZE_POLICY', 'map_reduce', OVERSIZE_POLICIES)
+
+def get_token_budget() -> int:
+    return _get_env_int('ANALYSIS_TOKEN_BUDGET', DEFAULT_TOKEN_BUDGET)
+
+def get_budget_policy() -> str:
+    return _get_env_choice('ANALYSIS_TOKEN_BUDGET_POLICY', 'warn', BUDGET_POLICIES)
+
+def split_into_sections(text: str, max_tokens: int, chars_per_token: float | None = None) -> list:
+    """
+    Divide el documento en secciones de como máximo `max_tokens` tokens, cortando
+    preferentemente entre párrafos y con un pequeño solapamiento entre secciones. Los tokens se
+    convierten en caracteres con `chars_per_token` (el medido en el documento) o, si no se
+    indica, con ANALYSIS_CHARS_PER_TOKEN.
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    chars_per_token = chars_per_token or get_chars_per_token()
+    chunk_size = max(1, int(max(1, max_tokens - PROMPT_OVERHEAD_TOKENS) * chars_per_token))
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=min(int(SECTION_OVERLAP_TOKENS * chars_per_token), chunk_size // 10),
+    )
+    return splitter.split_text(text) or [text]
+
+def plan_document_context(document_text: str, llm=None) -> dict:
+    """
+    Decide cómo se envía el documento al LLM en el modo 'full'. Los tokens del documento se
+    cuentan con el tokenizador de `llm` (ver count_tokens). Devuelve un dict con:
+      - 'sections': textos que se envían por separado (uno solo si el documento cabe).
+      - 'error': mensaje si la política es 'refuse' y el documento no cabe; None en otro caso.
+    """
+    limit = get_prompt_token_limit()
+    document_tokens = count_tokens(document_text, llm)
+    if document_tokens + PROMPT_OVERHEAD_TOKENS <= limit:
+        return {"sections": [document_text], "error": None}
+
+    policy = get_oversize_policy()
+    increment("analysis_oversize_total", policy=policy)
+    if policy == 'refuse':
+        return {
+            "sections": [],
+            "error": f"El documento tiene unos {document_tokens} tokens y supera el límite de {limit} tokens por prompt (ANALYSIS_PROMPT_TOKEN_LIMIT). Divídelo en documentos más pequeños o usa el modo 'retrieval'.",
+        }
+    if policy == 'warn':
+        print(f"ADVERTENCIA: El documento tiene unos {document_tokens} tokens y supera el límite de {limit} tokens por prompt. Se envía completo.")
+        return {"sections": [document_text], "error": None}
+
+    # Las secciones se dimensionan con la relación caracteres/token real del documento
+    sections = split_into_sections(document_text, limit, max(1.0, len(document_text) / max(1, document_tokens)))
+    print(f"El documento tiene unos {document_tokens} tokens y supera el límite de {limit} por prompt: se analiza en {len(sections)} secciones.")
+    return {"sections": sections, "error": None}
+
+def get_context_cache_variant() -> str:
+    """
+    Sufijo de la caché de resultados del modo 'full'. Solo depende de la configuración, no del
+    recuento de tokens del documento, para que un análisis ya guardado se pueda servir desde la
+    caché sin llamar al modelo: con 'map_reduce' el resultado depende del tamaño de sección.
+    """
+    if get_oversize_policy() == 'map_reduce':
+        return f":sections={get_prompt_token_limit()}"
+    return ""
+
+def check_token_budget(estimated_tokens: int, calls: int) -> str | None:
+    """
+    Compara los tokens de entrada estimados del análisis con ANALYSIS_TOKEN_BUDGET. Devuelve un
+    mensaje de error si se supera y la política es 'refuse'; si es 'warn', solo avisa.
+    """
+    budget = get_token_budget()
+    if not budget or estimated_tokens <= budget:
+        return None
+    policy = get_budget_policy()
+    increment("analysis_budget_exceeded_total", policy=policy)
+    message = f"El análisis necesita unos {estimated_tokens} tokens de entrada en {calls} llamadas al LLM y supera el presupuesto de {budget} tokens (ANALYSIS_TOKEN_BUDGET)."
+    if policy == 'refuse':
+        return message + " Reduce los controles aplicables o usa el modo 'retrieval'."
+    print(f"ADVERTENCIA: {message} Se continúa igualmente.")
+    return None
+
+def merge_section_verdicts(section_results: list) -> dict:
+    """
+    Combina los veredictos de un control obtenidos sección a sección. Basta con que una sección
+    cubra el control para considerarlo cubierto: el estado final es el de mayor cobertura, y la
+    justificación reúne las de las secciones con ese estado, en orden. Los estados desconocidos
+    cuentan como 'Not Covered'. El resultado no depende del orden en que terminen las secciones.
+    """
+    ranked = [
+        (STATUS_RANK.get(result.get("status"), STATUS_RANK["Not Covered"]), index, result)
+        for index, result in enumerate(section_results)
+    ]
+    best_rank = max(rank for rank, _, _ in ranked)
+    best = [(index, result) for rank, index, result in ranked if rank == best_rank]
+    status = next(name for name, rank in STATUS_RANK.items() if rank == best_rank)
+    total = len(section_results)
+    justification = " ".join(f"[Sección {index + 1}/{total}] {result.get('justification', '')}".strip() for index, result in best)
+    return {"status": status, "justification": justification}
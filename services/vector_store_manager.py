@@ -1,16 +1,97 @@
 import os
-from pymongo import MongoClient
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import MongoDBAtlasVectorSearch
+import hashlib
+import threading
+from pymongo import ASCENDING, DeleteMany, InsertOne, MongoClient, UpdateMany, UpdateOne
+from langchain_core.embeddings import Embeddings
+from .metrics import span
+from .lru_cache import LRUCache
+from .mongo_collections import CHUNKS_COLLECTION
+# Las librerías pesadas (modelo de embeddings, LangChain community, NumPy) se importan dentro
+# de las funciones que las usan, para que importar este módulo no ralentice el arranque.
 
 DB_NAME = "ia_auditor_db"
 # Modelo de embeddings que usaremos. 'all-MiniLM-L6-v2' es rápido y eficaz.
 # Es importante que el número de dimensiones coincida con el índice de Atlas (384 para este modelo).
 EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+VECTOR_SEARCH_INDEX_NAME = "default"
+DEFAULT_TENANT = "default"
+# Tamaño de la caché LRU de embeddings de consultas (preguntas del chat y consultas de evidencia).
+DEFAULT_QUERY_EMBEDDING_CACHE_SIZE = 1024
+# Número de retrievers por documento que se mantienen creados (RAG_POOL_SIZE).
+DEFAULT_RAG_POOL_SIZE = 128
 
-# Se utiliza la clase recomendada y actualizada de langchain-huggingface.
-embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+def create_local_embeddings():
+    """Carga el modelo de embeddings en este proceso."""
+    # Se utiliza la clase recomendada y actualizada de langchain-huggingface.
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+
+def _create_embeddings():
+    """
+    Si EMBEDDING_SERVICE_ADDRESS está definida, los embeddings se piden al servicio compartido
+    (scripts/run_embedding_service.py) en lugar de cargar una copia del modelo en cada worker.
+    """
+    service_address = os.getenv('EMBEDDING_SERVICE_ADDRESS')
+    if service_address:
+        from .embedding_service import RemoteEmbeddings
+        return RemoteEmbeddings(service_address)
+    return create_local_embeddings()
+
+# --- Modelo de embeddings singleton, cargado la primera vez que se necesita (o en el calentamiento) ---
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+def get_embeddings():
+    """Devuelve el modelo de embeddings, cargándolo en la primera llamada."""
+    global _embeddings
+    if _embeddings is None:
+        with _embeddings_lock:
+            if _embeddings is None:
+                from .runtime import timed_phase
+                with timed_phase("embeddings_load"):
+                    _embeddings = _create_embeddings()
+    return _embeddings
+
+def _get_env_size(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.getenv(name, default)))
+    except ValueError:
+        return default
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Embeddings de consultas con caché LRU: las preguntas y consultas de evidencia repetidas no
+    vuelven a pasar por el modelo. Delega siempre en `get_embeddings()`; los documentos no se cachean.
+    """
+
+    def __init__(self, max_size: int):
+        self.cache = LRUCache("query_embeddings", max_size)
+
+    def embed_documents(self, texts: list) -> list:
+        return get_embeddings().embed_documents(texts)
+
+    def embed_query(self, text: str) -> list:
+        vector = self.cache.get(text)
+        if vector is None:
+            vector = get_embeddings().embed_query(text)
+            self.cache.put(text, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> list:
+        vector = self.cache.get(text)
+        if vector is None:
+            vector = await get_embeddings().aembed_query(text)
+            self.cache.put(text, vector)
+        return vector
+
+_query_embeddings = None
+
+def get_query_embeddings() -> CachedQueryEmbeddings:
+    """Devuelve los embeddings con caché de consultas (QUERY_EMBEDDING_CACHE_SIZE entradas)."""
+    global _query_embeddings
+    if _query_embeddings is None:
+        _query_embeddings = CachedQueryEmbeddings(_get_env_size('QUERY_EMBEDDING_CACHE_SIZE', DEFAULT_QUERY_EMBEDDING_CACHE_SIZE))
+    return _query_embeddings
 
 # --- Refactorización: Cliente de MongoDB Singleton ---
 # Se crea una única instancia del cliente de MongoDB para ser reutilizada en toda la aplicación.
@@ -42,31 +123,255 @@ def get_mongo_collection(collection_name: str):
     db = client[DB_NAME]
     return db[collection_name]
 
-def create_vector_store(document_text: str, collection_name: str):
-    """
-    Divide el texto, crea embeddings y los almacena en MongoDB Atlas.
-    Borra los documentos antiguos de la colección para mantenerla actualizada.
-    """
-    collection = get_mongo_collection(collection_name)
-    
-    # Borrar datos antiguos para este documento para evitar duplicados
-    collection.delete_many({})
-
-    # Dividir el documento en trozos (chunks) manejables
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
-    docs = text_splitter.split_text(document_text)
-
-    # Crear la base de datos vectorial y almacenar los documentos y sus embeddings
-    MongoDBAtlasVectorSearch.from_texts(
-        texts=docs,
-        embedding=embeddings,
-        collection=collection,
-        index_name="default" # Este es el nombre del índice que crearemos en Atlas
-    )
-    print(f"Base de datos vectorial creada/actualizada para la colección '{collection_name}' con {len(docs)} fragmentos.")
-
-def get_vector_store_retriever(collection_name: str):
-    """Obtiene un retriever para hacer búsquedas de similitud en la base de datos vectorial."""
-    collection = get_mongo_collection(collection_name)
-    vector_store = MongoDBAtlasVectorSearch(collection, embeddings, index_name="default")
-    return vector_store.as_retriever(search_type="similarity", search_kwargs={"k": 5})
\ No newline at end of file
+# Cliente asíncrono (pymongo >= 4.13) para el modo ASGI (asgi.py): sus consultas se esperan en el
+# bucle de eventos sin ocupar un hilo. Se crea en la primera consulta, dentro del bucle que lo usa.
+_async_mongo_client = None
+
+def get_async_mongo_collection(collection_name: str):
+    """Obtiene una colección de MongoDB para consultas con `await`."""
+    global _async_mongo_client
+    if _async_mongo_client is None:
+        mongo_uri = os.getenv("MONGO_URI")
+        if not mongo_uri:
+            raise ValueError("La variable de entorno MONGO_URI no está configurada.")
+        from pymongo import AsyncMongoClient
+        _async_mongo_client = AsyncMongoClient(mongo_uri)
+    return _async_mongo_client[DB_NAME][collection_name]
+
+_text_splitter = None
+
+def split_document(document_text: str) -> list:
+    """Divide el texto en los mismos fragmentos (chunks) que se almacenan en la base de datos vectorial."""
+    global _text_splitter
+    if _text_splitter is None:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        _text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
+    with span("chunking"):
+        return _text_splitter.split_text(document_text)
+
+def _find_chunk_offsets(document_text: str, chunk_texts: list) -> list:
+    """
+    Posición de cada fragmento dentro del texto. Los fragmentos aparecen en orden y se solapan,
+    así que cada uno se busca a partir del inicio del anterior.
+    """
+    offsets = []
+    position = 0
+    for chunk_text in chunk_texts:
+        offset = document_text.find(chunk_text, position)
+        if offset < 0:
+            offset = position
+        offsets.append(offset)
+        position = offset + 1
+    return offsets
+
+def compute_chunk_hash(chunk_text: str) -> str:
+    """Hash SHA-256 del texto de un fragmento, que lo identifica entre versiones de un documento."""
+    return hashlib.sha256(chunk_text.encode("utf-8")).hexdigest()
+
+def _compute_embedding_key(chunk_text: str) -> str:
+    """
+    Clave de un fragmento en la base de datos vectorial: hash del texto y del modelo de embeddings.
+    Si cambia el modelo, los vectores guardados dejan de ser válidos y se recalculan.
+    """
+    return hashlib.sha256(f"{EMBEDDING_MODEL}\0{chunk_text}".encode("utf-8")).hexdigest()
+
+def get_tenant() -> str:
+    """Tenant al que pertenecen los documentos de esta instancia (TENANT_ID)."""
+    return os.getenv('TENANT_ID', DEFAULT_TENANT)
+
+_chunk_indexes_ready = False
+
+def get_chunks_collection():
+    """Devuelve la colección compartida de fragmentos, creando sus índices la primera vez."""
+    global _chunk_indexes_ready
+    collection = get_mongo_collection(CHUNKS_COLLECTION)
+    if not _chunk_indexes_ready:
+        # Un fragmento (por su texto y modelo) aparece una sola vez en cada documento
+        collection.create_index([("tenant", ASCENDING), ("doc_id", ASCENDING), ("embedding_key", ASCENDING)], unique=True, name="tenant_doc_embedding_key")
+        collection.create_index([("tenant", ASCENDING), ("doc_id", ASCENDING), ("chunk_id", ASCENDING)], name="tenant_doc_chunk_id")
+        # Para reutilizar embeddings ya calculados en otros documentos
+        collection.create_index([("embedding_key", ASCENDING)], name="embedding_key")
+        _chunk_indexes_ready = True
+    return collection
+
+def _get_document_filter(doc_id: str, tenant: str | None = None) -> dict:
+    """Filtro de los fragmentos de un documento, válido en consultas y en el pre_filter de Atlas."""
+    return {"tenant": {"$eq": tenant or get_tenant()}, "doc_id": {"$eq": doc_id}}
+
+def get_vector_backend() -> str:
+    """
+    Backend vectorial configurado en VECTOR_BACKEND:
+     - 'atlas' (por defecto): MongoDB Atlas Vector Search.
+     - 'local': índice NumPy en disco por documento, sin dependencias de red (útil para CI y benchmarks).
+    """
+    return os.getenv('VECTOR_BACKEND', 'atlas').lower()
+
+def create_vector_store(document_text: str, collection_name: str, tenant: str | None = None, version: str | None = None, segments: list | None = None):
+    """
+    Divide el texto, crea embeddings y los almacena en el backend vectorial configurado.
+    `collection_name` identifica al documento (doc_id); con el backend 'atlas' todos los
+    documentos comparten la colección CHUNKS_COLLECTION. `version` es la versión del documento
+    que se guarda con sus fragmentos (por defecto, el hash de su texto).
+    Cada fragmento se guarda con una clave derivada de su texto y del modelo de embeddings,
+    de modo que al reprocesar el documento solo se calculan los embeddings de los fragmentos
+    nuevos y los que ya no existen se eliminan.
+    `segments` son los de `load_document`: con ellos cada fragmento guarda su página (o párrafo)
+    en 'location', para citarla como evidencia.
+    """
+    # Dividir el documento en trozos (chunks) manejables. Los fragmentos repetidos se guardan una sola vez.
+    from .document_processor import locate_offsets
+    chunk_texts = split_document(document_text)
+    locations = locate_offsets(segments, _find_chunk_offsets(document_text, chunk_texts)) if segments else [None] * len(chunk_texts)
+    chunks = {}
+    for chunk_id, (chunk_text, location) in enumerate(zip(chunk_texts, locations)):
+        chunks.setdefault(_compute_embedding_key(chunk_text), (chunk_id, chunk_text, location))
+
+    if get_vector_backend() == 'local':
+        new_count, deleted_count = _store_chunks_local(chunks, collection_name)
+    else:
+        if version is None:
+            from .document_processor import compute_document_hash
+            version = compute_document_hash(document_text)
+        new_count, deleted_count = _store_chunks_atlas(chunks, collection_name, tenant or get_tenant(), version)
+    print(f"Base de datos vectorial creada/actualizada para el documento '{collection_name}' con {len(chunks)} fragmentos "
+          f"({new_count} embeddings nuevos, {len(chunks) - new_count} reutilizados, {deleted_count} eliminados).")
+
+def _build_chunk_record(key: str, chunk_id: int, chunk_text: str, location: str | None) -> dict:
+    """Metadatos que se guardan con cada fragmento, en cualquier backend."""
+    return {
+        "_id": key,
+        "text": chunk_text,
+        # Cada fragmento guarda su posición (chunk_id) y su página o párrafo (location) para poder citarlo como evidencia.
+        "chunk_id": chunk_id,
+        "location": location,
+        "chunk_hash": compute_chunk_hash(chunk_text),
+        "embedding_model": EMBEDDING_MODEL,
+    }
+
+def _store_chunks_atlas(chunks: dict, doc_id: str, tenant: str, version: str) -> tuple:
+    """
+    Sincroniza los fragmentos del documento con la colección compartida de MongoDB Atlas en una
+    única escritura por lotes. Los embeddings ya calculados (en este documento o en cualquier
+    otro con el mismo fragmento) se reutilizan. Devuelve (embeddings_nuevos, fragmentos_eliminados).
+    """
+    collection = get_chunks_collection()
+    document_filter = _get_document_filter(doc_id, tenant)
+
+    # Fragmentos del documento que ya están guardados
+    stored_positions = {
+        doc["embedding_key"]: (doc.get("chunk_id"), doc.get("location"))
+        for doc in collection.find(document_filter, {"_id": 0, "embedding_key": 1, "chunk_id": 1, "location": 1})
+    }
+    missing_keys = [key for key in chunks if key not in stored_positions]
+    # Fragmentos idénticos de otros documentos: se copia su embedding en lugar de recalcularlo
+    reusable_vectors = {}
+    if missing_keys:
+        for doc in collection.find({"embedding_key": {"$in": missing_keys}}, {"_id": 0, "embedding_key": 1, "embedding": 1}):
+            reusable_vectors.setdefault(doc["embedding_key"], doc["embedding"])
+    new_keys = [key for key in missing_keys if key not in reusable_vectors]
+    vectors = dict(reusable_vectors)
+    with span("embedding", doc_id=doc_id, chunks=len(new_keys)):
+        vectors.update(zip(new_keys, get_embeddings().embed_documents([chunks[key][1] for key in new_keys]) if new_keys else []))
+
+    operations = []
+    for key in missing_keys:
+        record = _build_chunk_record(key, *chunks[key])
+        record["embedding_key"] = record.pop("_id")
+        operations.append(InsertOne({**record, "doc_id": doc_id, "tenant": tenant, "version": version, "embedding": vectors[key]}))
+    for key, stored_position in stored_positions.items():
+        # El texto no ha cambiado, pero puede haberse desplazado dentro del documento
+        if key in chunks and stored_position != (chunks[key][0], chunks[key][2]):
+            operations.append(UpdateOne({**document_filter, "embedding_key": key}, {"$set": {"chunk_id": chunks[key][0], "location": chunks[key][2]}}))
+    # Eliminar los fragmentos que ya no forman parte del documento y anotar la versión en el resto
+    operations.append(DeleteMany({**document_filter, "embedding_key": {"$nin": list(chunks)}}))
+    operations.append(UpdateMany({**document_filter, "version": {"$ne": version}}, {"$set": {"version": version}}))
+
+    with span("mongo_write", operation="document_chunks", doc_id=doc_id):
+        result = collection.bulk_write(operations, ordered=False)
+    return len(new_keys), result.deleted_count
+
+def _store_chunks_local(chunks: dict, collection_name: str) -> tuple:
+    """
+    Reescribe el índice local del documento reutilizando los vectores ya calculados.
+    Devuelve (embeddings_nuevos, fragmentos_eliminados).
+    """
+    from .local_vector_index import load_local_index, save_local_index
+    stored_vectors = load_local_index(collection_name).get_stored_vectors()
+    new_keys = [key for key in chunks if key not in stored_vectors]
+    with span("embedding", doc_id=collection_name, chunks=len(new_keys)):
+        new_vectors = dict(zip(new_keys, get_embeddings().embed_documents([chunks[key][1] for key in new_keys]) if new_keys else []))
+
+    records = [_build_chunk_record(key, *chunks[key]) for key in chunks]
+    vectors = [new_vectors[key] if key in new_vectors else stored_vectors[key] for key in chunks]
+    save_local_index(collection_name, records, vectors)
+    return len(new_keys), len(set(stored_vectors) - set(chunks))
+
+def get_document_version(collection_name: str, tenant: str | None = None) -> str | None:
+    """
+    Versión del documento indexado (None si no está indexado). Con Atlas es la guardada con sus
+    fragmentos; con el backend local, un hash de las claves de sus fragmentos.
+    """
+    if get_vector_backend() == 'local':
+        from .local_vector_index import load_local_index
+        records = load_local_index(collection_name).records
+        if not records:
+            return None
+        return hashlib.sha256("\x00".join(record["_id"] for record in records).encode("utf-8")).hexdigest()
+    chunk = get_chunks_collection().find_one(_get_document_filter(collection_name, tenant), {"_id": 0, "version": 1})
+    return chunk.get("version") if chunk else None
+
+def get_document_vectors(collection_name: str, tenant: str | None = None) -> list:
+    """Devuelve los embeddings ya guardados de todos los fragmentos del documento."""
+    if get_vector_backend() == 'local':
+        from .local_vector_index import load_local_index
+        return list(load_local_index(collection_name).vectors)
+    return [doc["embedding"] for doc in get_chunks_collection().find(_get_document_filter(collection_name, tenant), {"_id": 0, "embedding": 1})]
+
+# --- Almacén de Atlas Vector Search y retrievers por documento, reutilizados entre peticiones ---
+_atlas_vector_store = None
+_retriever_pool = None
+
+def _get_atlas_vector_store():
+    """Envoltorio de LangChain sobre la colección compartida; el documento se elige con el prefiltro."""
+    global _atlas_vector_store
+    if _atlas_vector_store is None:
+        from langchain_community.vectorstores import MongoDBAtlasVectorSearch
+        _atlas_vector_store = MongoDBAtlasVectorSearch(get_chunks_collection(), get_query_embeddings(), index_name=VECTOR_SEARCH_INDEX_NAME)
+    return _atlas_vector_store
+
+def _create_retriever(collection_name: str, tenant: str):
+    if get_vector_backend() == 'local':
+        from .local_vector_index import LocalVectorRetriever
+        return LocalVectorRetriever(collection_name=collection_name, embeddings=get_query_embeddings(), k=5)
+    return _get_atlas_vector_store().as_retriever(search_type="similarity", search_kwargs={"k": 5, "pre_filter": _get_document_filter(collection_name, tenant)})
+
+def get_vector_store_retriever(collection_name: str, version: str | None = None):
+    """
+    Obtiene un retriever para hacer búsquedas de similitud en la base de datos vectorial.
+    Los retrievers se reutilizan entre peticiones (LRU de RAG_POOL_SIZE documentos); son
+    seguros de compartir porque no guardan estado de cada búsqueda. La clave incluye la
+    versión del documento, si se conoce, para que al re-indexarlo no se reutilice el anterior.
+    """
+    global _retriever_pool
+    if _retriever_pool is None:
+        _retriever_pool = LRUCache("retrievers", _get_env_size('RAG_POOL_SIZE', DEFAULT_RAG_POOL_SIZE))
+    tenant = get_tenant()
+    return _retriever_pool.get_or_create(get_retriever_pool_key(collection_name, tenant, version), lambda: _create_retriever(collection_name, tenant))
+
+def get_retriever_pool_key(collection_name: str, tenant: str, version: str | None = None) -> tuple:
+    """Clave de un documento en los pools de retrievers y cadenas RAG: backend, tenant, documento y versión."""
+    return (get_vector_backend(), tenant, collection_name, version)
+
+def retrieve_relevant_chunks(collection_name: str, query: str, k: int = 5) -> list:
+    """
+    Devuelve los `k` fragmentos del documento más similares a la consulta,
+    ordenados por relevancia, como diccionarios con 'chunk_id', 'location' y 'text'.
+    """
+    with span("retrieval", doc_id=collection_name):
+        if get_vector_backend() == 'local':
+            from .local_vector_index import search_local_index
+            documents = search_local_index(collection_name, get_query_embeddings().embed_query(query), k)
+        else:
+            # El prefiltro se aplica dentro de la búsqueda vectorial, antes de elegir los k vecinos
+            documents = _get_atlas_vector_store().similarity_search(query, k=k, pre_filter=_get_document_filter(collection_name))
+    return [{"chunk_id": doc.metadata.get("chunk_id"), "location": doc.metadata.get("location"), "text": doc.page_content} for doc in documents]
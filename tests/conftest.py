@@ -0,0 +1,74 @@
+import os
+import sys
+import pytest
+
+# Mismo entorno que el benchmark (benchmarks/run_benchmark.py): MongoDB en memoria con mongomock,
+# LLM simulado y embeddings deterministas, sin red ni credenciales.
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (project_root, os.path.join(project_root, "benchmarks"), os.path.join(project_root, "scripts")):
+    if path not in sys.path:
+        sys.path.append(path)
+os.environ.setdefault("MONGO_URI", "mongodb://tests.invalid")
+
+@pytest.fixture
+def fake_services(monkeypatch, tmp_path):
+    """
+    Sustituye MongoDB, el LLM y los embeddings por sus versiones locales, con el catálogo de
+    controles ya cargado y el backend vectorial 'local' en un directorio temporal.
+    Devuelve el LLM simulado, cuyas `stats` cuentan las llamadas.
+    """
+    import mongomock
+    from fakes import DeterministicEmbeddings, FakeChatModel
+    from seed_database import ALL_ISO_27001_CONTROLS
+    from services import ai_analyzer, analysis_cache, chat_cache, control_catalog, control_triage, local_vector_index, metrics, vector_store_manager
+
+    monkeypatch.setenv("VECTOR_BACKEND", "local")
+    monkeypatch.setenv("VECTOR_INDEX_DIR", str(tmp_path / "vector_indexes"))
+    monkeypatch.setenv("ANALYSIS_TRACES_ENABLED", "false")
+
+    monkeypatch.setattr(vector_store_manager, "_mongo_client", mongomock.MongoClient())
+    monkeypatch.setattr(vector_store_manager, "_embeddings", DeterministicEmbeddings())
+    # Cachés y pools de cada proceso: se vacían para que ninguna prueba vea datos de otra
+    for module, name, value in (
+        (vector_store_manager, "_query_embeddings", None),
+        (vector_store_manager, "_retriever_pool", None),
+        (vector_store_manager, "_chunk_indexes_ready", False),
+        (ai_analyzer, "_rag_chains", None),
+        (analysis_cache, "_indexes_ready", False),
+        (chat_cache, "_indexes_ready", False),
+        (metrics, "_trace_indexes_ready", False),
+        (control_catalog, "_catalogs", {}),
+        (control_triage, "_control_matrices", {}),
+        (local_vector_index, "_loaded_indexes", {}),
+    ):
+        monkeypatch.setattr(module, name, value)
+
+    llm = FakeChatModel(latency_ms=0, tokens_per_second=1e9, justification_tokens=5)
+    monkeypatch.setattr(ai_analyzer, "_llm_instance", llm)
+
+    vector_store_manager.get_mongo_collection(control_catalog.DEFAULT_CATALOG).insert_many([dict(control) for control in ALL_ISO_27001_CONTROLS])
+    control_catalog.bump_catalog_version()
+    return llm
+
+class InlineExecutor:
+    """Ejecuta los trabajos de análisis en el mismo hilo, para comprobar su estado al terminar."""
+
+    def submit(self, function, *args):
+        function(*args)
+
+@pytest.fixture
+def policy_docx(tmp_path):
+    """Ruta de un .docx de prueba con una política breve."""
+    from docx import Document
+    document = Document()
+    document.add_paragraph("Política de control de acceso y de uso de criptografía.")
+    path = tmp_path / "politica.docx"
+    document.save(path)
+    return path
+
+@pytest.fixture
+def inline_jobs(fake_services, monkeypatch, policy_docx):
+    """Los trabajos de análisis se ejecutan al crearse. Devuelve la ruta del .docx de prueba."""
+    from services import analysis_jobs
+    monkeypatch.setattr(analysis_jobs, "_get_job_executor", InlineExecutor)
+    return policy_docx
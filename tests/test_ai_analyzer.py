@@ -0,0 +1,82 @@
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+CONTROL_IDS = ["A.5.1", "A.5.15", "A.8.24"]
+
+@pytest.fixture
+def policy_text(fake_services):
+    from services.ai_analyzer import get_iso_controls_from_db
+    descriptions = {control["id"]: control["description"] for control in get_iso_controls_from_db()}
+    return "\n\n".join(descriptions[control_id] for control_id in CONTROL_IDS[:2])
+
+def _analyze(text: str, **kwargs) -> dict:
+    from services.ai_analyzer import analyze_document_coverage
+    options = {"context_mode": "full", "incremental": False, "triage": False, **kwargs}
+    results = analyze_document_coverage(text, CONTROL_IDS, **options)
+    return {result.get("id"): result for result in results}
+
+def test_llm_initialization_error_is_returned(policy_text, monkeypatch):
+    from services import ai_analyzer
+
+    def failing_get_llm():
+        raise google_exceptions.PermissionDenied("Vertex AI API has not been used in project")
+
+    monkeypatch.setattr(ai_analyzer, "get_llm", failing_get_llm)
+    results = _analyze(policy_text)
+    assert list(results) == [None]
+    assert "Vertex AI" in results[None]["error"]
+
+def test_cached_reanalysis_does_not_touch_the_llm(policy_text, fake_services, monkeypatch):
+    from services import ai_analyzer
+
+    get_llm_calls = []
+    get_llm = ai_analyzer.get_llm
+    monkeypatch.setattr(ai_analyzer, "get_llm", lambda: get_llm_calls.append(1) or get_llm())
+    first = _analyze(policy_text)
+    assert fake_services.stats.calls > 0 and get_llm_calls
+
+    fake_services.stats.reset()
+    get_llm_calls.clear()
+    second = _analyze(policy_text)
+    assert fake_services.stats.calls == 0
+    assert get_llm_calls == []
+    assert {control_id: result["status"] for control_id, result in second.items()} == {control_id: result["status"] for control_id, result in first.items()}
+
+def test_batch_response_keeps_only_valid_requested_items():
+    from services.ai_analyzer import _parse_batch_response
+
+    response = {"results": [
+        {"control_id": "A.5.1", "status": "Covered", "justification": "Sí."},
+        {"control_id": "A.5.1", "status": "Not Covered", "justification": "Duplicado."},
+        {"control_id": "A.5.2", "justification": "Sin estado."},
+        {"control_id": "A.9.9", "status": "Covered", "justification": "No se pidió."},
+    ]}
+    assert _parse_batch_response(response, {"A.5.1", "A.5.2"}) == {"A.5.1": {"status": "Covered", "justification": "Sí."}}
+    assert _parse_batch_response(["no es un objeto"], {"A.5.1"}) == {}
+
+def test_controls_missing_from_a_batch_are_analyzed_individually(fake_services, monkeypatch):
+    import json
+    from fakes import FakeChatModel
+    from services.ai_analyzer import analyze_document_coverage, get_iso_controls_from_db
+
+    batch_ids = ["A.5.1", "A.5.2", "A.5.3"]
+    descriptions = {control["id"]: control["description"] for control in get_iso_controls_from_db()}
+    respond = FakeChatModel._respond
+
+    def incomplete_batch_respond(self, prompt: str) -> str:
+        text = respond(self, prompt)
+        if "CONTROLES A ANALIZAR" not in prompt:
+            return text
+        # El modelo omite un control y devuelve otro sin estado
+        results = [item for item in json.loads(text)["results"] if item["control_id"] != "A.5.2"]
+        for item in results:
+            if item["control_id"] == "A.5.3":
+                del item["status"]
+        return json.dumps({"results": results}, ensure_ascii=False)
+
+    monkeypatch.setattr(FakeChatModel, "_respond", incomplete_batch_respond)
+    monkeypatch.setenv("ANALYSIS_CACHE_ENABLED", "false")
+    results = analyze_document_coverage(descriptions["A.5.2"], batch_ids, batch_size=3, context_mode="full", incremental=False, triage=False)
+    statuses = {result["id"]: result["status"] for result in results if result["id"] in batch_ids}
+    assert statuses == {"A.5.1": "Not Covered", "A.5.2": "Covered", "A.5.3": "Not Covered"}
+    assert fake_services.stats.calls == 3
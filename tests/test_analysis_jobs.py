@@ -0,0 +1,65 @@
+import pytest
+
+APPLICABLE_IDS = ["A.5.1", "A.5.15", "A.8.24"]
+
+@pytest.fixture
+def completed_job(inline_jobs, monkeypatch):
+    """Trabajo terminado en el que uno de los controles aplicables quedó en estado 'Error'."""
+    from services.analysis_jobs import ANALYSIS_JOBS_COLLECTION, create_analysis_job
+    from services.ai_analyzer import CONTROL_ERROR_STATUS
+    from services.vector_store_manager import get_mongo_collection
+
+    monkeypatch.setenv("ANALYSIS_CACHE_ENABLED", "false")
+    job_id = create_analysis_job("politica.docx", str(inline_jobs), "politica", APPLICABLE_IDS)
+    get_mongo_collection(ANALYSIS_JOBS_COLLECTION).update_one(
+        {"_id": job_id, "results.id": APPLICABLE_IDS[0]},
+        {"$set": {"results.$.status": CONTROL_ERROR_STATUS, "failed_controls": 1}},
+    )
+    return job_id
+
+def test_resume_only_reports_missing_controls(completed_job, fake_services):
+    from services.analysis_jobs import JOB_COMPLETED, get_analysis_job, resume_analysis_job
+
+    fake_services.stats.reset()
+    assert resume_analysis_job(completed_job)
+
+    job = get_analysis_job(completed_job)
+    ids = [result["id"] for result in job["results"]]
+    assert job["status"] == JOB_COMPLETED
+    assert job["completed"] == job["total"] == len(ids)
+    assert len(ids) == len(set(ids))
+    assert job["failed_controls"] == 0
+    assert fake_services.stats.calls == 1
+
+def test_finished_job_without_errors_is_not_resumed(completed_job):
+    from services.analysis_jobs import resume_analysis_job
+
+    assert resume_analysis_job(completed_job)
+    assert not resume_analysis_job(completed_job)
+
+def test_reloading_the_page_reuses_the_job(inline_jobs):
+    from docx import Document
+    from services.analysis_jobs import get_or_create_analysis_job
+
+    job_id = get_or_create_analysis_job("politica.docx", str(inline_jobs), "politica", APPLICABLE_IDS)
+    assert get_or_create_analysis_job("politica.docx", str(inline_jobs), "politica", APPLICABLE_IDS[::-1]) == job_id
+    # ?refresh=1, otros controles aplicables o un fichero modificado crean un trabajo nuevo
+    assert get_or_create_analysis_job("politica.docx", str(inline_jobs), "politica", APPLICABLE_IDS, use_cache=False) != job_id
+    assert get_or_create_analysis_job("politica.docx", str(inline_jobs), "politica", APPLICABLE_IDS[:1]) != job_id
+    document = Document(inline_jobs)
+    document.add_paragraph("Nuevo apartado sobre copias de seguridad.")
+    document.save(inline_jobs)
+    assert get_or_create_analysis_job("politica.docx", str(inline_jobs), "politica", APPLICABLE_IDS) != job_id
+
+def test_failed_and_interrupted_jobs_are_not_reused(inline_jobs):
+    from datetime import datetime, timedelta, timezone
+    from services.analysis_jobs import ANALYSIS_JOBS_COLLECTION, JOB_FAILED, JOB_RUNNING, get_or_create_analysis_job
+    from services.vector_store_manager import get_mongo_collection
+
+    jobs = get_mongo_collection(ANALYSIS_JOBS_COLLECTION)
+    job_id = get_or_create_analysis_job("politica.docx", str(inline_jobs), "politica", APPLICABLE_IDS)
+    jobs.update_one({"_id": job_id}, {"$set": {"status": JOB_FAILED}})
+    second = get_or_create_analysis_job("politica.docx", str(inline_jobs), "politica", APPLICABLE_IDS)
+    assert second != job_id
+    jobs.update_one({"_id": second}, {"$set": {"status": JOB_RUNNING, "updated_at": datetime.now(timezone.utc) - timedelta(days=1)}})
+    assert get_or_create_analysis_job("politica.docx", str(inline_jobs), "politica", APPLICABLE_IDS) not in (job_id, second)
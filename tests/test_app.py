@@ -0,0 +1,56 @@
+import importlib
+import re
+import pytest
+
+@pytest.fixture
+def client(inline_jobs, monkeypatch, tmp_path):
+    """Cliente de pruebas de Flask, con credenciales ficticias y las subidas en un directorio temporal."""
+    credentials = tmp_path / "credentials.json"
+    credentials.write_text("{}")
+    monkeypatch.setenv("GOOGLE_APPLICATION_CREDENTIALS", str(credentials))
+    monkeypatch.setenv("GOOGLE_CLOUD_PROJECT", "proyecto-de-pruebas")
+    monkeypatch.chdir(tmp_path)
+    app = importlib.import_module("app")
+    uploads = tmp_path / "uploads"
+    uploads.mkdir(exist_ok=True)
+    monkeypatch.setitem(app.app.config, "UPLOAD_FOLDER", str(uploads))
+    return app.app.test_client()
+
+@pytest.fixture
+def job_id(inline_jobs):
+    from services.analysis_jobs import create_analysis_job
+    return create_analysis_job("politica.docx", str(inline_jobs), "politica", [])
+
+def _events(response) -> list:
+    """(id, tipo) de cada evento SSE de la respuesta."""
+    return re.findall(r"(?:id: (\S+)\n)?event: (\w+)\n", response.get_data(as_text=True))
+
+def test_events_carry_their_position(client, job_id):
+    events = _events(client.get(f"/analysis/jobs/{job_id}/events"))
+    results = [event_id for event_id, event in events if event == "result"]
+    assert results[0].split(":")[0] == "1"
+    assert [int(event_id.split(":")[0]) for event_id in results] == list(range(1, len(results) + 1))
+    assert events[-1][1] == "done" and events[-1][0] == events[-2][0]
+
+def test_reconnection_resumes_after_the_last_event(client, job_id):
+    first = _events(client.get(f"/analysis/jobs/{job_id}/events"))
+    total_results = sum(1 for _, event in first if event == "result")
+    last_event_id = next(event_id for event_id, event in first if event == "result" and event_id.startswith("10:"))
+
+    resumed = _events(client.get(f"/analysis/jobs/{job_id}/events", headers={"Last-Event-ID": last_event_id}))
+    assert sum(1 for _, event in resumed if event == "result") == total_results - 10
+    assert not any(event == "message" for _, event in resumed)
+    assert next(event_id for event_id, event in resumed if event == "result").startswith("11:")
+
+def test_since_skips_results_already_received(client, job_id):
+    first = _events(client.get(f"/analysis/jobs/{job_id}/events"))
+    total_results = sum(1 for _, event in first if event == "result")
+    resumed = _events(client.get(f"/analysis/jobs/{job_id}/events?since={total_results - 2}"))
+    assert sum(1 for _, event in resumed if event == "result") == 2
+
+def test_creating_a_job_twice_reuses_it(client, inline_jobs):
+    import shutil
+    shutil.copy(inline_jobs, client.application.config["UPLOAD_FOLDER"])
+    first = client.post("/analysis/politica.docx/jobs").get_json()
+    assert client.post("/analysis/politica.docx/jobs").get_json()["job_id"] == first["job_id"]
+    assert client.post("/analysis/politica.docx/jobs?refresh=1").get_json()["job_id"] != first["job_id"]
@@ -0,0 +1,62 @@
+import asyncio
+import importlib
+import pytest
+
+pytest.importorskip("starlette")
+pytest.importorskip("a2wsgi")
+
+@pytest.fixture
+def asgi(fake_services, monkeypatch, tmp_path):
+    """Módulo asgi.py con credenciales ficticias y semáforos nuevos en cada prueba."""
+    credentials = tmp_path / "credentials.json"
+    credentials.write_text("{}")
+    monkeypatch.setenv("GOOGLE_APPLICATION_CREDENTIALS", str(credentials))
+    monkeypatch.setenv("GOOGLE_CLOUD_PROJECT", "proyecto-de-pruebas")
+    monkeypatch.chdir(tmp_path)
+    module = importlib.import_module("asgi")
+    monkeypatch.setattr(module.LimitedEndpoint, "_semaphores", {})
+    monkeypatch.setattr(module.LimitedEndpoint, "_in_flight", {})
+    return module
+
+async def _call(endpoint) -> list:
+    """Llama al endpoint con una petición GET mínima y devuelve los mensajes ASGI enviados."""
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": [], "query_string": b""}
+    await endpoint(scope, receive, send)
+    return sent
+
+def test_request_is_rejected_with_503_when_no_slot_frees_in_time(asgi, monkeypatch):
+    from starlette.responses import JSONResponse
+
+    monkeypatch.setenv("ASGI_CHAT_CONCURRENCY", "1")
+    monkeypatch.setenv("ASGI_QUEUE_TIMEOUT_SECONDS", "1")
+    release = asyncio.Event()
+
+    async def handler(request):
+        await release.wait()
+        return JSONResponse({"ok": True})
+
+    endpoint = asgi.LimitedEndpoint("chat", handler)
+
+    async def main():
+        first = asyncio.create_task(_call(endpoint))
+        await asyncio.sleep(0)
+        rejected = await _call(endpoint)
+        assert asgi.LimitedEndpoint._in_flight["chat"] == 1
+        release.set()
+        return await first, rejected, await _call(endpoint)
+
+    first, rejected, after = asyncio.run(main())
+    assert first[0]["status"] == 200
+    assert rejected[0]["status"] == 503
+    assert (b"retry-after", b"5") in rejected[0]["headers"]
+    # El hueco se libera al terminar la respuesta
+    assert after[0]["status"] == 200
+    assert asgi.LimitedEndpoint._in_flight["chat"] == 0
@@ -0,0 +1,21 @@
+import csv
+import shutil
+import sys
+
+def test_duplicates_appear_in_the_matrix_with_the_original_results(fake_services, policy_docx, monkeypatch, tmp_path):
+    import batch_audit
+
+    policies = tmp_path / "policies"
+    policies.mkdir()
+    shutil.copy(policy_docx, policies / "acceso.docx")
+    shutil.copy(policy_docx, policies / "acceso_copia.docx")
+    output = tmp_path / "auditoria.jsonl"
+    monkeypatch.setattr(sys, "argv", ["batch_audit.py", str(policies), "--output", str(output), "--controls", "A.5.1,A.5.15"])
+    batch_audit.main()
+
+    with open(tmp_path / "auditoria_matrix.csv", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["control_id", "description", "acceso.docx", "acceso_copia.docx (idéntico a acceso.docx)", "best_coverage"]
+    for row in rows[1:]:
+        assert row[2] and row[3] == row[2]
+    assert '"type": "duplicate"' in output.read_text(encoding="utf-8")
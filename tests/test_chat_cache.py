@@ -0,0 +1,62 @@
+import pytest
+
+QUESTION = "¿Con qué frecuencia se revisan los privilegios de acceso?"
+
+@pytest.fixture
+def policy(fake_services):
+    """Indexa (o re-indexa) el documento 'politica' con el texto indicado."""
+    from services.vector_store_manager import create_vector_store
+
+    def index(text: str):
+        create_vector_store(text, "politica")
+
+    index("Los privilegios de acceso se revisan cada seis meses.")
+    return index
+
+def test_repeated_question_is_answered_from_cache(policy, fake_services):
+    from services.ai_analyzer import answer_question_with_rag
+
+    first = answer_question_with_rag(QUESTION, "politica")
+    assert fake_services.stats.calls == 1
+    assert answer_question_with_rag(QUESTION, "politica") == first
+    assert fake_services.stats.calls == 1
+
+def test_reindexed_document_invalidates_cached_answers(policy, fake_services):
+    from services.ai_analyzer import answer_question_with_rag
+
+    answer_question_with_rag(QUESTION, "politica")
+    policy("Los privilegios de acceso se revisan cada tres meses.")
+    answer_question_with_rag(QUESTION, "politica")
+    assert fake_services.stats.calls == 2
+
+def test_cached_answers_are_scoped_by_model(policy):
+    from services.chat_cache import find_cached_answer, get_chat_cache_scope, store_answer
+
+    store_answer(get_chat_cache_scope("politica", QUESTION, "modelo-a"), QUESTION, "Cada seis meses.")
+    assert find_cached_answer(get_chat_cache_scope("politica", QUESTION, "modelo-a")) == "Cada seis meses."
+    assert find_cached_answer(get_chat_cache_scope("politica", QUESTION, "modelo-b")) is None
+
+def test_entries_expire_and_are_evicted(policy, monkeypatch):
+    from services.chat_cache import _get_chat_cache_collection, get_chat_cache_scope, store_answer
+
+    monkeypatch.setenv("CHAT_CACHE_TTL_SECONDS", "3600")
+    monkeypatch.setenv("CHAT_CACHE_MAX_ENTRIES", "2")
+    for number in range(3):
+        question = f"Pregunta número {number}"
+        store_answer(get_chat_cache_scope("politica", question, "modelo-a"), question, f"Respuesta {number}")
+
+    collection = _get_chat_cache_collection()
+    assert collection.index_information()["created_at_ttl"]["expireAfterSeconds"] == 3600
+    assert sorted(entry["question"] for entry in collection.find()) == ["Pregunta número 1", "Pregunta número 2"]
+
+def test_rag_chain_is_rebuilt_for_a_new_document_version(policy, monkeypatch):
+    from services import ai_analyzer
+    from services.ai_analyzer import answer_question_with_rag
+
+    monkeypatch.setenv("CHAT_CACHE_THRESHOLD", "1.1")
+    answer_question_with_rag(QUESTION, "politica")
+    answer_question_with_rag("¿Quién aprueba la política?", "politica")
+    assert len(ai_analyzer._rag_chains) == 1
+    policy("Los privilegios de acceso se revisan cada tres meses.")
+    answer_question_with_rag(QUESTION, "politica")
+    assert len(ai_analyzer._rag_chains) == 2
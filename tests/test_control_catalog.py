@@ -0,0 +1,56 @@
+def test_catalog_indexes_controls_by_id_and_theme(fake_services):
+    from seed_database import ALL_ISO_27001_CONTROLS
+    from services.control_catalog import get_control_catalog
+
+    catalog = get_control_catalog()
+    assert catalog.by_id["A.8.24"]["description"] == next(control["description"] for control in ALL_ISO_27001_CONTROLS if control["id"] == "A.8.24")
+    assert list(catalog.by_theme) == ["A.5", "A.6", "A.7", "A.8"]
+    assert sum(len(controls) for controls in catalog.by_theme.values()) == len(ALL_ISO_27001_CONTROLS)
+    assert all(control["id"].startswith("A.6.") for control in catalog.by_theme["A.6"])
+
+def test_catalog_is_reloaded_when_its_version_changes(fake_services, monkeypatch):
+    from services.control_catalog import DEFAULT_CATALOG, bump_catalog_version, get_control_catalog
+    from services.vector_store_manager import get_mongo_collection
+
+    monkeypatch.setenv("CONTROL_CATALOG_CHECK_SECONDS", "0")
+    get_control_catalog()
+    get_mongo_collection(DEFAULT_CATALOG).update_one({"id": "A.5.1"}, {"$set": {"description": "Descripción revisada."}})
+    bump_catalog_version()
+    assert get_control_catalog().by_id["A.5.1"]["description"] == "Descripción revisada."
+
+def test_batches_do_not_mix_themes(fake_services):
+    from services.ai_analyzer import _group_controls
+    from services.control_catalog import get_control_catalog
+
+    catalog = get_control_catalog()
+    controls = catalog.by_theme["A.5"][:5] + catalog.by_theme["A.8"][:2]
+    groups = _group_controls(controls[::-1], 3)
+    assert [[control["id"] for control in group] for group in groups] == [
+        [control["id"] for control in controls[:3]],
+        [control["id"] for control in controls[3:5]],
+        [control["id"] for control in controls[5:]],
+    ]
+
+def test_triage_reuses_the_catalog_embeddings(fake_services, monkeypatch):
+    from services import vector_store_manager
+    from services.control_catalog import get_control_catalog
+    from services.control_triage import get_control_matrix
+
+    embedded = []
+    embeddings = vector_store_manager._embeddings
+    monkeypatch.setattr(embeddings, "embed_documents", lambda texts: embedded.append(len(texts)) or type(embeddings).embed_documents(embeddings, texts))
+    catalog = get_control_catalog()
+    first = get_control_matrix(catalog.by_theme["A.5"])
+    second = get_control_matrix(catalog.by_theme["A.8"][:3])
+    assert embedded == [len(catalog.controls)]
+    assert first.shape[0] == len(catalog.by_theme["A.5"]) and second.shape[0] == 3
+
+def test_library_lookup_uses_the_catalog_description(fake_services):
+    from services.ai_analyzer import LIBRARY_PROMPT_VERSION, generate_policy_draft, get_llm_model_name
+    from services.control_catalog import get_control_catalog
+    from services.control_library import LIBRARY_POLICY_DRAFT, store_library_entry
+
+    description = get_control_catalog().by_id["A.5.1"]["description"]
+    store_library_entry(LIBRARY_POLICY_DRAFT, "A.5.1", description, "Borrador guardado.", get_llm_model_name(), LIBRARY_PROMPT_VERSION)
+    assert generate_policy_draft("A.5.1", description + "  ") == "Borrador guardado."
+    assert fake_services.stats.calls == 0
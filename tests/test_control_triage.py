@@ -0,0 +1,71 @@
+import argparse
+import pytest
+
+COVERED_IDS = ["A.5.1", "A.5.15", "A.8.24"]
+
+@pytest.fixture
+def indexed_policy(fake_services):
+    """Documento indexado que trata (con su descripción literal) los controles de COVERED_IDS."""
+    from services.ai_analyzer import get_iso_controls_from_db
+    from services.vector_store_manager import create_vector_store
+
+    controls = get_iso_controls_from_db()
+    descriptions = {control["id"]: control["description"] for control in controls}
+    text = "\n\n".join(descriptions[control_id] for control_id in COVERED_IDS)
+    create_vector_store(text, "politica")
+    return text, controls
+
+def test_threshold_precedence(fake_services, monkeypatch):
+    from services.control_triage import DEFAULT_TRIAGE_THRESHOLD, get_triage_threshold, save_triage_calibration
+
+    monkeypatch.delenv("ANALYSIS_TRIAGE_THRESHOLD", raising=False)
+    assert get_triage_threshold() == DEFAULT_TRIAGE_THRESHOLD
+    save_triage_calibration(0.4, {"recall": 1.0})
+    assert get_triage_threshold() == 0.4
+    monkeypatch.setenv("ANALYSIS_TRIAGE_THRESHOLD", "0.1")
+    assert get_triage_threshold() == 0.1
+
+def test_triage_keeps_controls_above_threshold(indexed_policy, monkeypatch):
+    from services.control_triage import compute_control_scores, triage_controls
+
+    text, controls = indexed_policy
+    scores = dict(zip((control["id"] for control in controls), compute_control_scores(controls, text, "politica").tolist()))
+    lowest_covered = min(scores[control_id] for control_id in COVERED_IDS)
+    monkeypatch.setenv("ANALYSIS_TRIAGE_THRESHOLD", str(lowest_covered - 1e-4))
+
+    plausible, triaged = triage_controls(controls, text, "politica")
+    assert set(COVERED_IDS) <= {control["id"] for control in plausible}
+    assert triaged and len(plausible) + len(triaged) == len(controls)
+    for result in triaged:
+        assert result["status"] == "Not Covered"
+        assert result["triaged"] is True
+        assert result["triage_score"] < lowest_covered
+
+def test_calibration_threshold_stays_within_positive_scores(indexed_policy):
+    from calibrate_triage import THRESHOLD_MARGIN, calibrate
+    from services.control_triage import compute_control_scores
+
+    _, controls = indexed_policy
+    labels = {"politica": {control["id"]: {"status": "Covered" if control["id"] in COVERED_IDS else "Not Covered"} for control in controls}}
+    scores = dict(zip((control["id"] for control in controls), compute_control_scores(controls, "", "politica").tolist()))
+    positive_scores = [scores[control_id] for control_id in COVERED_IDS]
+
+    full_recall = calibrate(labels, controls, 1.0)
+    assert full_recall["recall"] == 1.0
+    assert full_recall["positives"] == len(COVERED_IDS)
+    assert full_recall["threshold"] == round(max(0.0, min(positive_scores) - THRESHOLD_MARGIN), 4)
+
+    # Con recall=0 el índice caería fuera de la lista de positivos; se acota al positivo más alto
+    no_recall = calibrate(labels, controls, 0.0)
+    assert no_recall["threshold"] == round(max(0.0, max(positive_scores) - THRESHOLD_MARGIN), 4)
+    assert no_recall["recall"] > 0
+
+@pytest.mark.parametrize("value", ["0", "-0.5", "1.5", "abc"])
+def test_recall_argument_must_be_in_unit_interval(value):
+    from calibrate_triage import _parse_recall
+    with pytest.raises(argparse.ArgumentTypeError):
+        _parse_recall(value)
+
+def test_recall_argument_accepts_full_recall():
+    from calibrate_triage import _parse_recall
+    assert _parse_recall("1") == 1.0
@@ -0,0 +1,55 @@
+import pytest
+from docx import Document
+
+@pytest.fixture
+def extractions(monkeypatch):
+    """Cuenta las extracciones reales (las que no se sirven desde la caché)."""
+    from services import document_processor
+    calls = []
+    extract_document = document_processor.extract_document
+
+    def counting_extract_document(file_path: str) -> dict:
+        calls.append(file_path)
+        return extract_document(file_path)
+
+    monkeypatch.setattr(document_processor, "extract_document", counting_extract_document)
+    return calls
+
+def _write_docx(path, paragraphs: list):
+    document = Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    document.save(path)
+
+def test_unchanged_file_is_served_from_cache(tmp_path, extractions):
+    from services.document_processor import load_document
+    path = tmp_path / "politica.docx"
+    _write_docx(path, ["Política de control de acceso.", "Revisión anual de privilegios."])
+
+    first = load_document(str(path))
+    second = load_document(str(path))
+    assert len(extractions) == 1
+    assert second == first
+    assert "Revisión anual de privilegios." in second["text"]
+
+def test_modified_file_is_extracted_again(tmp_path, extractions):
+    from services.document_processor import load_document
+    path = tmp_path / "politica.docx"
+    _write_docx(path, ["Política de control de acceso."])
+    first = load_document(str(path))
+
+    _write_docx(path, ["Política de control de acceso.", "Nuevo apartado sobre cifrado."])
+    second = load_document(str(path))
+    assert len(extractions) == 2
+    assert second["file_hash"] != first["file_hash"]
+    assert "Nuevo apartado sobre cifrado." in second["text"]
+
+def test_cache_can_be_disabled(tmp_path, extractions, monkeypatch):
+    from services.document_processor import load_document
+    monkeypatch.setenv("EXTRACTION_CACHE_ENABLED", "false")
+    path = tmp_path / "politica.docx"
+    _write_docx(path, ["Política de control de acceso."])
+
+    load_document(str(path))
+    load_document(str(path))
+    assert len(extractions) == 2
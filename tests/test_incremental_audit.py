@@ -0,0 +1,53 @@
+import pytest
+
+CONTROL_IDS = ["A.5.1", "A.5.15", "A.8.24"]
+FILLER = "El responsable del área revisa este apartado cada año y conserva los registros de la revisión. "
+
+def _paragraph(description: str) -> str:
+    # Cada párrafo ocupa un fragmento propio (más de la mitad del tamaño de fragmento)
+    return description + " " + FILLER * 7
+
+def _document(paragraphs: list) -> str:
+    return "\n\n".join(paragraphs)
+
+@pytest.fixture
+def audit(fake_services, monkeypatch):
+    """Analiza un documento con re-auditoría incremental (modo 'retrieval', un fragmento de evidencia por control)."""
+    from services.ai_analyzer import analyze_document_coverage, get_iso_controls_from_db
+    from services.vector_store_manager import create_vector_store
+
+    monkeypatch.setenv("ANALYSIS_CACHE_ENABLED", "false")
+    monkeypatch.setenv("ANALYSIS_EVIDENCE_TOP_K", "1")
+    descriptions = {control["id"]: control["description"] for control in get_iso_controls_from_db()}
+
+    def run(paragraphs: list) -> dict:
+        text = _document(paragraphs)
+        create_vector_store(text, "politica")
+        fake_services.stats.reset()
+        results = analyze_document_coverage(text, CONTROL_IDS, collection_name="politica", context_mode="retrieval", incremental=True, triage=False)
+        return {result["id"]: result for result in results if result["id"] in CONTROL_IDS}
+
+    run.descriptions = descriptions
+    return run
+
+def test_unchanged_document_carries_every_result_forward(audit, fake_services):
+    paragraphs = [_paragraph(audit.descriptions[control_id]) for control_id in CONTROL_IDS]
+    first = audit(paragraphs)
+    assert fake_services.stats.calls > 0
+    assert not any(result.get("carried_forward") for result in first.values())
+
+    second = audit(paragraphs)
+    assert fake_services.stats.calls == 0
+    assert all(result.get("carried_forward") for result in second.values())
+    assert {control_id: result["status"] for control_id, result in second.items()} == {control_id: result["status"] for control_id, result in first.items()}
+
+def test_changed_evidence_is_analyzed_again(audit, fake_services):
+    paragraphs = [_paragraph(audit.descriptions[control_id]) for control_id in CONTROL_IDS]
+    audit(paragraphs)
+
+    # Solo cambia el párrafo que sirve de evidencia al primer control
+    paragraphs[0] = _paragraph(audit.descriptions[CONTROL_IDS[0]]) + " Esta sección se actualizó en la última revisión."
+    results = audit(paragraphs)
+    assert fake_services.stats.calls > 0
+    assert not results[CONTROL_IDS[0]].get("carried_forward")
+    assert all(results[control_id].get("carried_forward") for control_id in CONTROL_IDS[1:])
@@ -0,0 +1,53 @@
+import os
+import numpy as np
+import pytest
+
+@pytest.fixture
+def index_dir(monkeypatch, tmp_path):
+    from services import local_vector_index
+    monkeypatch.setenv("VECTOR_INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(local_vector_index, "_loaded_indexes", {})
+    return tmp_path
+
+def _records(texts: list) -> list:
+    return [{"_id": f"id-{number}", "text": text} for number, text in enumerate(texts)]
+
+def test_search_returns_the_top_k_in_score_order(index_dir):
+    from services.local_vector_index import save_local_index, search_local_index
+
+    vectors = [[1, 0, 0], [0.6, 0.8, 0], [0, 1, 0], [0.8, 0.6, 0], [0, 0, 1]]
+    save_local_index("politica", _records(["a", "b", "c", "d", "e"]), vectors)
+    results = search_local_index("politica", [1, 0.1, 0], k=3)
+    assert [document.page_content for document in results] == ["a", "d", "b"]
+    scores = [document.metadata["score"] for document in results]
+    assert scores == sorted(scores, reverse=True)
+    assert len(search_local_index("politica", [1, 0, 0], k=10)) == 5
+
+def test_saving_switches_the_current_version_atomically(index_dir):
+    from services.local_vector_index import CURRENT_FILE, KEPT_VERSIONS, load_local_index, save_local_index
+
+    save_local_index("politica", _records(["primera"]), [[1, 0]])
+    first = load_local_index("politica")
+    for text in ("segunda", "tercera", "cuarta"):
+        save_local_index("politica", _records([text]), [[0, 1]])
+
+    # El índice ya abierto sigue siendo válido y el nuevo se lee completo
+    assert first.records[0]["text"] == "primera"
+    assert load_local_index("politica").records[0]["text"] == "cuarta"
+    current = (index_dir / "politica" / CURRENT_FILE).read_text()
+    versions = [entry.name for entry in os.scandir(index_dir / "politica") if entry.is_dir()]
+    assert current in versions and len(versions) == KEPT_VERSIONS
+    assert not (index_dir / "politica" / (CURRENT_FILE + ".tmp")).exists()
+
+def test_missing_index_is_empty(index_dir):
+    from services.local_vector_index import load_local_index, search_local_index
+
+    assert load_local_index("inexistente").records == []
+    assert search_local_index("inexistente", [1.0, 0.0], k=3) == []
+
+def test_vectors_are_normalized(index_dir):
+    from services.local_vector_index import load_local_index, save_local_index
+
+    save_local_index("politica", _records(["a", "b"]), [[3, 4], [0, 0]])
+    vectors = np.asarray(load_local_index("politica").vectors)
+    assert np.allclose(vectors[0], [0.6, 0.8]) and np.allclose(vectors[1], [0, 0])
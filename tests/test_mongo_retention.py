@@ -0,0 +1,31 @@
+from datetime import datetime, timedelta, timezone
+
+def _collection(name: str):
+    from services.vector_store_manager import get_mongo_collection
+    return get_mongo_collection(name)
+
+def test_oldest_entries_are_evicted(fake_services):
+    from services.mongo_retention import evict_oldest
+
+    collection = _collection("retention_test")
+    now = datetime.now(timezone.utc)
+    collection.insert_many([{"_id": number, "created_at": now + timedelta(seconds=number)} for number in (3, 1, 4, 2)])
+    evict_oldest(collection, 2)
+    assert sorted(entry["_id"] for entry in collection.find()) == [3, 4]
+    evict_oldest(collection, 5)
+    assert collection.count_documents({}) == 2
+
+def test_ttl_index_is_created(fake_services):
+    from services.mongo_retention import ensure_ttl_index
+
+    collection = _collection("retention_test")
+    ensure_ttl_index(collection, "started_at", 60)
+    assert collection.index_information()["started_at_ttl"]["expireAfterSeconds"] == 60
+
+def test_analysis_cache_is_capped(fake_services, monkeypatch):
+    from services.analysis_cache import _get_cache_collection, store_results
+
+    monkeypatch.setenv("ANALYSIS_CACHE_MAX_ENTRIES", "2")
+    for number in range(3):
+        store_results(f"documento-{number}", [{"id": "A.5.1", "status": "Covered", "justification": "-"}], "modelo", "1", "full")
+    assert sorted(entry["document_hash"] for entry in _get_cache_collection().find()) == ["documento-1", "documento-2"]
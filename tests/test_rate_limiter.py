@@ -0,0 +1,99 @@
+import asyncio
+import pytest
+from google.api_core import exceptions as google_exceptions
+from services.rate_limiter import AdaptiveConcurrencyLimiter, acall_with_retry, call_with_retry, stream_with_retry
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setenv("LLM_RETRY_BASE_SECONDS", "0")
+    monkeypatch.setenv("LLM_RETRY_MAX_ATTEMPTS", "3")
+
+def _failing(errors: list, result="respuesta"):
+    """Función que lanza los errores indicados, uno por llamada, y después devuelve `result`."""
+    calls = []
+
+    def func():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+        return result
+
+    func.calls = calls
+    return func
+
+def test_limit_halves_on_throttling_and_grows_additively():
+    limiter = AdaptiveConcurrencyLimiter(8)
+    limiter.release(limiter.acquire(), throttled=True)
+    assert limiter.limit == 4
+    for _ in range(4):
+        limiter.release(limiter.acquire(), throttled=False)
+    # Cada llamada correcta suma 1/límite: una ventana de 4 llamadas suma aproximadamente 1
+    assert 4.9 < limiter.limit < 5
+    limiter.release(limiter.acquire(), throttled=None)
+    assert 4.9 < limiter.limit < 5
+
+def test_simultaneous_throttling_counts_once():
+    limiter = AdaptiveConcurrencyLimiter(8)
+    epochs = [limiter.acquire() for _ in range(3)]
+    for epoch in epochs:
+        limiter.release(epoch, throttled=True)
+    assert limiter.limit == 4
+
+def test_limit_stays_within_bounds():
+    limiter = AdaptiveConcurrencyLimiter(2, min_limit=1)
+    for _ in range(3):
+        limiter.release(limiter.acquire(), throttled=True)
+    assert limiter.limit == 1
+    for _ in range(20):
+        limiter.release(limiter.acquire(), throttled=False)
+    assert limiter.limit == 2
+
+def test_transient_errors_are_retried_through_the_limiter():
+    limiter = AdaptiveConcurrencyLimiter(4)
+    func = _failing([google_exceptions.ResourceExhausted("429"), google_exceptions.InternalServerError("500")])
+    assert call_with_retry(func, limiter) == "respuesta"
+    assert len(func.calls) == 3
+    assert limiter.limit == 2 + 1 / 2
+
+def test_retries_are_exhausted_and_other_errors_are_not_retried():
+    func = _failing([google_exceptions.ServiceUnavailable("503")] * 3)
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        call_with_retry(func, AdaptiveConcurrencyLimiter(4))
+    assert len(func.calls) == 3
+
+    func = _failing([ValueError("respuesta no válida")])
+    with pytest.raises(ValueError):
+        call_with_retry(func, AdaptiveConcurrencyLimiter(4))
+    assert len(func.calls) == 1
+
+def test_stream_is_retried_only_before_the_first_chunk():
+    attempts = []
+
+    def stream(fail_after: int):
+        def func():
+            attempts.append(1)
+            for index, chunk in enumerate(["a", "b", "c"]):
+                if index == fail_after and len(attempts) == 1:
+                    raise google_exceptions.ServiceUnavailable("503")
+                yield chunk
+        return func
+
+    assert list(stream_with_retry(stream(0))) == ["a", "b", "c"]
+    assert len(attempts) == 2
+
+    attempts.clear()
+    received = []
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        for chunk in stream_with_retry(stream(1)):
+            received.append(chunk)
+    assert received == ["a"] and len(attempts) == 1
+
+def test_async_calls_are_retried():
+    errors = [google_exceptions.TooManyRequests("429")]
+
+    async def call():
+        if errors:
+            raise errors.pop(0)
+        return "respuesta"
+
+    assert asyncio.run(acall_with_retry(call)) == "respuesta"
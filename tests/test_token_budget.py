@@ -0,0 +1,60 @@
+import pytest
+from services.token_budget import PROMPT_OVERHEAD_TOKENS, get_context_cache_variant, merge_section_verdicts, plan_document_context
+
+class TokenCounter:
+    """Tokenizador simulado: una palabra por token, contando las llamadas."""
+    model_name = "modelo-de-prueba"
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_num_tokens(self, text: str) -> int:
+        self.calls += 1
+        return len(text.split())
+
+def _document(paragraphs: int) -> str:
+    return "\n\n".join(f"Párrafo {number} " + "palabra " * 99 for number in range(paragraphs))
+
+def test_best_section_verdict_wins_regardless_of_order():
+    verdicts = [
+        {"status": "Not Covered", "justification": "No se menciona."},
+        {"status": "Covered", "justification": "Se revisa cada año."},
+        {"status": "Partially Covered", "justification": "Solo en parte."},
+    ]
+    merged = merge_section_verdicts(verdicts)
+    assert merged == {"status": "Covered", "justification": "[Sección 2/3] Se revisa cada año."}
+    assert merge_section_verdicts(verdicts[::-1])["status"] == "Covered"
+
+def test_unknown_section_status_counts_as_not_covered():
+    merged = merge_section_verdicts([{"status": "Quizá", "justification": "?"}, {"status": "Not Applicable", "justification": "-"}])
+    assert merged["status"] == "Not Covered"
+
+def test_document_that_fits_is_sent_whole(monkeypatch):
+    monkeypatch.setenv("ANALYSIS_PROMPT_TOKEN_LIMIT", str(1000 + PROMPT_OVERHEAD_TOKENS))
+    text = _document(5)
+    assert plan_document_context(text, TokenCounter()) == {"sections": [text], "error": None}
+
+def test_oversized_document_is_split_with_the_model_token_count(monkeypatch):
+    monkeypatch.setenv("ANALYSIS_PROMPT_TOKEN_LIMIT", str(300 + PROMPT_OVERHEAD_TOKENS))
+    monkeypatch.setenv("ANALYSIS_OVERSIZE_POLICY", "map_reduce")
+    counter = TokenCounter()
+    text = _document(6)
+    plan = plan_document_context(text, counter)
+    assert plan["error"] is None
+    assert len(plan["sections"]) > 1
+    assert all(len(section.split()) <= 300 for section in plan["sections"])
+    # El recuento del documento se guarda en memoria
+    plan_document_context(text, counter)
+    assert counter.calls == 1
+
+def test_oversized_document_is_refused(monkeypatch):
+    monkeypatch.setenv("ANALYSIS_PROMPT_TOKEN_LIMIT", str(300 + PROMPT_OVERHEAD_TOKENS))
+    monkeypatch.setenv("ANALYSIS_OVERSIZE_POLICY", "refuse")
+    plan = plan_document_context(_document(6), TokenCounter())
+    assert plan["sections"] == [] and "ANALYSIS_PROMPT_TOKEN_LIMIT" in plan["error"]
+
+@pytest.mark.parametrize("policy, variant", [("map_reduce", ":sections=5000"), ("warn", ""), ("refuse", "")])
+def test_cache_variant_depends_only_on_configuration(monkeypatch, policy, variant):
+    monkeypatch.setenv("ANALYSIS_PROMPT_TOKEN_LIMIT", "5000")
+    monkeypatch.setenv("ANALYSIS_OVERSIZE_POLICY", policy)
+    assert get_context_cache_variant() == variant
@@ -0,0 +1,73 @@
+import pytest
+
+FILLER = "Los registros de esta sección se conservan y se revisan periódicamente por el responsable. "
+
+def _paragraph(topic: str) -> str:
+    # Cada párrafo ocupa un fragmento propio (más de la mitad del tamaño de fragmento)
+    return f"{topic}. " + FILLER * 7
+
+class CountingEmbeddings:
+    """Envuelve los embeddings del entorno de pruebas y cuenta los textos que se vectorizan."""
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.embedded_texts = 0
+
+    def embed_documents(self, texts: list) -> list:
+        self.embedded_texts += len(texts)
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list:
+        return self.embeddings.embed_query(text)
+
+def _stored_chunk_hashes(doc_id: str) -> set:
+    from services.local_vector_index import load_local_index
+    from services.vector_store_manager import get_chunks_collection, get_vector_backend
+    if get_vector_backend() == "local":
+        return {record["chunk_hash"] for record in load_local_index(doc_id).records}
+    return {chunk["chunk_hash"] for chunk in get_chunks_collection().find({"doc_id": doc_id}, {"chunk_hash": 1})}
+
+@pytest.mark.parametrize("backend", ["local", "atlas"])
+def test_reindexing_deletes_stale_chunks_and_reuses_embeddings(fake_services, monkeypatch, backend):
+    from services import vector_store_manager
+    from services.vector_store_manager import compute_chunk_hash, create_vector_store, split_document
+
+    monkeypatch.setenv("VECTOR_BACKEND", backend)
+    embeddings = CountingEmbeddings(vector_store_manager._embeddings)
+    monkeypatch.setattr(vector_store_manager, "_embeddings", embeddings)
+
+    first = "\n\n".join(_paragraph(topic) for topic in ("Control de acceso", "Copias de seguridad", "Gestión de incidentes"))
+    create_vector_store(first, "politica", version="v1")
+    assert _stored_chunk_hashes("politica") == {compute_chunk_hash(chunk) for chunk in split_document(first)}
+    assert embeddings.embedded_texts == 3
+
+    # Se elimina un párrafo, se modifica otro y se añade uno nuevo
+    second = "\n\n".join(_paragraph(topic) for topic in ("Control de acceso", "Gestión de incidentes revisada", "Cifrado"))
+    embeddings.embedded_texts = 0
+    create_vector_store(second, "politica", version="v2")
+    assert _stored_chunk_hashes("politica") == {compute_chunk_hash(chunk) for chunk in split_document(second)}
+    assert embeddings.embedded_texts == 2
+
+def test_atlas_reindex_only_touches_its_own_document(fake_services, monkeypatch):
+    from services.vector_store_manager import create_vector_store, get_chunks_collection, get_document_version
+
+    monkeypatch.setenv("VECTOR_BACKEND", "atlas")
+    create_vector_store(_paragraph("Control de acceso"), "politica_a", version="a1")
+    create_vector_store(_paragraph("Control de acceso"), "politica_b", version="b1")
+    create_vector_store(_paragraph("Cifrado"), "politica_a", version="a2")
+
+    assert get_document_version("politica_a") == "a2"
+    assert get_document_version("politica_b") == "b1"
+    assert get_chunks_collection().count_documents({"doc_id": "politica_b"}) == 1
+
+def test_retriever_pool_is_keyed_by_tenant_document_and_version(fake_services, monkeypatch):
+    from services.vector_store_manager import get_vector_store_retriever
+
+    monkeypatch.setenv("VECTOR_BACKEND", "local")
+    monkeypatch.setenv("TENANT_ID", "tenant_a")
+    retriever = get_vector_store_retriever("politica", "v1")
+    assert get_vector_store_retriever("politica", "v1") is retriever
+    assert get_vector_store_retriever("politica", "v2") is not retriever
+    assert get_vector_store_retriever("otra_politica", "v1") is not retriever
+    monkeypatch.setenv("TENANT_ID", "tenant_b")
+    assert get_vector_store_retriever("politica", "v1") is not retriever